@@ -0,0 +1,64 @@
+'''
+Array-backed lookup of a histogram template
+
+ArrayTemplate copies the contents (including under- and overflow) and edges of
+a TH1 into numpy arrays once. Lookups use the uniform-bin index computation of
+TAxis::FindFixBin instead of calling FindBin/GetBinContent through PyROOT, and
+can be done for a single x (as a TF1 callback) or for an array of x at once.
+'''
+import numpy as np
+import th1_arrays as th1
+
+class ArrayTemplate(object):
+    '''
+    Drop-in replacement for the python function returned by HistogramToFunction()
+
+    template(x) returns the content of the bin containing x[0]
+    template.evaluate(xs) returns the contents for an array of x values
+    '''
+    def __init__(self, contents, edges):
+        edges = np.array(edges, dtype=float)
+        contents = np.array(contents, dtype=float)
+        nbins = len(edges) - 1
+        if len(contents) == nbins: contents = np.concatenate(([0.], contents, [0.]))
+        if not len(contents) == nbins + 2:
+            raise ValueError('ArrayTemplate: got {} contents for {} bins'.format(len(contents), nbins))
+        self.nbins = nbins
+        self.edges = edges
+        self.contents = contents
+        self.values = contents.tolist()  # plain floats for fast scalar lookups
+        widths = np.diff(edges)
+        self.uniform = bool(np.allclose(widths, widths[0]))
+        self.xmin = float(edges[0])
+        self.xmax = float(edges[-1])
+        self.width = self.xmax - self.xmin
+
+    @classmethod
+    def from_hist(cls, hist):
+        return cls(th1.contents(hist, flow=True).astype(float), th1.edges(hist))
+
+    def find_bin(self, x):
+        '''
+        Same bin numbering as TH1::FindBin: 0 is underflow, nbins+1 is overflow
+        '''
+        if x < self.xmin: return 0
+        if not x < self.xmax: return self.nbins + 1
+        if self.uniform: return 1 + int(self.nbins * (x - self.xmin) / self.width)
+        return int(np.searchsorted(self.edges, x, side='right'))
+
+    def find_bins(self, xs):
+        xs = np.asarray(xs, dtype=float)
+        if self.uniform:
+            with np.errstate(invalid='ignore'):
+                bins = 1 + np.floor(self.nbins * (xs - self.xmin) / self.width).astype(int)
+        else:
+            bins = np.searchsorted(self.edges, xs, side='right')
+        bins[xs < self.xmin] = 0
+        bins[~(xs < self.xmax) & ~(xs < self.xmin)] = self.nbins + 1
+        return bins
+
+    def __call__(self, x):
+        return self.values[self.find_bin(x[0])]
+
+    def evaluate(self, xs):
+        return self.contents[self.find_bins(np.atleast_1d(xs))]
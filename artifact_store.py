@@ -0,0 +1,200 @@
+'''
+Single-file store of the fit artifacts of an input directory
+
+run_scaler, run_fitter and run_plotter used to write and read one ROOT file
+per bin and per kind of output (loose fits, scaled tight data, tight templates,
+degrees, chi2s, polynomials). All of them now go into fit_artifacts.root in
+the input directory, in TDirectories named like the old output directories, so
+an object is found by (category, name):
+
+  store = ArtifactStore('.')
+  store.put(artifacts.LOOSE, [loose_hist])
+  loose_hist = store.get(artifacts.LOOSE, 'iso_asym_barrel_20_40_loose')
+
+Writes take an exclusive lock on fit_artifacts.root.lock so parallel run_fitter
+workers can share the store, and count up the generation in
+fit_artifacts.root.generation; readers reopen the file when the generation (or
+the modification time, size or inode of the file) is not the one they opened. Objects missing from the store are looked up in the
+old per-bin files, so outputs of earlier runs can still be read.
+
+ROOT is only imported when the store is used; UprootArtifacts reads the same
+file with uproot for process_for_BAT.
+'''
+import os
+from contextlib import contextmanager
+import profiling
+try:
+    import fcntl
+except ImportError:  # no locking outside unix
+    fcntl = None
+
+STORE_NAME = 'fit_artifacts.root'
+
+# categories, named after the old output directories
+LOOSE = 'loose_fit_hists'
+SCALED_TIGHT = 'scaled_tight_hists'
+SCALED_PHISLICE = 'scaled_phislice_tight_hists'
+TEMPLATES = 'tight_templates/templates'
+TEMPLATES_NOSCALING = 'tight_templates/templates_noscaling'
+DEGREES = 'tight_templates/degrees'
+CHI2S = 'tight_templates/chi2s'
+POLYS = 'tight_templates/polys'
+
+@contextmanager
+def locked(lock_path, exclusive=True):
+    '''
+    Holds a flock on lock_path, shared or exclusive, for the duration of the with block
+    '''
+    if fcntl is None:
+        yield
+        return
+    with open(lock_path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+class ArtifactStore(object):
+    def __init__(self, directory='.', name=STORE_NAME, legacy=True):
+        '''
+        legacy: fall back to the old per-bin files for objects not in the store
+        '''
+        self.directory = directory
+        self.path = os.path.join(directory, name)
+        self.lock_path = self.path + '.lock'
+        self.generation_path = self.path + '.generation'
+        self.legacy = legacy
+        self._file = None
+        self._version = None
+
+    def _generation(self):
+        try:
+            with open(self.generation_path) as f: return int(f.read() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _bump_generation(self):
+        '''
+        Counts up the generation, call with the exclusive lock held
+        '''
+        tmp = self.generation_path + '.tmp'
+        with open(tmp, 'w') as f: f.write(str(self._generation() + 1))
+        os.rename(tmp, self.generation_path)
+
+    def _reader(self):
+        '''
+        Read handle on the store, reopened when another process has written to it; call with the lock held
+
+        A write is recognized by the generation, and also by the modification
+        time, size and inode of the file, since an mtime alone can miss writes
+        within one tick of a coarse or network file system
+        '''
+        import ROOT
+        stat = os.stat(self.path)
+        version = (self._generation(), stat.st_mtime, stat.st_size, stat.st_ino)
+        if self._file is None or not version == self._version:
+            if self._file is not None: self._file.Close()
+            self._file = ROOT.TFile(self.path, 'READ')
+            self._version = version
+            ROOT.gROOT.cd()  # new histograms must not end up in the read handle
+        return self._file
+
+    def _legacy_path(self, category, name):
+        return os.path.join(self.directory, category, name + '.root')
+
+    def has(self, category, name):
+        if os.path.exists(self.path):
+            with locked(self.lock_path, False):
+                if self._reader().Get(category + '/' + name): return True
+        return self.legacy and os.path.exists(self._legacy_path(category, name))
+
+    @profiling.timed('store_read')
+    def get(self, category, name):
+        '''
+        Returns a copy of the object, owned by python and not attached to any file
+        '''
+        import ROOT
+        obj = None
+        if os.path.exists(self.path):
+            with locked(self.lock_path, False):
+                stored = self._reader().Get(category + '/' + name)
+                if stored: obj = stored.Clone(name)
+        if obj is None and self.legacy and os.path.exists(self._legacy_path(category, name)):
+            legacy_file = ROOT.TFile(self._legacy_path(category, name))
+            stored = legacy_file.Get(name)
+            ROOT.gROOT.cd()
+            if stored: obj = stored.Clone(name)
+            legacy_file.Close()
+        if obj is None: raise KeyError('ArtifactStore: no {} in {}'.format(category + '/' + name, self.path))
+        if hasattr(obj, 'SetDirectory'): obj.SetDirectory(0)
+        ROOT.SetOwnership(obj, True)
+        return obj
+
+    @profiling.timed('store_write')
+    def put(self, category, objects):
+        '''
+        Writes objects into category under their names, replacing older versions
+        '''
+        import ROOT
+        with locked(self.lock_path, True):
+            if self._file is not None:
+                self._file.Close()
+                self._file = None
+            outfile = ROOT.TFile(self.path, 'UPDATE')
+            directory = outfile
+            for part in category.split('/'):
+                if not directory.GetDirectory(part): directory.mkdir(part)
+                directory = directory.GetDirectory(part)
+            directory.cd()
+            for obj in objects: obj.Write(obj.GetName(), ROOT.TObject.kOverwrite)
+            outfile.Close()
+            self._bump_generation()
+            ROOT.gROOT.cd()
+
+    def close(self):
+        if self._file is not None: self._file.Close()
+        self._file = None
+
+class MemoryStore(object):
+    '''
+    Same interface as ArtifactStore on a dict, for run_fitter --stream: nothing is written to disk
+
+    get() returns the stored object itself, not a copy
+    '''
+    def __init__(self):
+        self.objects = {}
+
+    def has(self, category, name):
+        return (category, name) in self.objects
+
+    def get(self, category, name):
+        if (category, name) not in self.objects: raise KeyError('MemoryStore: no {}'.format(category + '/' + name))
+        return self.objects[(category, name)]
+
+    def put(self, category, objects):
+        for obj in objects:
+            if hasattr(obj, 'SetDirectory'): obj.SetDirectory(0)
+            self.objects[(category, obj.GetName())] = obj
+
+    def close(self):
+        pass
+
+class UprootArtifacts(object):
+    '''
+    Read-only access to the store with uproot, falling back to the old per-bin files
+    '''
+    def __init__(self, directory='.', name=STORE_NAME, legacy=True):
+        import uproot
+        self.uproot = uproot
+        self.directory = directory
+        self.legacy = legacy
+        path = os.path.join(directory, name)
+        self.file = uproot.open(path) if os.path.exists(path) else None
+
+    def get(self, category, name):
+        key = category + '/' + name
+        if self.file is not None and key in self.file: return self.file[key]
+        legacy_path = os.path.join(self.directory, category, name + '.root')
+        if self.legacy and os.path.exists(legacy_path): return self.uproot.open(legacy_path)[name]
+        raise KeyError('UprootArtifacts: no {} in {}'.format(key, self.directory))
@@ -0,0 +1,124 @@
+'''
+Cache of polynomial basis matrices
+
+The polynomial part of the tight fit is evaluated by ROOT at the same bin
+centers over and over (every Minuit call, every TemplateToHistogram). Instead of
+recomputing factorials and Chebyshev recurrences for every point, the full basis
+matrix B[i, j] = B_j(center_i) for a given (poly type, degree, bin edges,
+BERN_UPPER_RANGE) is built once and kept in a bounded LRU cache.
+
+poly types follow MultiplyWithPolyToTF1():
+  0 regular polynomials, 1/2 Chebyshev of the first/second kind, 3 Bernstein
+'''
+import math
+from collections import OrderedDict
+import numpy as np
+import constants as VALS
+
+DEFAULT_EDGES = np.linspace(0, 50, 1001)  # binning of the input loose and tight histograms
+MAX_DEGREE = 8
+MAX_ENTRIES = 64
+
+_CACHE = OrderedDict()
+STATS = {'hits': 0, 'misses': 0}
+
+def evaluate_basis(x, degree, poly=0, upper_range=None):
+    '''
+    Returns the matrix of basis polynomials B_j(x), j = 0..degree
+    '''
+    if upper_range is None: upper_range = VALS.BERN_UPPER_RANGE
+    if degree < 0 or degree > MAX_DEGREE or poly not in (0, 1, 2, 3):
+        raise ValueError('Got degree {} for poly type {}. Not Implemented!'.format(degree, poly))
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    basis = np.empty((len(x), degree+1))
+    if poly == 0:
+        for j in range(degree+1): basis[:, j] = x**j
+    elif poly == 1 or poly == 2:
+        basis[:, 0] = 1
+        if degree >= 1: basis[:, 1] = x if poly == 1 else 2*x
+        for j in range(2, degree+1): basis[:, j] = 2*x*basis[:, j-1] - basis[:, j-2]
+    else:
+        x_adj = x / upper_range
+        for j in range(degree+1):
+            comb = float(math.factorial(degree)) / (math.factorial(j) * math.factorial(degree - j))
+            basis[:, j] = comb * x_adj**j * (1 - x_adj)**(degree - j)
+    return basis
+
+class Basis(object):
+    '''
+    Basis matrix at the bin centers of a fixed binning
+    '''
+    def __init__(self, poly, degree, edges, upper_range):
+        self.poly = poly
+        self.degree = degree
+        self.upper_range = upper_range
+        self.edges = np.array(edges, dtype=float)
+        self.centers = (self.edges[1:] + self.edges[:-1]) / 2.0
+        widths = np.diff(self.edges)
+        self.uniform = np.allclose(widths, widths[0])
+        self.low = self.edges[0]
+        self.width = widths[0]
+        self.tolerance = 1e-9 * widths.min()
+        self.matrix = evaluate_basis(self.centers, degree, poly, upper_range)
+        self.matrix.setflags(write=False)
+        self.rows = [tuple(row) for row in self.matrix]  # plain floats for fast scalar access
+
+    def index(self, x):
+        '''
+        Bin index of x if x is one of the bin centers, otherwise None
+        '''
+        if self.uniform: i = int(math.floor((x - self.low) / self.width))
+        else: i = int(np.searchsorted(self.edges, x, side='right')) - 1
+        if i < 0 or i >= len(self.rows): return None
+        if abs(self.centers[i] - x) > self.tolerance: return None
+        return i
+
+    def row(self, x):
+        '''
+        Basis values at x, from the cache when x is a bin center
+        '''
+        i = self.index(x)
+        if i is not None: return self.rows[i]
+        return tuple(evaluate_basis([x], self.degree, self.poly, self.upper_range)[0])
+
+def get_basis(poly, degree, edges=None, upper_range=None):
+    '''
+    Returns the cached Basis for (poly, degree, edges, upper_range), building it if needed
+    '''
+    if edges is None: edges = DEFAULT_EDGES
+    if upper_range is None: upper_range = VALS.BERN_UPPER_RANGE
+    edges = np.asarray(edges, dtype=float)
+    key = (poly, degree, edges.tobytes(), float(upper_range))
+    if key in _CACHE:
+        STATS['hits'] += 1
+        _CACHE[key] = _CACHE.pop(key)  # most recently used goes last
+        return _CACHE[key]
+    STATS['misses'] += 1
+    basis = Basis(poly, degree, edges, upper_range)
+    _CACHE[key] = basis
+    while len(_CACHE) > MAX_ENTRIES: _CACHE.popitem(last=False)
+    return basis
+
+def basis_matrix(poly, degree, edges=None, upper_range=None):
+    '''
+    Returns the read-only matrix B[i, j] = B_j(center_i)
+    '''
+    return get_basis(poly, degree, edges, upper_range).matrix
+
+def make_polynomial(poly, degree, edges=None, upper_range=None):
+    '''
+    Returns a python function polynomial(x, p) = sum_j p[j]*B_j(x[0]) for use in a TF1
+    '''
+    basis = get_basis(poly, degree, edges, upper_range)
+    npar = degree + 1
+    def polynomial(x, p):
+        row = basis.row(x[0])
+        val = 0
+        for j in range(npar): val += p[j]*row[j]
+        return val
+    return polynomial
+
+def clear():
+    _CACHE.clear()
+    STATS['hits'] = 0
+    STATS['misses'] = 0
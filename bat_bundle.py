@@ -0,0 +1,135 @@
+'''
+Per control region input bundles for BAT, written by process_for_BAT
+
+All arrays of a control region are saved together, either as
+
+  npz: bat_input_<region>.npz, one numpy archive
+  npy: bat_input_<region>.npy with every array flattened into one float64
+       array, and bat_input_<region>.json with the offset and shape of each
+       (the .npy can be memory-mapped, the index read from any language)
+
+Arrays, with pt bins along the first axis and phi bins along the second:
+
+  pt_bins, phi_bins            low edges of the bins
+  bin_centers                  (nbins,)
+  pt_spectrum                  (nphi, npt_spectrum) MC pt spectrum of the signal region
+  loose_fit                    (npt, nbins) loose fits
+  tight_data_old               (npt, nbins) scaled tight data, pt binned
+  tight_data_unscaled_old      (npt, nbins) unscaled tight data, pt binned
+  tight_data                   (npt, nphi, nbins) scaled tight data, phi x pt binned
+  tight_data_unscaled          (npt, nphi, nbins) unscaled tight data, phi x pt binned
+  tight_data_unscaled_phiAll   (npt, nbins) unscaled tight data, all phi
+'''
+import os
+import json
+from collections import OrderedDict
+import numpy as np
+import artifact_store as artifacts
+
+BASENAME = 'bat_input_'
+FORMATS = ['npz', 'npy']
+PREFIX_MASS = 'twoprong_masspi0_'
+
+# sources of collect(), besides the artifact store categories
+EGAMMA = 'egamma'  # input histograms of summed_egamma.root
+MC = 'mc'  # histograms of summed_gjets.root, with their plots/ path
+
+def collect(control_region, read, pt_bins, phi_bins):
+    '''
+    Reads all the arrays of a control region in one pass
+
+    read(source, name) returns the (contents, edges) of a histogram, source is
+    EGAMMA, MC, artifacts.LOOSE, artifacts.SCALED_TIGHT or artifacts.SCALED_PHISLICE
+    '''
+    arrays = OrderedDict()
+    arrays['pt_bins'] = np.array(pt_bins)
+    arrays['phi_bins'] = np.array(phi_bins)
+
+    # pt spectrum
+    if 'barrel' in control_region: region_for_pt_spectrum = "iso_sym_barrel"
+    if 'endcap' in control_region: region_for_pt_spectrum = "iso_sym_endcap"
+    pt_spectrum = []
+    for k in range(len(phi_bins)):
+        phi_low = phi_bins[k]
+        phi_high = phi_bins[k+1] if k != len(phi_bins)-1 else "Inf"
+        mc_fraction_hist_name = "plots/twoprong_pt_phi{}-{}_".format(phi_low, phi_high)+region_for_pt_spectrum+"_ptX-X_tight"
+        pt_spectrum.append(read(MC, mc_fraction_hist_name)[0])
+
+    # loose fits and pt-binned tight data
+    loose_fits, tight_old, tight_old_unscaled = [], [], []
+    for i in range(len(pt_bins)):
+        pt_low = pt_bins[i]
+        pt_high = pt_bins[i+1] if i != len(pt_bins)-1 else "Inf"
+
+        tight_hist_name = "{}_{}_{}_tight".format(control_region, pt_low, pt_high).replace("_Inf", "+")
+        loose_hist_name = "{}_{}_{}_loose".format(control_region, pt_low, pt_high).replace("_Inf", "+")
+
+        loose_fit, edges = read(artifacts.LOOSE, loose_hist_name)
+        if i==0: arrays['bin_centers'] = np.array([(edges[j] + edges[j])/2.0 for j in range(len(edges)-1)])
+        loose_fits.append(loose_fit)
+        tight_old.append(read(artifacts.SCALED_TIGHT, tight_hist_name)[0])
+        tight_old_unscaled.append(read(EGAMMA, PREFIX_MASS + tight_hist_name)[0])
+    arrays['pt_spectrum'] = np.array(pt_spectrum)
+    arrays['loose_fit'] = np.array(loose_fits)
+    arrays['tight_data_old'] = np.array(tight_old)
+    arrays['tight_data_unscaled_old'] = np.array(tight_old_unscaled)
+
+    # phi+pt-binned tight data
+    tight, tight_unscaled, tight_unscaled_all = [], [], []
+    for i in range(len(pt_bins)):
+        pt_low = pt_bins[i]
+        pt_high = pt_bins[i+1] if i != len(pt_bins)-1 else "Inf"
+        tight.append([])
+        tight_unscaled.append([])
+        for k in range(len(phi_bins)):
+            phi_low = phi_bins[k]
+            phi_high = phi_bins[k+1] if k != len(phi_bins)-1 else "Inf"
+            name = '{}phi{}-{}_{}_pt{}-{}_tight'.format(PREFIX_MASS, phi_low, phi_high, control_region, pt_low, pt_high)
+            tight[i].append(read(artifacts.SCALED_PHISLICE, name)[0])
+            tight_unscaled[i].append(read(EGAMMA, name)[0])
+        tight_unscaled_all.append(read(EGAMMA, '{}phi{}_{}_pt{}-{}_tight'.format(PREFIX_MASS, 'All', control_region, pt_low, pt_high))[0])
+    arrays['tight_data'] = np.array(tight)
+    arrays['tight_data_unscaled'] = np.array(tight_unscaled)
+    arrays['tight_data_unscaled_phiAll'] = np.array(tight_unscaled_all)
+    return arrays
+
+def paths(directory, control_region, fmt):
+    '''
+    Files of the bundle of control_region
+    '''
+    base = os.path.join(directory, BASENAME + control_region)
+    if fmt == 'npz': return [base + '.npz']
+    return [base + '.npy', base + '.json']
+
+def save(directory, control_region, arrays, fmt='npz'):
+    '''
+    Writes arrays, a dict of name -> array, as the bundle of control_region
+    '''
+    if fmt == 'npz':
+        np.savez(paths(directory, control_region, fmt)[0], **arrays)
+        return
+    data_path, index_path = paths(directory, control_region, fmt)
+    index = OrderedDict()
+    offset = 0
+    for name, array in arrays.items():
+        index[name] = {'offset': offset, 'shape': list(np.shape(array))}
+        offset += int(np.size(array))
+    data = np.concatenate([np.ravel(np.asarray(array, dtype=float)) for array in arrays.values()])
+    np.save(data_path, data)
+    with open(index_path, 'w') as f: json.dump(index, f, indent=1)
+
+def load(directory, control_region, fmt='npz'):
+    '''
+    Returns an OrderedDict of name -> array, memory-mapped views for npy bundles
+    '''
+    if fmt == 'npz':
+        with np.load(paths(directory, control_region, fmt)[0]) as bundle:
+            return OrderedDict((name, bundle[name]) for name in bundle.files)
+    data_path, index_path = paths(directory, control_region, fmt)
+    with open(index_path) as f: index = json.load(f, object_pairs_hook=OrderedDict)
+    data = np.load(data_path, mmap_mode='r')
+    arrays = OrderedDict()
+    for name, info in index.items():
+        size = int(np.prod(info['shape']))
+        arrays[name] = data[info['offset']:info['offset'] + size].reshape(info['shape'])
+    return arrays
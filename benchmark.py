@@ -0,0 +1,192 @@
+'''
+Benchmarks of the fitting steps and of the scripts, on synthetic input
+
+The input is written by synthetic_input.py into --dir (once, or again with
+--regenerate). Then
+
+  micro    fit_hist (landau and exp, both backends), template times polynomial
+           fits (MultiplyWithPolyToTF1 and hist.Fit, degrees 0-3), removeEntries
+           and TemplateToHistogram on one bin (--bin), best of --repeat runs
+  scripts  run_scaler, run_fitter, run_plotter and process_for_BAT end to end,
+           one run each, with every cache that would skip work turned off
+
+are timed and compared with the baseline (benchmark_baseline.json next to this
+file). A result slower than the baseline by more than --tolerance (and by more
+than --minDelta seconds) is flagged and the exit code is 1. --saveBaseline
+stores the results as the new baseline; only compare runs made with the same
+settings on the same machine.
+
+  python benchmark.py --saveBaseline
+  python benchmark.py --only micro
+'''
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+from collections import OrderedDict
+import synthetic_input
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'benchmark_baseline.json')
+SCRIPTS = ['run_scaler.py', 'run_fitter.py', 'run_plotter.py', 'process_for_BAT.py']
+# options that turn off the caches, so every run does the full work
+SCRIPT_ARGS = {
+    'run_scaler.py': [],
+    'run_fitter.py': ['--createLooseFits', '--noLooseCache', '--noParamStore'],
+    'run_plotter.py': ['--noPageCache'],
+    'process_for_BAT.py': [],
+}
+
+def best_of(func, repeat):
+    '''
+    Smallest wall time of repeat calls of func
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+def fit_ranges(hist, cutoff=1000):
+    '''
+    (first, left, right, last) x ranges of the rising and falling fits, chosen like run_fitter does
+    '''
+    nbins = hist.GetNbinsX()
+    above = [b+1 for b in range(nbins) if hist.GetBinContent(b+1) >= cutoff]
+    filled = [b+1 for b in range(nbins) if hist.GetBinContent(b+1) > 0]
+    left_bin = above[0] if above else 0
+    right_bin = above[-1] if above else nbins+1
+    last_bin = filled[-1] if filled else nbins+1
+    return hist.GetBinLowEdge(4), hist.GetBinLowEdge(left_bin+1), hist.GetBinLowEdge(right_bin), hist.GetBinLowEdge(last_bin+1)
+
+def micro_benchmarks(directory, test_bin, repeat):
+    import ROOT
+    import hist_cache
+    import fitting_utils as util
+    import degree_scan as degscan
+    ROOT.gROOT.SetBatch(True)
+    region, eta_reg, pt = test_bin
+    cache = hist_cache.HistCache(directory, verbose=False)
+    loose = cache.to_hist(cache.find(region, eta_reg, pt, None, 'loose'))
+    tight = cache.to_hist(cache.find(region, eta_reg, pt, None, 'tight'))
+    tight.SetBinErrorOption(ROOT.TH1.kPoisson)
+    signal = cache.to_hist(cache.find('iso_sym', eta_reg, pt, None, 'tight'))
+    first, left, right, last = fit_ranges(loose)
+
+    results = OrderedDict()
+    for backend in ['root', 'numpy']:
+        results['fit_hist/landau/' + backend] = best_of(lambda: util.fit_hist(loose, 'landau', first, left, N=1, backend=backend), repeat)
+        results['fit_hist/exp/' + backend] = best_of(lambda: util.fit_hist(loose, 'exp', right, last, N=1, backend=backend), repeat)
+    func, _ = util.fit_hist(loose, 'landau', first, left, N=1)
+    results['TemplateToHistogram'] = best_of(lambda: util.TemplateToHistogram(func, 1000, 0, 50), repeat)
+    results['TemplateToHistogram/integral'] = best_of(lambda: util.TemplateToHistogram(func, 1000, 0, 50, integral=True), repeat)
+    template = util.HistogramToFunction(loose)
+    for degree in range(4):
+        results['poly_fit/bernstein{}'.format(degree)] = best_of(lambda: degscan.fit_degree(tight, template, degree, poly=3, solver='minuit'), repeat)
+    def remove():
+        hist = tight.Clone()
+        util.removeEntries(hist, signal.Integral(), rand=ROOT.TRandom3(1))
+    results['removeEntries'] = best_of(remove, repeat)
+    return results
+
+def script_benchmarks(directory, test_bin, scripts):
+    '''
+    Wall time of each script run as a separate process, None if it failed
+    '''
+    results = OrderedDict()
+    for script in scripts:
+        command = [sys.executable, os.path.join(HERE, script), directory] + SCRIPT_ARGS[script]
+        if test_bin is not None and not script == 'process_for_BAT.py': command += ['--testBin', ' '.join(str(v) for v in test_bin)]
+        log_path = os.path.join(directory, 'benchmark_' + script.replace('.py', '.log'))
+        start = time.time()
+        with open(log_path, 'w') as log: code = subprocess.call(command, cwd=HERE, stdout=log, stderr=subprocess.STDOUT)
+        seconds = time.time() - start
+        if not code == 0:
+            print('{} failed with exit code {}, see {}'.format(script, code, log_path))
+            results['script/' + script] = None
+            break  # the later scripts need its outputs
+        results['script/' + script] = seconds
+    return results
+
+def compare(results, baseline, tolerance, min_delta):
+    '''
+    Prints the results next to the baseline, returns the names of the slowdowns
+    '''
+    slower = []
+    print('{:<34} {:>10} {:>10} {:>8}'.format('benchmark', 'seconds', 'baseline', 'ratio'))
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if seconds is None:
+            print('{:<34} {:>10}'.format(name, 'failed'))
+            continue
+        if base is None:
+            print('{:<34} {:10.4f} {:>10}'.format(name, seconds, '-'))
+            continue
+        ratio = seconds / base if base > 0 else float('inf')
+        flag = ratio > 1 + tolerance and seconds - base > min_delta
+        if flag: slower.append(name)
+        print('{:<34} {:10.4f} {:10.4f} {:7.2f}x{}'.format(name, seconds, base, ratio, '  SLOWER' if flag else ''))
+    return slower
+
+def machine():
+    return OrderedDict([('node', platform.node()), ('machine', platform.machine()), ('python', platform.python_version())])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time the fits and scripts on synthetic input and compare with the baseline")
+    parser.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "bkgfit_benchmark"), help="directory of the synthetic input and of the script outputs")
+    parser.add_argument("--regenerate", default=False, action="store_true", help="write the synthetic input again")
+    parser.add_argument("--entries", default=1e6, type=float, help="statistics of the synthetic input, see synthetic_input.py")
+    parser.add_argument("--seed", default=1, type=int, help="seed of the synthetic input")
+    parser.add_argument("--only", default=None, choices=["micro", "scripts"], help="run only one group of benchmarks")
+    parser.add_argument("--bin", default="noniso_sym barrel 100", help="bin of the micro benchmarks, format: '<region> <eta> <pt low edge>'")
+    parser.add_argument("--testBin", default=None, help="run the scripts on this bin only (process_for_BAT is skipped), same format as --bin")
+    parser.add_argument("--repeat", default=3, type=int, help="runs of each micro benchmark, the fastest counts")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline json file")
+    parser.add_argument("--saveBaseline", default=False, action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", default=0.25, type=float, help="flag results slower than the baseline by more than this fraction")
+    parser.add_argument("--minDelta", default=0.05, type=float, help="and by more than this many seconds")
+    parser.add_argument("--output", default=None, help="also write the results to this json file")
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.dir)
+    settings = OrderedDict([('entries', args.entries), ('seed', args.seed), ('bin', args.bin), ('testBin', args.testBin), ('repeat', args.repeat)])
+    settings_path = os.path.join(directory, 'benchmark_input.json')
+    if args.regenerate or not os.path.exists(os.path.join(directory, 'summed_egamma.root')):
+        if os.path.exists(directory): shutil.rmtree(directory)
+        print('writing synthetic input to', directory)
+        synthetic_input.generate(directory, args.entries, seed=args.seed)
+        with open(settings_path, 'w') as f: json.dump({'entries': args.entries, 'seed': args.seed}, f)
+    with open(settings_path) as f: written = json.load(f)
+    if not (written['entries'] == args.entries and written['seed'] == args.seed):
+        parser.error('{} was made with --entries {} --seed {}, add --regenerate'.format(directory, written['entries'], written['seed']))
+
+    parse_bin = lambda text: (text.split()[0], text.split()[1], int(text.split()[2]))
+    results = OrderedDict()
+    if not args.only == 'scripts': results.update(micro_benchmarks(directory, parse_bin(args.bin), args.repeat))
+    if not args.only == 'micro':
+        test_bin = parse_bin(args.testBin) if args.testBin else None
+        scripts = [script for script in SCRIPTS if test_bin is None or not script == 'process_for_BAT.py']
+        results.update(script_benchmarks(directory, test_bin, scripts))
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f: stored = json.load(f)
+        if not stored['settings'] == settings: print('baseline was made with other settings: {}'.format(stored['settings']))
+        else: baseline = stored['results']
+    slower = compare(results, baseline, args.tolerance, args.minDelta)
+    report = OrderedDict([('settings', settings), ('machine', machine()), ('created', time.strftime('%Y-%m-%d %H:%M:%S')), ('results', results)])
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=1)
+    if args.saveBaseline:
+        with open(args.baseline, 'w') as f: json.dump(report, f, indent=1)
+        print('saved baseline', args.baseline)
+    elif slower:
+        print('slower than the baseline: ' + ', '.join(slower))
+        sys.exit(1)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+'''
+One entry point for the scripts of the chain, run in a single interpreter
+
+  python bkgfit.py scale <dir_name> [run_scaler.py options]
+  python bkgfit.py fit <dir_name> [run_fitter.py options]
+  python bkgfit.py plot <dir_name> [run_plotter.py options]
+  python bkgfit.py export <dir_name> [process_for_BAT.py options]
+
+Stages are chained with a lone '+', and 'all <dir_name>' runs the four stages
+with their default options:
+
+  python bkgfit.py scale <dir_name> + fit <dir_name> --jobs 4 --noPlots + plot <dir_name> --jobs 4
+
+The stages run one after the other in this process, each script as if it was
+started on its own (runpy, with sys.argv set to its options), so ROOT, scipy,
+the fitting modules and the histogram cache of summed_egamma.root
+(hist_cache.shared()) are loaded once for the whole chain. This file imports
+none of them and the scripts import them only after parsing their options, so
+--help and option errors return right away. The chain stops at the first stage
+that fails, with its exit code.
+'''
+from __future__ import print_function
+import os
+import sys
+import time
+import runpy
+from collections import OrderedDict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STAGES = OrderedDict([
+    ('scale', 'run_scaler.py'),
+    ('fit', 'run_fitter.py'),
+    ('plot', 'run_plotter.py'),
+    ('export', 'process_for_BAT.py'),
+])
+SEPARATOR = '+'
+USAGE = '''usage: bkgfit.py <stage> <dir_name> [options] [+ <stage> <dir_name> [options] ...]
+       bkgfit.py all <dir_name>
+
+stages:
+{}
+  all     scale, fit, plot and export <dir_name> with the default options
+
+bkgfit.py <stage> --help lists the options of a stage'''.format(
+    '\n'.join('  {:<7} {}'.format(stage, script) for stage, script in STAGES.items()))
+
+def split_commands(argv):
+    '''
+    [[stage, arg, ...], ...] of a command line with the stages separated by SEPARATOR
+    '''
+    commands = [[]]
+    for arg in argv:
+        if arg == SEPARATOR: commands.append([])
+        else: commands[-1].append(arg)
+    return commands
+
+def expand(commands):
+    '''
+    Replaces 'all <dir_name>' by the four stages, None if a command is not a stage
+    '''
+    expanded = []
+    for command in commands:
+        if len(command) == 2 and command[0] == 'all': expanded += [[stage, command[1]] for stage in STAGES]
+        elif command and command[0] in STAGES: expanded.append(command)
+        else: return None
+    return expanded
+
+def exit_code(code):
+    '''
+    Exit code of a SystemExit code (None, a number or a message)
+    '''
+    if code is None: return 0
+    if isinstance(code, int): return code
+    print(code, file=sys.stderr)
+    return 1
+
+def run_stage(stage, args):
+    '''
+    Runs the script of stage with the options args in this interpreter, returns its exit code
+    '''
+    script = os.path.join(HERE, STAGES[stage])
+    argv, cwd = sys.argv, os.getcwd()
+    sys.argv = [script] + list(args)
+    try:
+        runpy.run_path(script, run_name='__main__')
+        code = 0
+    except SystemExit as e:
+        code = exit_code(e.code)
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)  # the scripts change to their input directory
+    return code
+
+def main(argv):
+    if not argv or argv[0] in ['-h', '--help']:
+        print(USAGE)
+        return 0 if argv else 2
+    commands = expand(split_commands(argv))
+    if commands is None:
+        print(USAGE, file=sys.stderr)
+        return 2
+    for command in commands:
+        start = time.time()
+        code = run_stage(command[0], command[1:])
+        if not code == 0:
+            print('bkgfit: {} failed with exit code {}'.format(command[0], code), file=sys.stderr)
+            return code
+        if len(commands) > 1: print('bkgfit: {} done in {:.1f}s'.format(command[0], time.time() - start))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
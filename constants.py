@@ -1,3 +1,4 @@
 BERN_UPPER_RANGE = 25
 PT_EDGES = [20,40,60,80,100,140,180,220,300,380]
 PHI_EDGES = [0, 500, 1000, 1500, 2000]
+SCALE_SEED = 12445  # seed of the downsampling in run_scaler
@@ -0,0 +1,90 @@
+'''
+Nested degree scan for the tight fit F-test
+
+The template times polynomial fits for degrees 0..max_degree are done in order,
+each one started from the previous solution written in the next degree. Raising
+the degree of a polynomial is exact: for Bernstein polynomials by degree
+elevation, for the other bases by adding a zero coefficient. Optionally the
+scan stops as soon as the sequential F-test fails.
+'''
+import fitting_utils as util
+import linear_fitting as linfit
+import fit_statistics as fstats
+import th1_arrays as th1
+import profiling
+
+def elevate(coeffs, poly=0):
+    '''
+    Returns the coefficients of the same polynomial expressed with degree+1
+    '''
+    coeffs = list(coeffs)
+    if not poly == 3: return coeffs + [0.0]
+    n = len(coeffs) - 1
+    elevated = [coeffs[0]]
+    for i in range(1, n+1):
+        elevated.append(float(i)/(n+1) * coeffs[i-1] + (1 - float(i)/(n+1)) * coeffs[i])
+    elevated.append(coeffs[n])
+    return elevated
+
+def fit_degree(hist, func, degree, poly=0, parameters=None, solver='minuit', integral=False):
+    '''
+    Fit hist with func times a polynomial of the given degree
+
+    Returns the TF1 and the fit result
+    '''
+    if solver == 'minuit':
+        tf1, _, _ = util.MultiplyWithPolyToTF1(func, degree, poly=poly, parameters=parameters)
+        result = hist.Fit(tf1, '0SL' if not integral else '0SLI')
+    else:
+        tf1, result = linfit.fit_template_poly(hist, func, degree, poly=poly, integral=integral, method=solver)
+    profiling.count_fit('tight_fit_calls', result)
+    return tf1, result
+
+def select_degree(table, ndegrees):
+    '''
+    Sequential F-test: each degree is compared to the best degree so far
+
+    Returns the best degree and the list of (d2, d1, decision) comparisons made
+    '''
+    best = 0
+    tested = []
+    for d2 in range(ndegrees):
+        for d1 in range(d2):
+            if not d1 == best: continue
+            decision = bool(table['decision'][d2][d1])
+            tested.append((d2, d1, decision))
+            if decision: best = d2
+    return best, tested
+
+def scan_degrees(hist, func, max_degree, poly=0, solver='minuit', integral=False, warm_start=True,
+                 early_stop=False, sig=0.1, callback=None):
+    '''
+    Fit degrees 0..max_degree and run the F-test on them
+
+    warm_start: start each degree from the elevated previous solution
+    early_stop: stop fitting once a degree fails the F-test against the best so far
+    callback:   called as callback(degree, tf1, result) after every fit
+
+    Returns the list of TF1s, the list of fit results, the F-test table (see
+    fit_statistics.ftest_table), the best degree and the comparisons made
+    '''
+    data, err_low, err_up = fstats.hist_poisson_arrays(hist)
+    edges = th1.edges(hist)
+    fitfuncs, fitresults, models = [], [], []
+    parameters = None
+    best = 0
+    for degree in range(max_degree+1):
+        tf1, result = fit_degree(hist, func, degree, poly, parameters if warm_start else None, solver, integral)
+        fitfuncs.append(tf1)
+        fitresults.append(result)
+        params = [tf1.GetParameter(i) for i in range(tf1.GetNpar())]
+        models.append(fstats.template_poly_values(func, params, edges, poly, integral=integral))
+        if callback: callback(degree, tf1, result)
+        if early_stop and degree > 0:
+            table = fstats.ftest_table(data, err_low, err_up, models, [f.GetNpar() for f in fitfuncs], sig=sig)
+            if not table['decision'][degree][best]: break
+            best = degree
+        parameters = elevate(params, poly)
+    table = fstats.ftest_table(data, err_low, err_up, models, [f.GetNpar() for f in fitfuncs], sig=sig)
+    best, tested = select_degree(table, len(fitfuncs))
+    return fitfuncs, fitresults, table, best, tested
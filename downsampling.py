@@ -0,0 +1,75 @@
+'''
+Batched downsampling of histograms for run_scaler
+
+Vectorized version of fitting_utils.removeEntries(): every bin of a histogram
+is thinned with one numpy binomial draw (or a Gaussian approximation for bins
+above cutoff) instead of one TRandom3 call per bin through PyROOT.
+
+Random numbers come from counter-based Philox streams keyed by the histogram
+name and the seed, so the result for a histogram doesn't depend on the order
+histograms are processed in or on how they are split across processes. numpy
+before 1.17 (the last numpy for python 2.7 is 1.16) has no Philox, there the
+stream is a RandomState seeded with the same key: results are still
+independent of the order, but differ from the ones of newer numpy.
+'''
+import hashlib
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+
+MASK64 = (1 << 64) - 1
+
+def stream(name, seed):
+    '''
+    Random generator for the histogram called name
+
+    The key is the seed (taken modulo 2**64, so negative seeds work too) and 64
+    bits of the md5 of name
+    '''
+    digest = int(hashlib.md5(name.encode('utf-8')).hexdigest()[:16], 16)
+    key = ((int(seed) & MASK64) << 64) | digest
+    if hasattr(np.random, 'Philox'): return np.random.Generator(np.random.Philox(key=key))
+    return np.random.RandomState([(key >> shift) & 0xFFFFFFFF for shift in (0, 32, 64, 96)])
+
+def downsample(counts, target_integral, rng, cutoff=1e6):
+    '''
+    Returns counts with entries removed at random so the integral is about target_integral
+
+    Same as removeEntries(): bins below cutoff are binomially thinned, larger
+    bins use the Gaussian approximation, and counts are returned unchanged if
+    they are empty or already below the target
+    '''
+    counts = np.asarray(counts, dtype=float)
+    total = counts.sum()
+    if total == 0: return counts.copy()
+    p = float(target_integral) / total  # probability of keeping an entry
+    if p >= 1: return counts.copy()
+    N = np.round(counts)
+    small = N < cutoff
+    scaled = np.empty_like(N)
+    scaled[small] = rng.binomial(N[small].astype(np.int64), p)
+    if not np.all(small):
+        content = rng.normal(N[~small]*p, (N[~small]*p*(1-p))**0.5)
+        scaled[~small] = np.round(np.maximum(content, 0))
+    return scaled
+
+def _downsample_task(task):
+    name, counts, target_integral, seed, cutoff = task
+    return name, downsample(counts, target_integral, stream(name, seed), cutoff)
+
+def downsample_many(items, seed, processes=1, cutoff=1e6):
+    '''
+    Downsample a list of (name, counts, target integral), spread over processes
+
+    Returns an OrderedDict of name -> downsampled counts, in the order of items
+    '''
+    tasks = [(name, counts, target, seed, cutoff) for name, counts, target in items]
+    if processes > 1 and len(tasks) > 1:
+        if hasattr(multiprocessing, 'get_context'): pool = multiprocessing.get_context('fork').Pool(processes)
+        else: pool = multiprocessing.Pool(processes)
+        results = pool.map(_downsample_task, tasks, chunksize=max(1, len(tasks) // (4*processes)))
+        pool.close()
+        pool.join()
+    else:
+        results = [_downsample_task(task) for task in tasks]
+    return OrderedDict(results)
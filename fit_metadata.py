@@ -0,0 +1,119 @@
+'''
+Per-bin scalar results of run_fitter
+
+The chosen degree and the chi2 of each bin used to be saved as histograms with
+every bin set to the same value. They are now records with one entry per bin:
+
+  key        bin name, e.g. iso_asym_barrel_20_40
+  degree     polynomial degree picked for the tight fit
+  chi2       modified chi2 of the tight fit (bins with fit >= 5)
+  ndof       its degrees of freedom
+  chi2_ndof  chi2 / ndof
+  pvalue     chi2 p-value, -1 if there were no bins
+  bin_error  bin-by-bin error
+  status     fit status of the tight fit (0 is success), edm its distance to minimum
+  time_loose, time_tight, time_total: seconds spent on the bin
+
+All records are written at once as the TTree fit_metadata in the artifact store
+and read back with a single call to load().
+'''
+import array
+from collections import OrderedDict
+import artifact_store as artifacts
+
+TREE_NAME = 'fit_metadata'
+CATEGORY = 'metadata'
+KEY_LENGTH = 64
+FIELDS = [
+    ('degree', 'I'),
+    ('chi2', 'D'),
+    ('ndof', 'I'),
+    ('chi2_ndof', 'D'),
+    ('pvalue', 'D'),
+    ('bin_error', 'D'),
+    ('status', 'I'),
+    ('edm', 'D'),
+    ('time_loose', 'D'),
+    ('time_tight', 'D'),
+    ('time_total', 'D'),
+]
+
+def make_record(key, **values):
+    '''
+    Record for bin key, fields not given are -1
+    '''
+    record = OrderedDict([('key', key)])
+    for field, _ in FIELDS: record[field] = values.pop(field, -1)
+    if values: raise ValueError('make_record(): unknown fields ' + ', '.join(sorted(values)))
+    return record
+
+def to_tree(records):
+    '''
+    Returns an in-memory TTree with one entry per record
+    '''
+    import ROOT
+    ROOT.gROOT.cd()
+    tree = ROOT.TTree(TREE_NAME, 'per-bin fit results')
+    key = array.array('b', bytearray(KEY_LENGTH))
+    tree.Branch('key', key, 'key/C')
+    buffers = {}
+    for field, code in FIELDS:
+        buffers[field] = array.array('i' if code == 'I' else 'd', [0])
+        tree.Branch(field, buffers[field], field + '/' + code)
+    for record in records:
+        encoded = bytearray(record['key'].encode('ascii'))[:KEY_LENGTH-1]
+        for n in range(KEY_LENGTH): key[n] = encoded[n] if n < len(encoded) else 0
+        for field, code in FIELDS:
+            buffers[field][0] = int(record[field]) if code == 'I' else float(record[field])
+        tree.Fill()
+    return tree
+
+def from_tree(tree):
+    records = OrderedDict()
+    for entry in tree:
+        key = str(entry.key)
+        records[key] = make_record(key, **dict((field, getattr(entry, field)) for field, _ in FIELDS))
+    return records
+
+def load(store):
+    '''
+    Returns an OrderedDict of bin key -> record, empty if nothing was saved yet
+    '''
+    if not store.has(CATEGORY, TREE_NAME): return OrderedDict()
+    return from_tree(store.get(CATEGORY, TREE_NAME))
+
+def save(store, records):
+    '''
+    Adds records to the ones in store, replacing records of the same bins, and writes them in one go
+    '''
+    # held from load to put, so runs on different bins don't drop each other's records
+    with artifacts.locked(store.path + '.metadata.lock'):
+        merged = load(store)
+        for record in records: merged[record['key']] = record
+        store.put(CATEGORY, [to_tree(list(merged.values()))])
+    return merged
+
+def load_uproot(directory='.'):
+    '''
+    Same as load(), with uproot (for scripts that run without ROOT)
+    '''
+    try:
+        tree = artifacts.UprootArtifacts(directory, legacy=False).get(CATEGORY, TREE_NAME)
+    except KeyError:
+        return OrderedDict()
+    columns = tree.arrays(['key'] + [field for field, _ in FIELDS], library='np')
+    records = OrderedDict()
+    for n in range(len(columns['key'])):
+        key = columns['key'][n]
+        if isinstance(key, bytes): key = key.decode('ascii')
+        records[key] = make_record(key, **dict((field, columns[field][n].item()) for field, _ in FIELDS))
+    return records
+
+def fit_status(fit_result):
+    '''
+    (status, edm) of a TFitResultPtr or vectorized_fitting.FitResult, (-1, -1) if there is none
+    '''
+    try:
+        return int(fit_result.Status()), float(fit_result.Edm())
+    except (AttributeError, ReferenceError):
+        return -1, -1
@@ -0,0 +1,221 @@
+'''
+Array versions of the fit statistics in fitting_utils
+
+Data, asymmetric Poisson errors and model values are computed as numpy arrays
+from the histogram contents and the fit parameters, so quantities that are
+recomputed many times (like the chi2 in the bin-by-bin error scan or the F-test
+over the candidate degrees) don't go back through PyROOT for every bin.
+'''
+import numpy as np
+import th1_arrays as th1
+import basis_cache
+
+POISSON_ALPHA = 1 - 0.682689492  # coverage of the TH1.kPoisson intervals
+# points and weights used to average the model over a bin, as vectorized_fitting
+GAUSS_POINTS, GAUSS_WEIGHTS = np.polynomial.legendre.leggauss(5)
+_CHECKED = []  # histogram error options already checked against the TH1
+
+def poisson_errors(data, alpha=POISSON_ALPHA):
+    '''
+    Low and up errors of TH1.kPoisson for an array of bin contents, with the
+    gamma quantiles of TH1::GetBinErrorLow/Up (the low error of an empty bin is 0)
+    '''
+    from scipy.special import gammaincinv, gammainccinv
+    n = np.floor(data)  # int(content) in TH1
+    low = np.where(n > 0, data - gammaincinv(np.maximum(n, 1), alpha/2), 0.0)
+    up = gammainccinv(n + 1, alpha/2) - data
+    return low, up
+
+def check_errors(hist, err_low, err_up, rtol=1e-6):
+    '''
+    Compares err_low and err_up with GetBinErrorLow/Up of every bin of hist
+    '''
+    nbins = hist.GetNbinsX()
+    root_low = np.array([hist.GetBinErrorLow(i+1) for i in range(nbins)])
+    root_up = np.array([hist.GetBinErrorUp(i+1) for i in range(nbins)])
+    if not (np.allclose(err_low, root_low, rtol=rtol, atol=0) and np.allclose(err_up, root_up, rtol=rtol, atol=0)):
+        raise ValueError('hist_poisson_arrays(): Poisson errors differ from the TH1 errors of '+hist.GetName())
+
+def hist_poisson_arrays(hist):
+    '''
+    Returns contents, low errors and up errors of the bins of a TH1 as numpy arrays
+    (the errors are Poisson intervals if hist uses TH1.kPoisson)
+
+    The Poisson intervals are computed from the contents in one step; the first
+    histogram of each process is also checked against the TH1 bin by bin.
+    '''
+    data = th1.contents(hist).astype(float)
+    option = hist.GetBinErrorOption()
+    if option == 1:  # TH1::kPoisson
+        err_low, err_up = poisson_errors(data)
+    elif option == 0:  # TH1::kNormal
+        err_low = err_up = th1.errors(hist)
+    else:
+        nbins = hist.GetNbinsX()
+        err_low = np.array([hist.GetBinErrorLow(i+1) for i in range(nbins)])
+        err_up = np.array([hist.GetBinErrorUp(i+1) for i in range(nbins)])
+    if option not in _CHECKED:
+        check_errors(hist, err_low, err_up)
+        _CHECKED.append(option)
+    return data, err_low, err_up
+
+def template_poly_values(template, params, edges, poly=0, integral=False):
+    '''
+    Returns template times the polynomial with coefficients params (the model of
+    MultiplyWithPolyToTF1()) at the bin centers of edges, or averaged over each
+    bin if integral=True, without going through the TF1
+
+    template: ArrayTemplate, e.g. from HistogramToFunction()
+    '''
+    params = np.asarray(params, dtype=float)
+    degree = len(params) - 1
+    edges = np.asarray(edges, dtype=float)
+    if not integral:
+        centers = (edges[1:] + edges[:-1]) / 2.0
+        return template.evaluate(centers) * basis_cache.basis_matrix(poly, degree, edges).dot(params)
+    lows, widths = edges[:-1], np.diff(edges)
+    x = (lows[:, None] + widths[:, None] * (GAUSS_POINTS[None, :] + 1)/2.0).ravel()
+    vals = template.evaluate(x) * basis_cache.evaluate_basis(x, degree, poly).dot(params)
+    return vals.reshape(len(lows), len(GAUSS_POINTS)).dot(GAUSS_WEIGHTS) / 2.0
+
+def fit_values(func, hist, integral=False):
+    '''
+    Returns the TF1 func evaluated at the bin centers of hist, or averaged over
+    each bin if integral=True, as in RSS()
+
+    This calls func for every bin; for the template times polynomial fits use
+    template_poly_values()
+    '''
+    nbins = hist.GetNbinsX()
+    if not integral: return np.array([func.Eval(hist.GetBinCenter(i+1)) for i in range(nbins)])
+    vals = np.empty(nbins)
+    for i in range(nbins):
+        low, width = hist.GetBinLowEdge(i+1), hist.GetBinWidth(i+1)
+        vals[i] = func.Integral(low, low + width) / width
+    return vals
+
+def chi2_terms(data, model, err_low, err_up, error=0):
+    '''
+    Per-bin contributions to the chi2 of RSS(chi2=True): the residual is
+    reduced by a relative model uncertainty "error", and divided by the low or
+    up Poisson error depending on the side of the data the model is on
+    '''
+    if error == 0: sr = (data - model)**2
+    else: sr = np.maximum(np.abs(data - model) - np.abs(model * error), 0)**2
+    sigma = np.where(data > model, err_low, err_up)
+    sigma = np.where(data == 0, err_up, sigma)
+    return sr / sigma**2
+
+def chi2(data, model, err_low, err_up, error=0):
+    return np.sum(chi2_terms(data, model, err_low, err_up, error))
+
+def solve_bin_error(data, model, err_low, err_up, ndof, tol=1e-4, stepped=False, step=0.005, max_error=10.0):
+    '''
+    Smallest relative model uncertainty ("bin-by-bin error") for which chi2/ndof <= 1
+
+    By default the crossing is found with Brent's method to a precision of tol.
+    stepped=True reproduces the old scan, increasing the error in steps of
+    step until chi2/ndof <= 1.
+
+    Returns the error and the chi2/ndof at that error
+    '''
+    def chi2_ndof(error):
+        return chi2(data, model, err_low, err_up, error) / ndof
+
+    error = 0.0
+    value = chi2_ndof(error)
+    if value <= 1.0: return error, value
+
+    if stepped:
+        while value > 1.0 and error < max_error:
+            error += step
+            value = chi2_ndof(error)
+        return error, value
+
+    # chi2 only decreases with the error, so double until the crossing is bracketed
+    high = step
+    while chi2_ndof(high) > 1.0 and high < max_error: high *= 2
+    if chi2_ndof(high) > 1.0:  # bins with no model but data keep chi2 from ever reaching ndof
+        return high, chi2_ndof(high)
+    from scipy.optimize import brentq
+    error = brentq(lambda e: chi2_ndof(e) - 1.0, 0.0, high, xtol=tol)
+    if chi2_ndof(error) > 1.0: error = min(error + tol, high)
+    return error, chi2_ndof(error)
+
+def rss(data, model, err_low=None, err_up=None, lows=None, bound=-1, error=0, chi2=False, cutoff=None):
+    '''
+    Array version of RSS(): sum of squared residuals over the bins with low
+    edge >= bound and model >= cutoff, divided by the Poisson errors if chi2=True
+
+    Returns the sum and a dict of by-bin arrays for the bins that were used
+    '''
+    used = np.ones(len(data), dtype=bool)
+    if lows is not None: used &= lows >= bound
+    if cutoff: used &= model >= cutoff
+    d, m = data[used], model[used]
+    if error == 0: sr = (d - m)**2
+    else: sr = np.maximum(np.abs(d - m) - np.abs(m * error), 0)**2
+    if chi2:
+        sigma = np.where(d > m, err_low[used], err_up[used])
+        sigma = np.where(d == 0, err_up[used], sigma)
+        sr_sigma = sr / sigma**2
+    else:
+        sigma = np.ones_like(sr)
+        sr_sigma = sr
+    by_bin = {
+        'index': np.nonzero(used)[0],
+        'low_edge': lows[used] if lows is not None else None,
+        'data': d,
+        'model': m,
+        'sr_sigma': sr_sigma,
+        'sr': sr,
+        'sigma': sigma,
+    }
+    return np.sum(sr_sigma), by_bin
+
+def count_nonzero(data, lows=None, bound=-1):
+    '''
+    Array version of count_nonzero_bins()
+    '''
+    used = data != 0
+    if lows is not None: used &= lows >= bound
+    return int(np.count_nonzero(used))
+
+def ftest_table(data, err_low, err_up, models, npars, sig=0.1):
+    '''
+    F-test statistics for every pair of candidate fits in one call
+
+    models: list of arrays of model values at the bin centers, one per candidate
+    npars:  number of parameters of each candidate
+
+    Returns a dict with the chi2 of each candidate ('rss') and matrices indexed
+    [more parameters][fewer parameters] with the F statistic ('F'), the
+    critical value ('target'), degrees of freedom ('dof1', 'dof2') and whether
+    the larger fit is significantly better ('decision')
+    '''
+    rss_all = np.array([chi2(data, model, err_low, err_up) for model in models])
+    npars = np.asarray(npars, dtype=float)
+    n = count_nonzero(data)
+    rss1, rss2 = rss_all[None, :], rss_all[:, None]
+    p1, p2 = npars[None, :], npars[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dof1 = p2 - p1
+        dof2 = n - p2 + 0*p1
+        F = ((rss1 - rss2)/dof1) / (rss2/dof2)
+        from scipy.stats import f as f_dist
+        target = f_dist.ppf(1-sig, dof1, dof2)
+    lower = np.tril(np.ones(F.shape, dtype=bool), -1)  # only [d2][d1] with d1 < d2
+    F = np.where(lower, F, np.nan)
+    target = np.where(lower, target, np.nan)
+    return {
+        'rss': rss_all,
+        'F': F,
+        'target': target,
+        'dof1': dof1,
+        'dof2': dof2,
+        'decision': lower & (F > target),
+    }
+
+def chi2_pvalue(chi2_value, ndof):
+    from scipy.stats import chi2 as chi2_dist
+    return chi2_dist.sf(chi2_value, ndof)
@@ -1,8 +1,13 @@
 import ROOT
-import sys
 import math
-from scipy.stats import f 
-import constants as VALS
+import kernels
+import vectorized_fitting as vfit
+import fit_statistics as fstats
+import basis_cache
+from array_template import ArrayTemplate
+import th1_arrays as th1
+import profiling
+import object_registry as registry
 
 # global counters
 NAME_COUNT = 0
@@ -54,81 +59,24 @@ def checkPullHist(pull_hist, nBins, sigma):
                     break
     return bad_pull
 
-def cheb_fn(x, degree, kind):
-  if kind == 1:
-    if degree == 0:
-        return 1
-    elif degree == 1:
-        return x
-    else:
-        t_minus_2 = 1
-        t_minus_1 = x
-        for n in range(2, degree + 1):
-            current_term = 2 * x * t_minus_1 - t_minus_2
-            t_minus_2 = t_minus_1
-            t_minus_1 = current_term
-        return current_term
-  elif kind == 2:
-    if degree == 0:
-        return 1
-    elif degree == 1:
-        return 2 * x
-    else:
-        u_minus_2 = 1
-        u_minus_1 = 2 * x
-        for n in range(2, degree + 1):
-            current_term = 2 * x * u_minus_1 - u_minus_2
-            u_minus_2 = u_minus_1
-            u_minus_1 = current_term
-        return current_term
-  else: raise ValueError('"kind" argument must be 1 or 2.')
-
-def bern_fn(x, n_degree, i_degree):
-    x_adj = x / VALS.BERN_UPPER_RANGE
-    if i_degree < 0 or i_degree > n_degree: return 0
-    #return scipy.special.comb(n_degree, i_degree) * x_adj**i_degree * (1 - x_adj)**(n_degree - i_degree)
-    return (math.factorial(n_degree))/(math.factorial(i_degree)*math.factorial(n_degree - i_degree)) * x_adj**i_degree * (1 - x_adj)**(n_degree - i_degree)
-
-def bern_deg0(x, p):
-    X = x[0]
-    return p[0]
-        
-def bern_deg1(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 1, 0) + p[1]*bern_fn(X, 1, 1)
-
-def bern_deg2(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 2, 0) + p[1]*bern_fn(X, 2, 1) + p[2]*bern_fn(X, 2, 2)
-
-def bern_deg3(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 3, 0) + p[1]*bern_fn(X, 3, 1) + p[2]*bern_fn(X, 3, 2) + p[3]*bern_fn(X, 3, 3)
-
-def bern_deg4(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 4, 0) + p[1]*bern_fn(X, 4, 1) + p[2]*bern_fn(X, 4, 2) + p[3]*bern_fn(X, 4, 3) + p[4]*bern_fn(X, 4, 4)
-
-def bern_deg5(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 5, 0) + p[1]*bern_fn(X, 5, 1) + p[2]*bern_fn(X, 5, 2) + p[3]*bern_fn(X, 5, 3) + p[4]*bern_fn(X, 5, 4) + p[5]*bern_fn(X, 5, 5)
-
-def bern_deg6(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 6, 0) + p[1]*bern_fn(X, 6, 1) + p[2]*bern_fn(X, 6, 2) + p[3]*bern_fn(X, 6, 3) + p[4]*bern_fn(X, 6, 4) + p[5]*bern_fn(X, 6, 5) + p[6]*bern_fn(X, 6, 6)
-
-def bern_deg7(x, p):
-    X = x[0]
-    return p[0]*bern_fn(X, 7, 0) + p[1]*bern_fn(X, 7, 1) + p[2]*bern_fn(X, 7, 2) + p[3]*bern_fn(X, 7, 3) + p[4]*bern_fn(X, 7, 4) + p[5]*bern_fn(X, 7, 5) + p[6]*bern_fn(X, 7, 6) + p[7]*bern_fn(X, 7, 7)
-
 def getname(prefix='obj'):
   '''
-  helper to return unique names for ROOT objects or global variables
+  helper to return unique names for ROOT objects
   '''
   global NAME_COUNT
   NAME_COUNT += 1
   return prefix+str(NAME_COUNT)
 
+def python_tf1(name, python_func, range_low, range_high, npar, counter='tf1_calls'):
+  '''
+  TF1 of a python function, both kept by the current object_registry scope
+
+  with run_fitter --profile the calls of python_func are counted under counter
+  '''
+  python_func = registry.keep(profiling.counted(counter, python_func), 'callback')
+  return registry.keep(ROOT.TF1(name, python_func, range_low, range_high, npar), 'tf1')
+
+@profiling.timed('template_to_histogram')
 def TemplateToHistogram(func, bins, low, high, integral=False):
     '''
     Convert a ROOT TF1 function template into a ROOT TH1D histogram.
@@ -163,7 +111,8 @@ def TemplateToHistogram(func, bins, low, high, integral=False):
           (Not a Number), the bin content is set to 0.
     '''
     name = getname()  
-    hist = ROOT.TH1D(name, name, bins, low, high)
+    hist = registry.keep(ROOT.TH1D(name, name, bins, low, high), 'hist')
+    hist.SetDirectory(0)  # freed with the registry scope, not listed in gDirectory
     for i in range(hist.GetNbinsX()):
         if not integral:
             val = func.Eval(hist.GetBinCenter(i+1))
@@ -177,11 +126,10 @@ def HistogramToFunction(hist):
   '''
   Takes a ROOT TH1 histogram
 
-  Returns a linearized version as a python function
+  Returns a linearized version as a python function, an ArrayTemplate holding
+  a snapshot of the histogram contents so lookups don't go through PyROOT
   '''
-  def histfunc(x):
-    return hist.GetBinContent(hist.FindBin(x[0])) 
-  return histfunc
+  return ArrayTemplate.from_hist(hist)
 
 def MultiplyWithPolyToTF1(func, degree, range_low=0, range_high=50, poly=0, parameters=None):
     '''
@@ -192,207 +140,17 @@ def MultiplyWithPolyToTF1(func, degree, range_low=0, range_high=50, poly=0, para
     when poly=0 (default) use regular polynomials (1, x^2, x^3, etc)
     when poly=1 use Chebyshev polynomials of the first kind
     when poly=2 use Chebyshev polynomials of the second kind
-    '''
-    if poly == 0:
-        if degree == 0:
-            def polynomial(x, p):
-                return p[0]
-        elif degree == 1:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0]
-        elif degree == 2:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2
-        elif degree == 3:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2 + p[3]*x[0]**3
-        elif degree == 4:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2 + p[3]*x[0]**3 \
-                      + p[4]*x[0]**4
-        elif degree == 5:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2 + p[3]*x[0]**3 \
-                        + p[4]*x[0]**4 + p[5]*x[0]**5
-        elif degree == 6:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2 + p[3]*x[0]**3 \
-                        + p[4]*x[0]**4 + p[5]*x[0]**5 + p[6]*x[0]**6
-        elif degree == 7:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2 + p[3]*x[0]**3 \
-                        + p[4]*x[0]**4 + p[5]*x[0]**5 + p[6]*x[0]**6 + p[7]*x[0]**7
-        elif degree == 8:
-            def polynomial(x, p):
-                return p[0] + p[1]*x[0] + p[2]*x[0]**2 + p[3]*x[0]**3 \
-                        + p[4]*x[0]**4 + p[5]*x[0]**5 + p[6]*x[0]**6 + p[7]*x[0]**7 \
-                        + p[8]*x[0]**8
-        else:
-            raise ValueError('Got degree {} for poly type {}. Not Implemented!'.format(degree, poly))
-
-    elif poly == 1:
-        if degree == 0:
-            def polynomial(x, p):
-                return (p[0])
-        elif degree == 1:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1))
-        elif degree == 2:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1))
-        elif degree == 3:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1)
-                            + p[3]*cheb_fn(X, 3, 1))
-        elif degree == 4:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1)
-                            + p[3]*cheb_fn(X, 3, 1) + p[4]*cheb_fn(X, 4, 1))
-        elif degree == 5:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1)
-                            + p[3]*cheb_fn(X, 3, 1) + p[4]*cheb_fn(X, 4, 1)
-                            + p[5]*cheb_fn(X, 5, 1))
-        elif degree == 6:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1)
-                            + p[3]*cheb_fn(X, 3, 1) + p[4]*cheb_fn(X, 4, 1)
-                            + p[5]*cheb_fn(X, 5, 1) + p[6]*cheb_fn(X, 6, 1))
-        elif degree == 7:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1)
-                            + p[3]*cheb_fn(X, 3, 1) + p[4]*cheb_fn(X, 4, 1)
-                            + p[5]*cheb_fn(X, 5, 1) + p[6]*cheb_fn(X, 6, 1)
-                            + p[7]*cheb_fn(X, 7, 1))
-        elif degree == 8:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 1) + p[2]*cheb_fn(X, 2, 1)
-                            + p[3]*cheb_fn(X, 3, 1) + p[4]*cheb_fn(X, 4, 1)
-                            + p[5]*cheb_fn(X, 5, 1) + p[6]*cheb_fn(X, 6, 1)
-                            + p[7]*cheb_fn(X, 7, 1) + p[8]*cheb_fn(X, 8, 1))
-        else:
-            raise ValueError('Got degree {} for poly type {}. Not Implemented!'.format(degree, poly))
-
-    elif poly == 2:
-        if degree == 0:
-            def polynomial(x, p):
-                return (p[0])
-        elif degree == 1:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2))
-        elif degree == 2:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2))
-        elif degree == 3:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2)
-                            + p[3]*cheb_fn(X, 3, 2))
-        elif degree == 4:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2)
-                            + p[3]*cheb_fn(X, 3, 2) + p[4]*cheb_fn(X, 4, 2))
-        elif degree == 5:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2)
-                            + p[3]*cheb_fn(X, 3, 2) + p[4]*cheb_fn(X, 4, 2)
-                            + p[5]*cheb_fn(X, 5, 2))
-        elif degree == 6:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2)
-                            + p[3]*cheb_fn(X, 3, 2) + p[4]*cheb_fn(X, 4, 2)
-                            + p[5]*cheb_fn(X, 5, 2) + p[6]*cheb_fn(X, 6, 2))
-        elif degree == 7:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2)
-                            + p[3]*cheb_fn(X, 3, 2) + p[4]*cheb_fn(X, 4, 2)
-                            + p[5]*cheb_fn(X, 5, 2) + p[6]*cheb_fn(X, 6, 2)
-                            + p[7]*cheb_fn(X, 7, 2))
-        elif degree == 8:
-            def polynomial(x, p):
-                X = x[0]
-                return (p[0] + p[1]*cheb_fn(X, 1, 2) + p[2]*cheb_fn(X, 2, 2)
-                            + p[3]*cheb_fn(X, 3, 2) + p[4]*cheb_fn(X, 4, 2)
-                            + p[5]*cheb_fn(X, 5, 2) + p[6]*cheb_fn(X, 6, 2)
-                            + p[7]*cheb_fn(X, 7, 2) + p[8]*cheb_fn(X, 8, 2))
-        else:
-            raise ValueError('Got degree {} for poly type {}. Not Implemented!'.format(degree, poly))
-
-    elif poly == 3:
-        if degree == 0:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]
-        elif degree == 1:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 1, 0) + p[1]*bern_fn(X, 1, 1)
-        elif degree == 2:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 2, 0) + p[1]*bern_fn(X, 2, 1) \
-                       + p[2]*bern_fn(X, 2, 2)
-        elif degree == 3:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 3, 0) + p[1]*bern_fn(X, 3, 1) \
-                       + p[2]*bern_fn(X, 3, 2) + p[3]*bern_fn(X, 3, 3)
-        elif degree == 4:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 4, 0) + p[1]*bern_fn(X, 4, 1) \
-                       + p[2]*bern_fn(X, 4, 2) + p[3]*bern_fn(X, 4, 3) + p[4]*bern_fn(X, 4, 4)
-        elif degree == 5:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 5, 0) + p[1]*bern_fn(X, 5, 1) \
-                       + p[2]*bern_fn(X, 5, 2) + p[3]*bern_fn(X, 5, 3) + p[4]*bern_fn(X, 5, 4) \
-                       + p[5]*bern_fn(X, 5, 5)
-        elif degree == 6:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 6, 0) + p[1]*bern_fn(X, 6, 1) \
-                       + p[2]*bern_fn(X, 6, 2) + p[3]*bern_fn(X, 6, 3) + p[4]*bern_fn(X, 6, 4) \
-                       + p[5]*bern_fn(X, 6, 5) + p[6]*bern_fn(X, 6, 6)
-        elif degree == 7:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 7, 0) + p[1]*bern_fn(X, 7, 1) \
-                       + p[2]*bern_fn(X, 7, 2) + p[3]*bern_fn(X, 7, 3) + p[4]*bern_fn(X, 7, 4) \
-                       + p[5]*bern_fn(X, 7, 5) + p[6]*bern_fn(X, 7, 6) + p[7]*bern_fn(X, 7, 7)
-        elif degree == 8:
-            def polynomial(x, p):
-                X = x[0]
-                return p[0]*bern_fn(X, 8, 0) + p[1]*bern_fn(X, 8, 1) \
-                       + p[2]*bern_fn(X, 8, 2) + p[3]*bern_fn(X, 8, 3) + p[4]*bern_fn(X, 8, 4) \
-                       + p[5]*bern_fn(X, 8, 5) + p[6]*bern_fn(X, 8, 6) + p[7]*bern_fn(X, 8, 7) \
-                       + p[8]*bern_fn(X, 8, 8)
-        else:
-            raise ValueError('Got degree {} for poly type {}. Not Implemented!'.format(degree, poly))
+    when poly=3 use Bernstein polynomials
 
-    else:
-        raise ValueError('Got degree {} for poly type {}. Not Implemented!'.format(degree, poly))
+    the polynomial is evaluated from the cached basis matrix in basis_cache
+    '''
+    polynomial = basis_cache.make_polynomial(poly, degree)
 
     def func_after_mult(x, p):
         val = func(x) * polynomial(x, p)
         return val
 
-    globals()[getname('func')] = polynomial
-    globals()[getname('func')] = func_after_mult
+    registry.keep(polynomial, 'callback')
 
     if poly == 0 or poly == 1 or poly == 2:
         num_param = degree + 1
@@ -401,7 +159,7 @@ def MultiplyWithPolyToTF1(func, degree, range_low=0, range_high=50, poly=0, para
     if poly == 3 and degree > 0:
         num_param = degree + 1
 
-    tf1 = ROOT.TF1(getname(), func_after_mult, range_low, range_high, num_param)
+    tf1 = python_tf1(getname(), func_after_mult, range_low, range_high, num_param, 'tight_tf1_calls')
 
     # Set parameter names
     if num_param>=0: tf1.SetParName(0, 'Constant') if poly==0 else tf1.SetParName(0, 'Zero')
@@ -438,7 +196,7 @@ def MultiplyWithPolyToTF1(func, degree, range_low=0, range_high=50, poly=0, para
 
     return tf1, func_after_mult, polynomial
 
-def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, integral=False):
+def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, integral=False, backend='root', param_store=None, store_key=None):
   '''
   Takes a historgram, fits a function and returns a TF1 and the fit result
 
@@ -446,43 +204,33 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
   N:        controls how many exponentials or landaus to use for 'exp' and 'landu'
             if function is 'full' N can be 11, 12, 13, 14, 22, 23, 23, 24
             where the tens digit is number of landaus, and ones digit is number of exps
+  backend:  'root' fits the TF1 with hist.Fit(), 'numpy' minimizes the same
+            binned likelihood with the vectorized models in vectorized_fitting
+  param_store: a param_store.ParamStore; parameters stored under store_key for
+            this function and N are used in place of initial_guesses, and the
+            parameters of a successful fit are recorded
   '''
+  if param_store is not None:
+    stored = param_store.get(store_key, function, N)
+    if stored is not None: initial_guesses = stored
   if function == 'landau' and N == 1:
-    def python_func(x, p):
-      norm = p[0]
-      mpv = p[1]
-      sigma = p[2]
-      land = norm * ROOT.TMath.Landau(x[0], mpv, sigma)
-      return land
     NPAR = 3
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses: initial_guesses = [hist.GetEntries(), hist.GetMean(), 0.25]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant", "MPV", "Sigma")
     tf1.SetParameters(*initial_guesses)
 
   elif function == 'landau' and N == 2:
-    def python_func(x, p):
-      norm = p[0]
-      mpv1 = p[1]
-      sigma1 = p[2]
-      bound = p[3]
-      mpv2 = p[4]
-      sigma2 = p[5]
-      land1 = norm * ROOT.TMath.Landau(x[0], mpv1, sigma1)
-      y1 = norm * ROOT.TMath.Landau(bound, mpv1, sigma1)
-      y2 = ROOT.TMath.Landau(bound, mpv2, sigma2)
-      if y2 == 0: land2 = (y1) * ROOT.TMath.Landau(x[0], mpv2, sigma2)
-      else: land2 = (y1/y2) * ROOT.TMath.Landau(x[0], mpv2, sigma2)
-      if x[0] < bound: return land1
-      else: return land2
     NPAR = 6
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses: initial_guesses = [
       hist.GetEntries(), hist.GetMean(), 0.25, (range_low+range_high)/2.0, hist.GetMean(), 0.25]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant", "MPV1", "Sigma1", "bound", "MPV2", "Sigma2")
     tf1.SetParameters(*initial_guesses)
     tf1.SetParLimits(3, range_low, range_high*2)
@@ -490,68 +238,37 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
     tf1.SetParLimits(5, 0, 1e5)
 
   elif function == 'exp' and N == 1:
-    def python_func(x, p):
-      norm = p[0]
-      C1 = p[1]
-      exp1 = norm * ROOT.TMath.Exp(C1*x[0])
-      return exp1
     NPAR = 2
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses: initial_guesses = [hist.GetEntries(), -1]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant", "C1")
     tf1.SetParameters(*initial_guesses)
 
   elif function == 'exp' and N == 2:
-    def python_func(x, p):
-      norm = p[0]
-      C1 = p[1]
-      bound = p[2]
-      C2 = p[3]
-      y1 = norm * ROOT.TMath.Exp(C1*bound)
-      y2 = ROOT.TMath.Exp(C2*bound)
-      exp1 = norm * ROOT.TMath.Exp(C1*x[0])
-      exp2 = ROOT.TMath.Exp(C2*x[0]) * (y1/y2)
-      if x[0] < bound: return exp1
-      else: return exp2
     NPAR = 4
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses: initial_guesses = [
       hist.Integral(hist.FindBin(range_low), hist.FindBin(range_high)), -1, (range_low+range_high)/2.0, -1]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant", "C1", "bound", "C2")
     tf1.SetParameters(*initial_guesses)
     tf1.SetParLimits(2, 0, hist.GetBinLowEdge(hist.GetNbinsX()))
     tf1.SetParLimits(3, -10, 0)
 
   elif function == 'exp' and N == 3:
-    def python_func(x, p):
-      norm = p[0]
-      C1 = p[1]
-      bound1 = p[2]
-      C2 = p[3]
-      bound12 = p[4]
-      C3 = p[5]
-      bound2 = bound1 + bound12
-      exp1 = norm * ROOT.TMath.Exp(C1*x[0])
-      y1 = norm * ROOT.TMath.Exp(C1*bound1)
-      y2 = ROOT.TMath.Exp(C2*bound1)
-      exp2 = ROOT.TMath.Exp(C2*x[0]) * (y1/y2)
-      y3 = ROOT.TMath.Exp(C2*bound2)
-      y4 = ROOT.TMath.Exp(C3*bound2)
-      exp3 = ROOT.TMath.Exp(C3*x[0]) * (y3/y4) * (y1/y2)
-      if x[0] < bound1: return exp1
-      elif x[0] < bound2: return exp2
-      else: return exp3
     NPAR = 6
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses: initial_guesses = [
       hist.Integral(hist.FindBin(range_low), hist.FindBin(range_high)), -1, (range_low+range_high)/2.0,
       -1, (range_low+range_high)/2.0, -1]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant", "C1", "bound1", "C2", "bound12", "C3")
     tf1.SetParameters(*initial_guesses)
     tf1.SetParLimits(2, 0, range_high)
@@ -560,26 +277,8 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
     tf1.SetParLimits(5, -10, 0)
   
   elif function == 'full' and N == 11: 
-    def python_func(x, p):
-        norm1 = p[0]
-        mpv1 = p[1]
-        sigma1 = p[2]
-        C1 = p[3]
-        bound1 = p[4]
-
-        if bound1 < 0: bound1 = 0
-
-        land1 = norm1 * ROOT.TMath.Landau(x[0], mpv1, sigma1)
-      
-        y11=norm1*ROOT.TMath.Landau(bound1, mpv1, sigma1)
-        y12=ROOT.TMath.Exp(C1*bound1)
-        if y12 == 0: exp1 = ROOT.TMath.Exp(C1*x[0])*y11
-        else: exp1 = ROOT.TMath.Exp(C1*x[0])*y11/y12
-         
-        if x[0] < bound1: return land1
-        else: return exp1
-
-    NPAR = 5 
+    NPAR = 5
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses:
         nEntries = hist.GetEntries()
         mean = hist.GetMean()
@@ -588,41 +287,15 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
             mean]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant1","MPV1","Sigma1","C1","Boundary1")
     for i, guess in enumerate(initial_guesses): tf1.SetParameter(i, guess)
     tf1.SetParLimits(3, -10, 0)
     tf1.SetParLimits(4, 0, 25)
 
   elif function == 'full' and N == 12: 
-    def python_func(x, p):
-        norm1 = p[0]
-        mpv1 = p[1]
-        sigma1 = p[2]
-        C1 = p[3]
-        C2 = p[4]
-        bound1 = p[5]
-        b12 = p[6]
-
-        if bound1 < 0: bound1 = 0
-        bound2 = bound1 + b12
-
-        land1 = norm1 * ROOT.TMath.Landau(x[0], mpv1, sigma1)
-      
-        y11=norm1*ROOT.TMath.Landau(bound1, mpv1, sigma1)
-        y12=ROOT.TMath.Exp(C1*bound1)
-        if y12 == 0: exp1 = ROOT.TMath.Exp(C1*x[0])*y11
-        else: exp1 = ROOT.TMath.Exp(C1*x[0])*y11/y12
-         
-        y21=ROOT.TMath.Exp(C1*bound2)*y11/y12
-        y22=ROOT.TMath.Exp(C2*bound2)
-        exp2=ROOT.TMath.Exp(C2*x[0])*y21/y22
-
-        if x[0] < bound1: return land1
-        elif x[0] < bound2: return exp1
-        else: return exp2
-
     NPAR = 7
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses:
         nEntries = hist.GetEntries()
         mean = hist.GetMean()
@@ -631,7 +304,7 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
             mean, mean/2]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant1","MPV1","Sigma1","C1","C2","Boundary1","BoundDiff12")
     for i, guess in enumerate(initial_guesses): tf1.SetParameter(i, guess)
     tf1.SetParLimits(3, -10, 0)
@@ -640,42 +313,8 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
     tf1.SetParLimits(6, 0.2, 7)
   
   elif function == 'full' and N == 13: 
-    def python_func(x, p):
-        norm1 = p[0]
-        mpv1 = p[1]
-        sigma1 = p[2]
-        C1 = p[3]
-        C2 = p[4]
-        C3 = p[5]
-        bound1 = p[6]
-        b12 = p[7]
-        b23 = p[8]
-
-        if bound1 < 0: bound1 = 0
-        bound2 = bound1 + b12
-        bound3 = bound2 + b23
-
-        land1 = norm1 * ROOT.TMath.Landau(x[0], mpv1, sigma1)
-      
-        y11=norm1*ROOT.TMath.Landau(bound1, mpv1, sigma1)
-        y12=ROOT.TMath.Exp(C1*bound1)
-        if y12 == 0: exp1 = ROOT.TMath.Exp(C1*x[0])*y11
-        else: exp1 = ROOT.TMath.Exp(C1*x[0])*y11/y12
-         
-        y21=ROOT.TMath.Exp(C1*bound2)*y11/y12
-        y22=ROOT.TMath.Exp(C2*bound2)
-        exp2=ROOT.TMath.Exp(C2*x[0])*y21/y22
-
-        y31=ROOT.TMath.Exp(C2*bound3)*y21/y22
-        y32=ROOT.TMath.Exp(C3*bound3)
-        exp3=ROOT.TMath.Exp(C3*x[0])*y31/y32
-        
-        if x[0] < bound1: return land1
-        elif x[0] < bound2: return exp1
-        elif x[0] < bound3: return exp2
-        else: return exp3
-
     NPAR = 9
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses:
         nEntries = hist.GetEntries()
         mean = hist.GetMean()
@@ -684,7 +323,7 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
             mean, mean/2, mean/2]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant1","MPV1","Sigma1","C1","C2","C3","Boundary1","BoundDiff12","BoundDiff23")
     for i, guess in enumerate(initial_guesses): tf1.SetParameter(i, guess)
     tf1.SetParLimits(3, -10, 0)
@@ -695,36 +334,8 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
     tf1.SetParLimits(8, 0.2, 7)
 
   elif function == 'full' and N == 21:
-    def python_func(x, p):
-        norm1 = p[0]
-        mpv1 = p[1]
-        sigma1 = p[2]
-        norm2 = p[3]
-        mpv2 = p[4]
-        sigma2 = p[5]
-        C1 = p[6]
-        bound1 = p[7]
-        b12 = p[8]
-
-        if bound1 < 0: bound1 = 0
-        bound2 = bound1 + b12
-        
-        land1 = norm1 * ROOT.TMath.Landau(x[0], mpv1, sigma1)
-      
-        y11=norm1*ROOT.TMath.Landau(bound1, mpv1, sigma1)
-        y12=norm2*ROOT.TMath.Landau(bound1, mpv2, sigma2)
-        if y12 == 0: land2 = norm2*ROOT.TMath.Landau(x[0], mpv2, sigma2)*y11
-        else: land2 = norm2*ROOT.TMath.Landau(x[0], mpv2, sigma2)*y11/y12
-         
-        if y12 == 0: y21=norm2*ROOT.TMath.Landau(bound2, mpv2, sigma2)*y11
-        else: y21=norm2*ROOT.TMath.Landau(bound2, mpv2, sigma2)*y11/y12
-        y22=ROOT.TMath.Exp(C1*bound2)
-        exp1=ROOT.TMath.Exp(C1*x[0])*y21/y22
-
-        if x[0] < bound1: return land1
-        elif x[0] < bound2: return land2
-        else: return exp1
     NPAR = 9
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses:
         nEntries = hist.GetEntries()
         mean = hist.GetMean()
@@ -732,7 +343,7 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
             nEntries, mean, 0.5, nEntries, mean, 0.5, -3, mean, mean/2]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant1","MPV1","Sigma1","Constant2","MPV2","Sigma2","C1","Boundary1","BoundDiff12")
     for i, guess in enumerate(initial_guesses): tf1.SetParameter(i, guess)
     tf1.SetParLimits(6, -10, 0)
@@ -740,60 +351,8 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
     tf1.SetParLimits(8, 0.2, 7)
   
   elif function == 'full' and N == 24:
-    def python_func(x, p):
-        norm1 = p[0]
-        mpv1 = p[1]
-        sigma1 = p[2]
-        norm2 = p[3]
-        mpv2 = p[4]
-        sigma2 = p[5]
-        C1 = p[6]
-        C2 = p[7]
-        C3 = p[8]
-        C4 = p[9]
-        bound1 = p[10]
-        b12 = p[11]
-        b23 = p[12]
-        b34 = p[13]
-        b45 = p[14]
-
-        if bound1 < 0: bound1 = 0
-        bound2 = bound1 + b12
-        bound3 = bound2 + b23
-        bound4 = bound3 + b34
-        bound5 = bound4 + b45
-
-        land1 = norm1 * ROOT.TMath.Landau(x[0], mpv1, sigma1)
-      
-        y11=norm1*ROOT.TMath.Landau(bound1, mpv1, sigma1)
-        y12=norm2*ROOT.TMath.Landau(bound1, mpv2, sigma2)
-        if y12 == 0: land2 = norm2*ROOT.TMath.Landau(x[0], mpv2, sigma2)*y11
-        else: land2 = norm2*ROOT.TMath.Landau(x[0], mpv2, sigma2)*y11/y12
-         
-        if y12 == 0: y21=norm2*ROOT.TMath.Landau(bound2, mpv2, sigma2)*y11
-        else: y21=norm2*ROOT.TMath.Landau(bound2, mpv2, sigma2)*y11/y12
-        y22=ROOT.TMath.Exp(C1*bound2)
-        exp1=ROOT.TMath.Exp(C1*x[0])*y21/y22
-
-        y31=ROOT.TMath.Exp(C1*bound3)*y21/y22
-        y32=ROOT.TMath.Exp(C2*bound3)
-        exp2=ROOT.TMath.Exp(C2*x[0])*y31/y32
-         
-        y41=ROOT.TMath.Exp(C2*bound4)*y31/y32
-        y42=ROOT.TMath.Exp(C3*bound4)
-        exp3=ROOT.TMath.Exp(C3*x[0])*y41/y42
-
-        y51=ROOT.TMath.Exp(C3*bound5)*y41/y42
-        y52=ROOT.TMath.Exp(C4*bound5)
-        exp4=ROOT.TMath.Exp(C4*x[0])*y51/y52
-        
-        if x[0] < bound1: return land1
-        elif x[0] < bound2: return land2
-        elif x[0] < bound3: return exp1
-        elif x[0] < bound4: return exp2
-        elif x[0] < bound5: return exp3
-        else: return exp4
     NPAR = 15
+    python_func = kernels.tf1_function(kernels.CHAINS[(function, N)][0], NPAR)
     if not initial_guesses:
         nEntries = hist.GetEntries()
         mean = hist.GetMean()
@@ -802,7 +361,7 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
             mean, mean/2, mean/2, mean/2, mean/2]
     if not len(initial_guesses) == NPAR:
         raise AssertionError('Length of initial guesses list must be '+str(NPAR)+"!")
-    tf1 = ROOT.TF1(getname('func'), python_func, range_low, range_high, NPAR)
+    tf1 = python_tf1(getname('func'), python_func, range_low, range_high, NPAR, 'loose_tf1_calls')
     tf1.SetParNames("Constant1","MPV1","Sigma1","Constant2","MPV2","Sigma2","C1","C2","C3","C4","Boundary1")
     tf1.SetParName(11, "BoundDiff12")
     tf1.SetParName(12, "BoundDiff23")
@@ -823,40 +382,28 @@ def fit_hist(hist, function, range_low, range_high, N=1, initial_guesses=None, i
   else:
     raise ValueError('fit_hist(): Invalid type of fit: got function='+str(function)+', N='+str(N))
 
-  globals()[getname('func')] = python_func
-  fit_string = '0SL'
-  if integral: fit_string += 'I'
-  fit_result = hist.Fit(tf1, fit_string, "", range_low, range_high)
+  if backend == 'numpy':
+    fit_result = vfit.fit_tf1(hist, tf1, vfit.MODELS[(function, N)], range_low, range_high, integral=integral)
+  elif backend == 'root':
+    fit_string = '0SL'
+    if integral: fit_string += 'I'
+    fit_result = hist.Fit(tf1, fit_string, "", range_low, range_high)
+  else:
+    raise ValueError('fit_hist(): Invalid backend: got '+str(backend))
+  profiling.count_fit('loose_fit_calls', fit_result)
+  if param_store is not None: param_store.record(store_key, function, N, tf1, fit_result, range_low, range_high)
   return tf1, fit_result
 
 def RSS(func, hist, bound=-1, error=0, integral=False, chi2=False, cutoff=None):
   '''
   helper for ftest()
   '''
-  rss = 0
-  by_bin = []
-  for i in range(hist.GetNbinsX()):
-    if hist.GetBinLowEdge(i+1) < bound: continue
-    hist_val = hist.GetBinContent(i+1)
-    if integral:
-      fit_val = (func.Integral(hist.GetBinLowEdge(i+1), hist.GetBinLowEdge(i+1) + hist.GetBinWidth(i+1)))/hist.GetBinWidth(i+1)
-    else:
-      fit_val = func.Eval(hist.GetBinCenter(i+1))
-    if cutoff and fit_val < cutoff: continue
-    if error == 0:
-        sr = (hist_val - fit_val)**2
-    else:
-        adj = abs(fit_val * error)
-        sr = (max(abs(hist_val - fit_val) - adj, 0))**2
-    if chi2:
-        if hist_val > fit_val: hist_error = hist.GetBinErrorLow(i+1)
-        else: hist_error = hist.GetBinErrorUp(i+1)
-        if hist_val==0: hist_error = hist.GetBinErrorUp(i+1)
-        sr_sigma = sr/(hist_error)**2
-    else:
-        sr_sigma = sr
-    rss += sr_sigma
-    by_bin.append((i, hist.GetBinLowEdge(i+1), hist_val, fit_val, sr_sigma, sr, hist_error))
+  data, err_low, err_up = fstats.hist_poisson_arrays(hist)
+  lows = th1.edges(hist)[:-1]
+  model = fstats.fit_values(func, hist, integral=integral)
+  rss, by_bin = fstats.rss(data, model, err_low, err_up, lows=lows, bound=bound, error=error, chi2=chi2, cutoff=cutoff)
+  by_bin = list(zip(by_bin['index'], by_bin['low_edge'], by_bin['data'], by_bin['model'],
+                    by_bin['sr_sigma'], by_bin['sr'], by_bin['sigma']))
   return rss, by_bin
 
 def ExtractPolyFromTightFit(fitfunc, range_low=0, range_high=50, poly=0, debug=False):
@@ -864,37 +411,33 @@ def ExtractPolyFromTightFit(fitfunc, range_low=0, range_high=50, poly=0, debug=F
     if poly == 0 or poly == 1 or poly == 2: poly_degree = nparam - 1
     elif poly == 3 and nparam == 1: poly_degree = 0
     elif poly == 3 and nparam > 1: poly_degree = nparam - 1
-    _, _, poly_func = MultiplyWithPolyToTF1(lambda x : x[0], poly_degree, poly=poly)
-    extracted_poly = ROOT.TF1(getname('func'), poly_func, range_low, range_high, nparam)
+    poly_func = basis_cache.make_polynomial(poly, poly_degree)
+    extracted_poly = python_tf1(getname('func'), poly_func, range_low, range_high, nparam, 'poly_tf1_calls')
     for n in range(nparam):
         extracted_poly.SetParameter(n, fitfunc.GetParameter(n))
         if debug: print(n, fitfunc.GetParameter(n))
     return extracted_poly
 
 def hist_to_numpy(hist):
-    array = np.zeros(int(hist.GetNbinsX()))
-    for j in range(hist.GetNbinsX()):
-        array[j] = hist.GetBinContent(j+1)
-    return array 
+    return th1.contents(hist).astype(float)  # a copy, in float64
 
 def count_nonzero_bins(hist, bound=-1):
   '''
   Helper for ftest()
   '''
-  count = 0
-  for i in range(hist.GetNbinsX()):
-    if hist.GetBinLowEdge(i+1) < bound: continue
-    if not hist.GetBinContent(i+1) == 0: count += 1
-  return count
+  data = th1.contents(hist)
+  lows = th1.edges(hist)[:-1]
+  return fstats.count_nonzero(data, lows=lows, bound=bound)
 
 def lookup_ftest_target(dof1, dof2, sig):
     '''
     Helper for ftest()
     '''
-    if 'scipy' in sys.modules:
-        return f.ppf(1-sig, dof1, dof2)
-    else:
+    try:
+        from scipy.stats import f
+    except ImportError:
         return 2
+    return f.ppf(1-sig, dof1, dof2)
 
 def ftest(hist, func2, fit2, func1, fit1, sig=0.1, integral=False):
     '''
@@ -0,0 +1,235 @@
+'''
+Memory-mapped cache of the masspi0 histograms of summed_egamma.root
+
+The first time it is used on an input directory, all twoprong_masspi0_*
+histograms (pt binned, phi x pt binned and unbinned, tight and loose) are read
+from summed_egamma.root once and written to hist_cache/ as
+
+  summed_egamma.npy   bin contents of all histograms with under- and overflow,
+                      one flat float64 array
+  summed_egamma.json  index: name -> offset, number of bins, edges, entries, the
+                      stored statistics (sums of w, w^2, w*x, w*x^2) and the
+                      (region, eta, pt, phi, tight/loose) the name encodes
+
+Later runs memory-map the array and return slices of it, so no histogram is
+read through ROOT and nothing is copied. The cache is rebuilt when the sha1 of
+summed_egamma.root changes (size and modification time are checked first so
+the hash is only computed when they differ).
+
+Histograms made by to_hist() and Get() have the flow bins, entries and
+statistics of the ones in the file, so GetMean(), GetRMS() and GetEntries()
+give the same values as with TFile.Get().
+
+Extraction uses ROOT when it can be imported and uproot otherwise.
+
+shared() returns one HistCache per source file and process, so the stages
+bkgfit.py runs in one interpreter open and check the cache only once.
+'''
+from __future__ import print_function
+import os
+import re
+import json
+import array
+import hashlib
+import numpy as np
+import th1_arrays as th1
+
+CACHE_DIR = 'hist_cache'
+SOURCE_NAME = 'summed_egamma.root'
+PREFIX = 'twoprong_masspi0_'
+VERSION = 2
+
+# twoprong_masspi0_[phi<phi>_]<region>[_<eta>][_<pt low>_<pt high> | _<pt low>+ | _pt<pt low>-<pt high>]_<tight|loose>
+NAME_PATTERN = re.compile(
+    r'^' + PREFIX + r'(?:phi(?P<phi>[^_]+)_)?(?P<region>(?:non)?iso_(?:a)?sym)(?:_(?P<eta>barrel|endcap))?'
+    r'(?:_pt(?P<phi_pt>[^_]+)|_(?P<pt>\d+)(?:_\d+|\+))?_(?P<kind>tight|loose)$')
+
+def parse_name(name):
+    '''
+    Returns the (region, eta, pt, phi, kind) encoded in a histogram name, None if it doesn't match
+
+    pt and phi are the low edges of the bins (ints), phi is 'All' for the
+    phi-inclusive histograms and None for histograms without phi binning
+    '''
+    match = NAME_PATTERN.match(name)
+    if match is None: return None
+    pt = match.group('pt') or match.group('phi_pt')
+    if pt is not None: pt = int(pt.split('-')[0])
+    phi = match.group('phi')
+    if phi is not None and not phi == 'All': phi = int(phi.split('-')[0])
+    return (match.group('region'), match.group('eta'), pt, phi, match.group('kind'))
+
+def file_sha1(path, chunk=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''): sha1.update(block)
+    return sha1.hexdigest()
+
+def _read_root(ROOT, path):
+    infile = ROOT.TFile(path)
+    plots = infile.Get('plots')
+    hists = []
+    for key in plots.GetListOfKeys():
+        name = key.GetName()
+        if not name.startswith(PREFIX) or not key.GetClassName().startswith('TH1'): continue
+        hist = key.ReadObj()
+        stats = array.array('d', [0.]*4)
+        hist.GetStats(stats)
+        hists.append((name, th1.contents(hist, flow=True).astype(float), th1.edges(hist), hist.GetEntries(),
+                      list(stats), hist.GetTitle()))
+    infile.Close()
+    return hists
+
+def _read_uproot(path):
+    import uproot
+    hists = []
+    with uproot.open(path) as infile:
+        plots = infile['plots']
+        for name, classname in plots.classnames(recursive=False).items():
+            name = name.split(';')[0]
+            if not name.startswith(PREFIX) or not classname.startswith('TH1'): continue
+            hist = plots[name]
+            contents = np.asarray(hist.values(flow=True), dtype=float)
+            stats = [hist.member(member) for member in ['fTsumw', 'fTsumw2', 'fTsumwx', 'fTsumwx2']]
+            hists.append((name, contents, np.asarray(hist.axis().edges()), hist.member('fEntries'), stats, hist.member('fTitle')))
+    return hists
+
+def read_histograms(path):
+    '''
+    Returns a list of (name, contents, edges, entries, stats, title) for the masspi0 histograms of the file
+
+    contents include under- and overflow, stats are the TH1::GetStats() sums
+    '''
+    try:
+        import ROOT
+    except ImportError:
+        return _read_uproot(path)
+    return _read_root(ROOT, path)
+
+class HistCache(object):
+    def __init__(self, directory='.', source=SOURCE_NAME, rebuild=False, verbose=True):
+        self.source = os.path.join(directory, source)
+        base = os.path.join(directory, CACHE_DIR, os.path.splitext(source)[0])
+        self.data_path = base + '.npy'
+        self.index_path = base + '.json'
+        self.verbose = verbose
+        if rebuild or not self._valid(): self.build()
+        with open(self.index_path) as f: self.index = json.load(f)
+        self.data = np.load(self.data_path, mmap_mode='r')
+        self.keys = {}
+        for name, info in self.index['hists'].items():
+            if info['key'] is not None: self.keys[tuple(info['key'])] = name
+
+    def _valid(self):
+        if not os.path.exists(self.index_path) or not os.path.exists(self.data_path): return False
+        with open(self.index_path) as f: index = json.load(f)
+        if not index.get('version') == VERSION: return False
+        stat = os.stat(self.source)
+        if stat.st_size == index['size'] and stat.st_mtime == index['mtime']: return True
+        if not stat.st_size == index['size'] or not file_sha1(self.source) == index['sha1']: return False
+        index['mtime'] = stat.st_mtime  # touched but not changed
+        self._write_json(index)
+        return True
+
+    def _write_json(self, index):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f: json.dump(index, f)
+        os.rename(tmp, self.index_path)
+
+    def build(self):
+        '''
+        Reads the histograms from the source file and writes the array and the index
+        '''
+        if self.verbose: print('HistCache: extracting histograms from', self.source)
+        directory = os.path.dirname(self.data_path)
+        if not os.path.exists(directory): os.makedirs(directory)
+        stat = os.stat(self.source)
+        hists = read_histograms(self.source)
+        index = {'version': VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_sha1(self.source), 'hists': {}}
+        offset = 0
+        for name, contents, edges, entries, stats, title in hists:
+            key = parse_name(name)
+            index['hists'][name] = {
+                'offset': offset,
+                'nbins': len(contents) - 2,
+                'edges': [float(edge) for edge in edges],
+                'entries': float(entries),
+                'stats': [float(value) for value in stats],
+                'title': str(title),
+                'key': list(key) if key is not None else None,
+            }
+            offset += len(contents)
+        data = np.concatenate([hist[1] for hist in hists]) if hists else np.zeros(0)
+        tmp = self.data_path + '.tmp.npy'
+        np.save(tmp, data)
+        os.rename(tmp, self.data_path)
+        self._write_json(index)  # written last, so a half-written cache is never valid
+
+    def unchanged(self):
+        '''
+        True if the source file has the size and modification time it had when the cache was opened
+        '''
+        stat = os.stat(self.source)
+        return stat.st_size == self.index['size'] and stat.st_mtime == self.index['mtime']
+
+    def names(self):
+        return list(self.index['hists'])
+
+    def find(self, region, eta=None, pt=None, phi=None, kind='tight'):
+        '''
+        Name of the histogram for (region, eta, pt low edge, phi low edge or 'All', tight/loose)
+        '''
+        return self.keys[(region, eta, pt, phi, kind)]
+
+    def contents(self, name, flow=False):
+        '''
+        Read-only view of the bin contents, with under- and overflow if flow=True
+        '''
+        info = self.index['hists'][name]
+        if flow: return self.data[info['offset']:info['offset'] + info['nbins'] + 2]
+        return self.data[info['offset'] + 1:info['offset'] + info['nbins'] + 1]
+
+    def edges(self, name):
+        return np.array(self.index['hists'][name]['edges'])
+
+    def entries(self, name):
+        return self.index['hists'][name]['entries']
+
+    def integral(self, name):
+        return float(np.sum(self.contents(name)))
+
+    def to_hist(self, name):
+        '''
+        New TH1D with the contents, flow bins, entries and statistics of histogram name
+        '''
+        import ROOT
+        info = self.index['hists'][name]
+        edges = info['edges']
+        widths = np.diff(edges)
+        if np.allclose(widths, widths[0]): hist = ROOT.TH1D(name, info['title'], info['nbins'], edges[0], edges[-1])
+        else: hist = ROOT.TH1D(name, info['title'], info['nbins'], array.array('d', edges))
+        hist.SetDirectory(0)
+        th1.set_contents(hist, self.contents(name, flow=True), flow=True)
+        hist.PutStats(array.array('d', info['stats']))
+        hist.SetEntries(info['entries'])
+        return hist
+
+    def Get(self, path):
+        '''
+        Same as TFile.Get("plots/<name>") for the cached histograms, None if not cached
+        '''
+        name = path.split('/')[-1]
+        if name not in self.index['hists']: return None
+        return self.to_hist(name)
+
+_shared = {}
+
+def shared(directory='.', source=SOURCE_NAME, verbose=True):
+    '''
+    HistCache of directory/source, reused by later calls in this process while the source is unchanged
+    '''
+    path = os.path.abspath(os.path.join(directory, source))
+    cache = _shared.get(path)
+    if cache is None or not cache.unchanged():
+        cache = _shared[path] = HistCache(os.path.dirname(path), os.path.basename(path), verbose=verbose)
+    return cache
@@ -0,0 +1,450 @@
+'''
+Landau and exponential kernels of the fit_hist() models, with numpy only
+
+  landau(x, mpv, sigma, norm=False)   ROOT.TMath.Landau for arrays of x, same
+                                      normalization convention (the density
+                                      of (x-mpv)/sigma, divided by sigma only
+                                      with norm=True)
+  landau_value(...)                   the same for one float x
+  Landau, Exponential                 norm * landau / norm * exp(slope * x)
+  Chain                               segments joined at bounds, each one scaled
+                                      to be continuous with the one before
+
+The continuity factors of a Chain depend only on the parameters, so they are
+computed once when the Chain is built and not at every x. CHAINS has a Chain
+builder for every (function, N) of fit_hist(); vectorized_fitting evaluates
+them on arrays of bin centers and tf1_function() makes the python function of
+a TF1 that rebuilds the Chain only when the fit changes the parameters.
+
+  python kernels.py   checks landau(), the exponential and CHAINS against the
+                      reference values below (check_reference()) and, if ROOT
+                      can be imported, against ROOT.TMath evaluated point by
+                      point (check_root_parity()); unit_test.sh runs it
+'''
+from __future__ import print_function
+import sys
+import math
+import bisect
+import numpy as np
+
+# CERNLIB G110 DENLAN coefficients, as used by ROOT::Math::landau_pdf
+LANDAU_P1 = [0.4259894875, -0.1249762550, 0.03984243700, -0.006298287635, 0.001511162253]
+LANDAU_Q1 = [1.0, -0.3388260629, 0.09594393323, -0.01608042283, 0.003778942063]
+LANDAU_P2 = [0.1788541609, 0.1173957403, 0.01488850518, -0.001394989411, 0.0001283617211]
+LANDAU_Q2 = [1.0, 0.7428795082, 0.3153932961, 0.06694219548, 0.008790609714]
+LANDAU_P3 = [0.1788544503, 0.09359161662, 0.006325387654, 0.00006611667319, -0.000002031049101]
+LANDAU_Q3 = [1.0, 0.6097809921, 0.2560616665, 0.04746722384, 0.006957301675]
+LANDAU_P4 = [0.9874054407, 118.6723273, 849.2794360, -743.7792444, 427.0262186]
+LANDAU_Q4 = [1.0, 106.8615961, 337.6496214, 2016.712389, 1597.063511]
+LANDAU_P5 = [1.003675074, 167.5702434, 4789.711289, 21217.86767, -22324.94910]
+LANDAU_Q5 = [1.0, 156.9424537, 3745.310488, 9834.698876, 66924.28357]
+LANDAU_P6 = [1.000827619, 664.9143136, 62972.92665, 475554.6998, -5743609.109]
+LANDAU_Q6 = [1.0, 651.4101098, 56974.73333, 165917.4725, -2815759.939]
+LANDAU_A1 = [0.04166666667, -0.01996527778, 0.02709538966]
+LANDAU_A2 = [-1.845568670, -4.284640743]
+
+def _ratio(p, q, v):
+    num = p[0]+(p[1]+(p[2]+(p[3]+p[4]*v)*v)*v)*v
+    den = q[0]+(q[1]+(q[2]+(q[3]+q[4]*v)*v)*v)*v
+    return num/den
+
+def landau(x, mpv, sigma, norm=False):
+    '''
+    ROOT.TMath.Landau(x, mpv, sigma, norm) for an array of x
+    '''
+    x = np.asarray(x, dtype=float)
+    if sigma <= 0: return np.zeros_like(x)
+    v = np.atleast_1d((x - mpv) / sigma)
+    out = np.zeros_like(v)
+    with np.errstate(all='ignore'):
+        m = v < -5.5
+        u = np.exp(v[m] + 1.0)
+        vals = 0.3989422803 * (np.exp(-1/u)/np.sqrt(u)) * (1 + (LANDAU_A1[0] + (LANDAU_A1[1] + LANDAU_A1[2]*u)*u)*u)
+        out[m] = np.where(u < 1e-10, 0.0, vals)
+        m = (v >= -5.5) & (v < -1)
+        u = np.exp(-v[m] - 1)
+        out[m] = np.exp(-u) * np.sqrt(u) * _ratio(LANDAU_P1, LANDAU_Q1, v[m])
+        m = (v >= -1) & (v < 1)
+        out[m] = _ratio(LANDAU_P2, LANDAU_Q2, v[m])
+        m = (v >= 1) & (v < 5)
+        out[m] = _ratio(LANDAU_P3, LANDAU_Q3, v[m])
+        m = (v >= 5) & (v < 12)
+        u = 1/v[m]
+        out[m] = u*u*_ratio(LANDAU_P4, LANDAU_Q4, u)
+        m = (v >= 12) & (v < 50)
+        u = 1/v[m]
+        out[m] = u*u*_ratio(LANDAU_P5, LANDAU_Q5, u)
+        m = (v >= 50) & (v < 300)
+        u = 1/v[m]
+        out[m] = u*u*_ratio(LANDAU_P6, LANDAU_Q6, u)
+        m = v >= 300
+        u = 1/(v[m] - v[m]*np.log(v[m])/(v[m] + 1))
+        out[m] = u*u*(1 + (LANDAU_A2[0] + LANDAU_A2[1]*u)*u)
+    if norm: out /= sigma
+    return out.reshape(x.shape)
+
+def landau_value(x, mpv, sigma, norm=False):
+    '''
+    ROOT.TMath.Landau(x, mpv, sigma, norm) for one float x, without numpy
+    '''
+    if sigma <= 0: return 0.0
+    v = (x - mpv) / sigma
+    if v < -5.5:
+        u = math.exp(v + 1.0)
+        if u < 1e-10: return 0.0
+        den = 0.3989422803 * (math.exp(-1/u)/math.sqrt(u)) * (1 + (LANDAU_A1[0] + (LANDAU_A1[1] + LANDAU_A1[2]*u)*u)*u)
+    elif v < -1:
+        u = math.exp(-v - 1)
+        den = math.exp(-u) * math.sqrt(u) * _ratio(LANDAU_P1, LANDAU_Q1, v)
+    elif v < 1: den = _ratio(LANDAU_P2, LANDAU_Q2, v)
+    elif v < 5: den = _ratio(LANDAU_P3, LANDAU_Q3, v)
+    elif v < 12: den = (1/v)*(1/v)*_ratio(LANDAU_P4, LANDAU_Q4, 1/v)
+    elif v < 50: den = (1/v)*(1/v)*_ratio(LANDAU_P5, LANDAU_Q5, 1/v)
+    elif v < 300: den = (1/v)*(1/v)*_ratio(LANDAU_P6, LANDAU_Q6, 1/v)
+    else:
+        u = 1/(v - v*math.log(v)/(v + 1))
+        den = u*u*(1 + (LANDAU_A2[0] + LANDAU_A2[1]*u)*u)
+    if norm: return den / sigma
+    return den
+
+def _exp(x):
+    try:
+        return math.exp(x)
+    except OverflowError:
+        return float('inf')  # like TMath.Exp
+
+class Landau(object):
+    '''
+    norm * TMath.Landau(x, mpv, sigma)
+    '''
+    def __init__(self, norm, mpv, sigma):
+        self.norm, self.mpv, self.sigma = norm, mpv, sigma
+
+    def __call__(self, x):
+        return self.norm * landau(x, self.mpv, self.sigma)
+
+    def value(self, x):
+        return self.norm * landau_value(x, self.mpv, self.sigma)
+
+class Exponential(object):
+    '''
+    norm * TMath.Exp(slope * x)
+    '''
+    def __init__(self, slope, norm=1.0):
+        self.slope, self.norm = slope, norm
+
+    def __call__(self, x):
+        with np.errstate(over='ignore'):
+            return self.norm * np.exp(self.slope * np.asarray(x, dtype=float))
+
+    def value(self, x):
+        return self.norm * _exp(self.slope * x)
+
+class Chain(object):
+    '''
+    Piecewise function: segments[0] below bounds[0], segments[1] from bounds[0]
+    to bounds[1], etc. Each segment after the first is scaled so the function is
+    continuous at its lower bound (by y_prev/y_next, or y_prev if y_next is 0,
+    like the python functions fit_hist() used to compute at every point)
+    '''
+    def __init__(self, segments, bounds=()):
+        self.segments = list(segments)
+        self.bounds = [float(bound) for bound in bounds]
+        self.factors = [1.0]
+        for prev, following, bound in zip(self.segments[:-1], self.segments[1:], self.bounds):
+            y_prev = self.factors[-1] * prev.value(bound)
+            y_next = following.value(bound)
+            self.factors.append(y_prev if y_next == 0 else y_prev / y_next)
+
+    def __call__(self, x):
+        '''
+        Values at an array of x
+        '''
+        x = np.asarray(x, dtype=float)
+        if len(self.segments) == 1: return self.factors[0] * self.segments[0](x)
+        flat = np.atleast_1d(x)
+        segment = np.searchsorted(self.bounds, flat, side='right')
+        out = np.empty_like(flat)
+        with np.errstate(all='ignore'):
+            for k, shape in enumerate(self.segments):
+                m = segment == k
+                if m.any(): out[m] = self.factors[k] * shape(flat[m])
+        return out.reshape(x.shape)
+
+    def value(self, x):
+        '''
+        Value at one float x
+        '''
+        k = bisect.bisect_right(self.bounds, x)
+        return self.factors[k] * self.segments[k].value(x)
+
+def _cumulative_bounds(bound1, diffs):
+    if bound1 < 0: bound1 = 0
+    bounds = [bound1]
+    for d in diffs: bounds.append(bounds[-1] + d)
+    return bounds
+
+def landau_1(p):
+    return Chain([Landau(p[0], p[1], p[2])])
+
+def landau_2(p):
+    return Chain([Landau(p[0], p[1], p[2]), Landau(1.0, p[4], p[5])], [p[3]])
+
+def exp_1(p):
+    return Chain([Exponential(p[1], p[0])])
+
+def exp_2(p):
+    return Chain([Exponential(p[1], p[0]), Exponential(p[3])], [p[2]])
+
+def exp_3(p):
+    return Chain([Exponential(p[1], p[0]), Exponential(p[3]), Exponential(p[5])], [p[2], p[2] + p[4]])
+
+def full_11(p):
+    return Chain([Landau(p[0], p[1], p[2]), Exponential(p[3])], _cumulative_bounds(p[4], []))
+
+def full_12(p):
+    return Chain([Landau(p[0], p[1], p[2]), Exponential(p[3]), Exponential(p[4])],
+                 _cumulative_bounds(p[5], [p[6]]))
+
+def full_13(p):
+    return Chain([Landau(p[0], p[1], p[2]), Exponential(p[3]), Exponential(p[4]), Exponential(p[5])],
+                 _cumulative_bounds(p[6], [p[7], p[8]]))
+
+def full_21(p):
+    return Chain([Landau(p[0], p[1], p[2]), Landau(p[3], p[4], p[5]), Exponential(p[6])],
+                 _cumulative_bounds(p[7], [p[8]]))
+
+def full_24(p):
+    return Chain([Landau(p[0], p[1], p[2]), Landau(p[3], p[4], p[5]),
+                  Exponential(p[6]), Exponential(p[7]), Exponential(p[8]), Exponential(p[9])],
+                 _cumulative_bounds(p[10], [p[11], p[12], p[13], p[14]]))
+
+# (function, N) of fit_hist() -> (Chain of the parameters, number of parameters)
+CHAINS = {
+    ('landau', 1): (landau_1, 3),
+    ('landau', 2): (landau_2, 6),
+    ('exp', 1): (exp_1, 2),
+    ('exp', 2): (exp_2, 4),
+    ('exp', 3): (exp_3, 6),
+    ('full', 11): (full_11, 5),
+    ('full', 12): (full_12, 7),
+    ('full', 13): (full_13, 9),
+    ('full', 21): (full_21, 9),
+    ('full', 24): (full_24, 15),
+}
+
+def tf1_function(build, npar):
+    '''
+    Python function (x, p) of a TF1 evaluating the Chain build(p); the Chain
+    and its continuity factors are only rebuilt when the parameters change
+    '''
+    last = {'params': None, 'chain': None}
+    def func(x, p):
+        params = tuple([p[i] for i in range(npar)])
+        if not params == last['params']: last['params'], last['chain'] = params, build(params)
+        return last['chain'].value(x[0])
+    return func
+
+# parameters the chains are checked with: (function, N) -> list of parameter sets
+CHECK_PARAMS = {
+    ('landau', 1): [[1000, 2.0, 0.3], [50, 0.5, 0.05]],
+    ('landau', 2): [[1000, 2.0, 0.3, 3.0, 2.5, 0.8], [1000, 2.0, 0.3, 0.5, 30.0, 0.01]],
+    ('exp', 1): [[1000, -1.0], [5, -0.2]],
+    ('exp', 2): [[1000, -1.0, 5.0, -0.3]],
+    ('exp', 3): [[1000, -2.0, 3.0, -0.8, 4.0, -0.2]],
+    ('full', 11): [[1000, 1.0, 0.2, -3.0, 1.5], [1000, 1.0, 0.2, -3.0, -1.0]],
+    ('full', 12): [[1000, 1.0, 0.2, -3.0, -1.0, 1.5, 2.0]],
+    ('full', 13): [[1000, 1.0, 0.2, -3.0, -1.0, -0.5, 1.5, 2.0, 3.0]],
+    ('full', 21): [[1000, 1.0, 0.5, 800, 1.2, 0.5, -3.0, 1.0, 1.0]],
+    ('full', 24): [[1000, 1.0, 0.5, 800, 1.2, 0.5, -3.0, -1.0, -0.5, -0.25, 1.0, 1.0, 2.0, 3.0, 4.0]],
+}
+
+# Reference values of TMath.Landau(x, mpv, sigma, norm), TMath.Exp(x) and of
+# CHAINS[key](CHECK_PARAMS[key][0]) at x, for the checks without ROOT: the
+# DENLAN branches of ROOT::Math::landau_pdf (same coefficients, v computed in
+# double like TMath.Landau) and exp evaluated with 40 digits (decimal), and
+# the chains with their continuity factors recomputed at every point like the
+# old fit_hist() functions. The Landau points include both sides of every
+# branch boundary (v = b - 2**-20 and b) and the far tails.
+LANDAU_REFERENCE = [
+    (-25.0, 0.0, 1.0, False, 0.0),
+    (-7.5, 0.0, 1.0, False, 1.3965400722567483e-288),
+    (-7.0, 0.0, 1.0, False, 4.9766770113901625e-175),
+    (-6.5, 0.0, 1.0, False, 3.3646333449839355e-106),
+    (-5.500000953674316, 0.0, 1.0, False, 3.049945630022269e-39),
+    (-5.5, 0.0, 1.0, False, 3.050206023135759e-39),
+    (-3.0, 0.0, 1.0, False, 0.0006737286156950519),
+    (-1.0000009536743164, 0.0, 1.0, False, 0.15139183536921502),
+    (-1.0, 0.0, 1.0, False, 0.1513919113594072),
+    (0.0, 0.0, 1.0, False, 0.1788541609),
+    (0.5, 0.0, 1.0, False, 0.16523227536871804),
+    (0.9999990463256836, 0.0, 1.0, False, 0.1452066776970283),
+    (1.0, 0.0, 1.0, False, 0.14520663713086202),
+    (3.0, 0.0, 1.0, False, 0.07424765455676449),
+    (4.999999046325684, 0.0, 1.0, False, 0.03916343052588353),
+    (5.0, 0.0, 1.0, False, 0.03916341957924748),
+    (8.0, 0.0, 1.0, False, 0.018090283936233322),
+    (11.999999046325684, 0.0, 1.0, False, 0.008421790368491753),
+    (12.0, 0.0, 1.0, False, 0.008421789054153419),
+    (30.0, 0.0, 1.0, False, 0.001298671406299767),
+    (49.999999046325684, 0.0, 1.0, False, 0.0004496494856566713),
+    (50.0, 0.0, 1.0, False, 0.0004496494673974602),
+    (100.0, 0.0, 1.0, False, 0.00010761122391164614),
+    (299.9999990463257, 0.0, 1.0, False, 1.1471530446353206e-05),
+    (300.0, 0.0, 1.0, False, 1.1471525661173314e-05),
+    (1000.0, 0.0, 1.0, False, 1.0120571850657368e-06),
+    (100000.0, 0.0, 1.0, False, 1.0002118334851486e-10),
+    (-1.5, 2.0, 0.5, True, 9.953354022780325e-175),
+    (0.5, 2.0, 0.5, True, 0.0013474572313901037),
+    (2.25, 2.0, 0.5, True, 0.3304645507374361),
+    (6.0, 2.0, 0.5, True, 0.036180567872466644),
+    (52.0, 2.0, 0.5, True, 0.00021522244782329228),
+    (502.0, 2.0, 0.5, True, 2.0241143701314736e-06),
+]
+EXP_REFERENCE = [
+    (-500.0, 7.124576406741286e-218),
+    (-50.0, 1.9287498479639178e-22),
+    (-20.0, 2.061153622438558e-09),
+    (-3.0, 0.049787068367863944),
+    (-0.125, 0.8824969025845955),
+    (0.0, 1.0),
+    (1.5, 4.4816890703380645),
+    (20.0, 485165195.4097903),
+]
+CHAIN_REFERENCE = [
+    (('landau', 2), 1.0, 0.0427276357632316),
+    (('landau', 2), 3.0, 66.31267945635263),
+    (('landau', 2), 4.0, 45.230502815189816),
+    (('exp', 3), 1.0, 135.3352832366127),
+    (('exp', 3), 3.0, 2.4787521766663585),
+    (('exp', 3), 5.0, 0.5004514334406106),
+    (('exp', 3), 7.0, 0.10103940183709333),
+    (('exp', 3), 20.0, 0.007504557915076861),
+    (('full', 11), 0.5, 9.636924785912493),
+    (('full', 11), 1.5, 88.2242009161481),
+    (('full', 11), 2.0, 19.68548007938738),
+    (('full', 11), 10.0, 7.431533586841332e-10),
+    (('full', 21), 0.5, 151.3919113594072),
+    (('full', 21), 1.0, 178.8541609),
+    (('full', 21), 1.5, 161.0789817559672),
+    (('full', 21), 2.0, 119.85189244710368),
+    (('full', 21), 6.0, 0.0007363954781432583),
+    (('full', 24), 0.5, 151.3919113594072),
+    (('full', 24), 1.0, 178.8541609),
+    (('full', 24), 1.5, 161.0789817559672),
+    (('full', 24), 2.0, 119.85189244710368),
+    (('full', 24), 3.5, 1.331434258296664),
+    (('full', 24), 5.0, 0.10929077926009338),
+    (('full', 24), 8.0, 0.008971133465169591),
+    (('full', 24), 15.0, 0.0007363954781432583),
+]
+
+def _compare(name, values, reference, rtol, atol, failed, verbose):
+    '''
+    Values have to agree to rtol times the reference value or atol times the
+    largest reference value of the check, whichever is larger (far in the
+    tails, where exp() of a large argument amplifies the last bit of its
+    argument, only the second holds); the name of a failed check is added to failed
+    '''
+    values, reference = np.asarray(values, dtype=float), np.asarray(reference, dtype=float)
+    scale = np.maximum(np.abs(reference), atol / rtol * np.max(np.abs(reference)))
+    scale = np.maximum(scale, 1e-300)
+    worst = float(np.max(np.abs(values - reference) / scale))
+    if not worst <= rtol: failed.append(name)
+    if verbose: print('{:<40} max rel. diff {:.2e}{}'.format(name, worst, '' if worst <= rtol else '  FAILED'))
+
+def check_reference(rtol=1e-12, verbose=True):
+    '''
+    Compares the kernels with the reference values, without ROOT; returns the failed checks
+    '''
+    failed = []
+    for x, mpv, sigma, norm, reference in LANDAU_REFERENCE:
+        name = 'reference landau({!r}, {}, {}, norm={})'.format(x, mpv, sigma, norm)
+        _compare(name, landau([x], mpv, sigma, norm), [reference], rtol, 0.0, failed, False)
+        _compare(name + ' scalar', [landau_value(x, mpv, sigma, norm)], [reference], rtol, 0.0, failed, False)
+    if verbose:
+        for name in failed: print('{:<40} FAILED'.format(name))
+        print('{:<40} {} of {} values agree'.format('reference landau', 2*len(LANDAU_REFERENCE) - len(failed), 2*len(LANDAU_REFERENCE)))
+    x, reference = [np.array(column) for column in zip(*EXP_REFERENCE)]
+    _compare('reference exp', Exponential(1.0)(x), reference, rtol, 0.0, failed, verbose)
+    _compare('reference exp scalar', [Exponential(1.0).value(xi) for xi in x], reference, rtol, 0.0, failed, verbose)
+    for key in sorted(set(row[0] for row in CHAIN_REFERENCE)):
+        build, npar = CHAINS[key]
+        params = CHECK_PARAMS[key][0]
+        x = np.array([row[1] for row in CHAIN_REFERENCE if row[0] == key])
+        reference = [row[2] for row in CHAIN_REFERENCE if row[0] == key]
+        name = 'reference {} {}'.format(key[0], key[1])
+        _compare(name, build(params)(x), reference, rtol, 0.0, failed, verbose)
+        func = tf1_function(build, npar)
+        _compare(name + ' tf1', [func([xi], params) for xi in x], reference, rtol, 0.0, failed, verbose)
+    return failed
+
+def _root_chain(segments, bounds, x):
+    '''
+    Reference: a chain evaluated at one x with ROOT.TMath, factors recomputed at the point
+    '''
+    factor, value = 1.0, segments[0](x)
+    for k, bound in enumerate(bounds):
+        if x < bound: break
+        y_prev = factor * segments[k](bound)
+        y_next = segments[k+1](bound)
+        factor = y_prev if y_next == 0 else y_prev / y_next
+        value = factor * segments[k+1](x)
+    return value
+
+def _root_segments(chain, ROOT):
+    segments = []
+    for segment in chain.segments:
+        if isinstance(segment, Landau): segments.append(lambda x, s=segment: s.norm * ROOT.TMath.Landau(x, s.mpv, s.sigma))
+        else: segments.append(lambda x, s=segment: s.norm * ROOT.TMath.Exp(s.slope * x))
+    return segments
+
+def check_root_parity(rtol=1e-12, atol=1e-15, verbose=True):
+    '''
+    Compares the kernels with ROOT.TMath point by point, returns the failed checks (see _compare())
+    '''
+    import ROOT
+    failed = []
+    def check(name, values, reference):
+        _compare(name, values, reference, rtol, atol, failed, verbose)
+
+    # every branch of DENLAN: v from -8 to 2000
+    v = np.concatenate([np.linspace(-8, -5.5, 101), np.linspace(-5.5, 1, 301), np.linspace(1, 12, 201),
+                        np.linspace(12, 300, 201), np.linspace(300, 2000, 51)])
+    for mpv, sigma in [(0.0, 1.0), (2.0, 0.3), (0.5, 0.05)]:
+        x = mpv + sigma * v
+        for norm in [False, True]:
+            reference = [ROOT.TMath.Landau(xi, mpv, sigma, norm) for xi in x]
+            name = 'landau({}, {}, norm={})'.format(mpv, sigma, norm)
+            check(name, landau(x, mpv, sigma, norm), reference)
+            check(name + ' scalar', [landau_value(xi, mpv, sigma, norm) for xi in x], reference)
+    x = np.linspace(0, 50, 1001)
+    for slope in [-10.0, -1.0, -0.01]:
+        check('exp({})'.format(slope), Exponential(slope)(x), [ROOT.TMath.Exp(slope * xi) for xi in x])
+
+    # the models, also at their bounds
+    for key in sorted(CHAINS):
+        build, npar = CHAINS[key]
+        for params in CHECK_PARAMS[key]:
+            chain = build(params)
+            points = np.sort(np.concatenate([np.linspace(0, 20, 801), chain.bounds]))
+            segments = _root_segments(chain, ROOT)
+            reference = [_root_chain(segments, chain.bounds, xi) for xi in points]
+            name = '{} {} {}'.format(key[0], key[1], params)
+            check(name, chain(points), reference)
+            func = tf1_function(build, npar)
+            check(name + ' tf1', [func([xi], params) for xi in points], reference)
+    return failed
+
+if __name__ == "__main__":
+    failed = check_reference()
+    try:
+        import ROOT
+    except ImportError:
+        ROOT = None
+        print('ROOT can not be imported, skipped the comparison with ROOT.TMath')
+    if ROOT is not None: failed += check_root_parity()
+    if failed:
+        print('{} checks failed'.format(len(failed)))
+        sys.exit(1)
+    print('all checks passed')
@@ -0,0 +1,104 @@
+'''
+Solver for the tight fit
+
+The tight fit model, loose template times a polynomial, is linear in the
+polynomial coefficients: mu = A c with A[i, j] = template(x_i) * basis_j(x_i).
+Instead of running Minuit on the TF1 from MultiplyWithPolyToTF1(), the binned
+Poisson likelihood is maximized directly on the design matrix A by iteratively
+reweighted least squares. For Bernstein polynomials (and the constant fit) the
+coefficients must be positive, so each reweighted step is solved with NNLS.
+'''
+import numpy as np
+import fitting_utils as util
+import vectorized_fitting as vfit
+import basis_cache
+
+def _evaluate(func, x):
+    if hasattr(func, 'evaluate'): return func.evaluate(x)  # ArrayTemplate
+    return np.array([func([xi]) for xi in x])
+
+def design_matrix(func, lows, widths, degree, poly=0, integral=False):
+    '''
+    A[i, j] = func(x) * B_j(x) at the bin centers, or averaged over each bin if integral=True
+
+    func: python function of x (x[0] is used) or ArrayTemplate, e.g. from HistogramToFunction()
+    '''
+    if not integral:
+        x = lows + widths/2.0
+        template = _evaluate(func, x)
+        edges = np.append(lows, lows[-1] + widths[-1])
+        return template[:, None] * basis_cache.basis_matrix(poly, degree, edges)
+    x = (lows[:, None] + widths[:, None] * (vfit.GAUSS_POINTS[None, :] + 1)/2.0).ravel()
+    template = _evaluate(func, x)
+    cols = template[:, None] * basis_cache.evaluate_basis(x, degree, poly)
+    cols = cols.reshape(len(lows), len(vfit.GAUSS_POINTS), degree+1)
+    return np.einsum('ikj,k->ij', cols, vfit.GAUSS_WEIGHTS) / 2.0
+
+def _weighted_solve(A, y, w, positive):
+    sw = np.sqrt(w)
+    if positive:
+        from scipy.optimize import nnls
+        return nnls(A * sw[:, None], y * sw)[0]
+    return np.linalg.lstsq(A * sw[:, None], y * sw, rcond=None)[0]
+
+def solve(A, y, positive=False, method='irls', max_iter=100, tol=1e-8, floor=1e-6):
+    '''
+    Fit y ~ Poisson(A c)
+
+    method: 'wls' stops after the weighted least squares start (weights 1/y),
+            'irls' iterates to the maximum likelihood solution (weights 1/mu)
+    positive: constrain all coefficients to be >= 0
+
+    Returns coefficients, covariance, negative log-likelihood, number of
+    iterations and whether the iteration converged
+    '''
+    used = np.any(A != 0, axis=1)
+    A_used, y_used = A[used], y[used]
+    coeffs = _weighted_solve(A_used, y_used, 1.0/np.maximum(y_used, 1), positive)
+    nll = vfit.poisson_nll(A.dot(coeffs), y)
+    converged = method == 'wls'
+    n_iter = 0
+    while not converged and n_iter < max_iter:
+        n_iter += 1
+        mu = np.maximum(A_used.dot(coeffs), floor)
+        new_coeffs = _weighted_solve(A_used, y_used, 1.0/mu, positive)
+        new_nll = vfit.poisson_nll(A.dot(new_coeffs), y)
+        step = 1.0
+        while new_nll > nll and step > 1e-3:  # damp steps that overshoot
+            step /= 2
+            new_coeffs = coeffs + step*(new_coeffs - coeffs)
+            new_nll = vfit.poisson_nll(A.dot(new_coeffs), y)
+        converged = abs(nll - new_nll) <= tol * max(abs(nll), 1) or np.allclose(new_coeffs, coeffs, rtol=tol, atol=0)
+        if new_nll <= nll: coeffs, nll = new_coeffs, new_nll
+        else: break
+    mu = np.maximum(A_used.dot(coeffs), floor)
+    fisher = (A_used / mu[:, None]).T.dot(A_used)
+    covariance = np.linalg.pinv(fisher)
+    return coeffs, covariance, nll, n_iter, converged
+
+def fit_template_poly(hist, func, degree, poly=0, range_low=0, range_high=50, integral=False, method='irls'):
+    '''
+    Replacement for hist.Fit() on the TF1 from MultiplyWithPolyToTF1(func, degree, poly=poly)
+
+    Returns the TF1 (with the fitted parameters) and a FitResult
+    '''
+    tf1, _, _ = util.MultiplyWithPolyToTF1(func, degree, range_low, range_high, poly=poly)
+    lows, widths, contents = vfit.hist_arrays(hist)
+    centers = lows + widths/2.0
+    in_range = (centers >= range_low) & (centers <= range_high)
+    lows, widths, contents = lows[in_range], widths[in_range], contents[in_range]
+
+    A = design_matrix(func, lows, widths, degree, poly=poly, integral=integral)
+    positive = poly == 3 or degree == 0
+    coeffs, covariance, nll, n_iter, converged = solve(A, contents, positive=positive, method=method)
+
+    errors = np.sqrt(np.abs(np.diag(covariance)))
+    ndf = int(np.count_nonzero(np.any(A != 0, axis=1)) - len(coeffs))
+    result = vfit.FitResult(coeffs, errors, covariance, nll, ndf, 0 if converged else 4, 0.0, n_iter)
+    for i in range(len(coeffs)):
+        tf1.SetParameter(i, coeffs[i])
+        tf1.SetParError(i, errors[i])
+    tf1.SetChisquare(result.Chi2())
+    tf1.SetNDF(result.Ndf())
+    vfit.attach_function(hist, tf1)
+    return tf1, result
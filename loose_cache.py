@@ -0,0 +1,85 @@
+'''
+Content-addressed cache of loose fit templates
+
+A loose fit is identified by a sha1 of everything it is computed from:
+
+  - the bin contents and edges of the input loose histogram
+  - the model and initial guesses of lookup_fit_guesses()
+  - the fit ranges derived from the histogram and the fit settings (backend, ...)
+  - the code version: CODE_VERSION and the sources in CODE_FILES, without
+    lookup_fit_guesses() (the guesses of each bin are in its settings)
+
+run_fitter refits a bin only when its key is not in the cache, so changing
+one input histogram or guess refits exactly the bins it affects. The cache
+lives outside the input directory (BKGFIT_CACHE or ~/.cache/bkgfitting by
+default), so input directories with identical histograms share their fits.
+
+Every entry is one <key>.npy with the 1000 bins of the loose fit template,
+written atomically so parallel workers can fill the cache at the same time.
+Parameters recorded in the param_store are not part of the key: they are
+converged values of the same fits, and would otherwise invalidate a bin on
+every run.
+'''
+import os
+import json
+import hashlib
+import numpy as np
+import pipeline
+
+CODE_VERSION = 1  # bump when the loose fit procedure in run_fitter changes
+CODE_FILES = ['fitting_utils.py', 'vectorized_fitting.py', 'kernels.py']
+
+def default_directory():
+    base = os.environ.get('BKGFIT_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'bkgfitting'))
+    return os.path.join(base, 'loose_fits')
+
+_code_hash = None
+def code_hash():
+    '''
+    sha1 of CODE_VERSION and the fitting sources, computed once per process
+
+    lookup_fit_guesses() is left out (pipeline.source_hash()), so editing the
+    guesses of one bin only changes the key of that bin
+    '''
+    global _code_hash
+    if _code_hash is None:
+        sha1 = hashlib.sha1(str(CODE_VERSION).encode('utf-8'))
+        sha1.update(pipeline.source_hash(CODE_FILES).encode('utf-8'))
+        _code_hash = sha1.hexdigest()
+    return _code_hash
+
+def fit_key(contents, edges, settings):
+    '''
+    Key of a loose fit of a histogram with contents and edges, settings is a json-serializable dict
+    '''
+    sha1 = hashlib.sha1(code_hash().encode('utf-8'))
+    sha1.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+    sha1.update(np.ascontiguousarray(contents, dtype=np.float64).tobytes())
+    sha1.update(np.ascontiguousarray(edges, dtype=np.float64).tobytes())
+    return sha1.hexdigest()
+
+class LooseFitCache(object):
+    def __init__(self, directory=None):
+        self.directory = os.path.abspath(directory if directory is not None else default_directory())
+        if not os.path.exists(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # made by another process in the meantime
+                if not os.path.isdir(self.directory): raise
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.npy')
+
+    def get(self, key):
+        '''
+        Bin contents of the cached loose fit, None if there is none
+        '''
+        path = self._path(key)
+        if not os.path.exists(path): return None
+        return np.load(path)
+
+    def put(self, key, contents):
+        path = self._path(key)
+        tmp = '{}.{}.tmp.npy'.format(path[:-len('.npy')], os.getpid())
+        np.save(tmp, np.asarray(contents, dtype=np.float64))
+        os.rename(tmp, path)
@@ -0,0 +1,114 @@
+'''
+Scoped ownership of the TF1s, python callbacks and temporary histograms of the fits
+
+The python function of a TF1 has to stay alive as long as the TF1. Instead of
+being stored for the whole run, the functions, TF1s and TemplateToHistogram()
+histograms are kept by the innermost open scope:
+
+  with object_registry.scope('iso_asym_barrel_100_140'):
+      object_registry.adopt_fits(h_tight, h_loose)
+      ...  # fit_hist(), MultiplyWithPolyToTF1(), TemplateToHistogram()
+
+or for every call of a function decorated with @object_registry.scoped
+
+and released when the scope closes. The copies of the fitted functions that
+hist.Fit() attaches to the adopted histograms are deleted first, so none of
+them outlives the python function it calls. Objects made outside of any scope
+stay alive for the whole run, as before.
+
+stats() has the number of live objects of each kind and their peak over the
+run, which stays flat across bins when every bin runs in its own scope.
+'''
+from __future__ import print_function
+import functools
+from contextlib import contextmanager
+
+KINDS = ['callback', 'tf1', 'hist']
+
+class Scope(object):
+    def __init__(self, name):
+        self.name = name
+        self.objects = []
+        self.fitted = []
+
+class Registry(object):
+    def __init__(self):
+        self.scopes = [Scope('global')]
+        self.live = dict((kind, 0) for kind in KINDS)
+        self.peak = dict((kind, 0) for kind in KINDS)
+        self.created = dict((kind, 0) for kind in KINDS)
+        self.peak_total = 0
+
+    def keep(self, obj, kind):
+        '''
+        Keeps obj alive until the current scope closes, returns obj
+        '''
+        self.scopes[-1].objects.append((kind, obj))
+        self.live[kind] += 1
+        self.created[kind] += 1
+        self.peak[kind] = max(self.peak[kind], self.live[kind])
+        self.peak_total = max(self.peak_total, sum(self.live.values()))
+        return obj
+
+    def adopt_fits(self, *hists):
+        self.scopes[-1].fitted += hists
+
+    def release(self, scope):
+        for hist in scope.fitted:
+            functions = hist.GetListOfFunctions()
+            if functions: functions.Delete()
+        for kind, _ in scope.objects: self.live[kind] -= 1
+        del scope.objects[:]
+        del scope.fitted[:]
+
+    @contextmanager
+    def scope(self, name):
+        current = Scope(name)
+        self.scopes.append(current)
+        try:
+            yield current
+        finally:
+            self.scopes.remove(current)
+            self.release(current)
+
+    def merge(self, stats):
+        '''
+        Takes the peaks of a registry of another process (its stats()) into account
+        '''
+        for kind in KINDS: self.peak[kind] = max(self.peak[kind], stats['peak'][kind])
+        self.peak_total = max(self.peak_total, stats['peak_total'])
+
+    def stats(self):
+        return {'live': dict(self.live), 'peak': dict(self.peak), 'created': dict(self.created), 'peak_total': self.peak_total}
+
+REGISTRY = Registry()
+
+def keep(obj, kind):
+    return REGISTRY.keep(obj, kind)
+
+def scope(name):
+    return REGISTRY.scope(name)
+
+def scoped(func):
+    '''
+    Decorator, runs every call of func in its own scope
+    '''
+    @functools.wraps(func)
+    def in_scope(*args, **kwargs):
+        with REGISTRY.scope(func.__name__): return func(*args, **kwargs)
+    return in_scope
+
+def adopt_fits(*hists):
+    '''
+    Deletes the functions attached to hists by their fits when the current scope closes
+    '''
+    REGISTRY.adopt_fits(*hists)
+
+def stats():
+    return REGISTRY.stats()
+
+def print_stats():
+    stats = REGISTRY.stats()
+    print('fit objects: peak {} live ({}), {} live now, {} created'.format(stats['peak_total'],
+        ', '.join('{} {}'.format(stats['peak'][kind], kind) for kind in KINDS),
+        sum(stats['live'].values()), sum(stats['created'].values())))
@@ -0,0 +1,89 @@
+'''
+Merging of pdf pages written by separate processes
+
+ROOT can't append to a multi-page pdf that another process has open, so when
+bins are run in parallel every task prints its pages to its own file and the
+files are merged in order at the end. pdfunite (poppler) or ghostscript is used
+when installed, otherwise pypdf/PyPDF2.
+
+PageCache keeps such per-bin pages between runs, with the hash of the inputs
+each page was drawn from, so only the pages whose inputs changed are drawn again.
+'''
+import os
+import json
+import shutil
+import subprocess
+
+INDEX_NAME = 'pages.json'
+
+def _run(cmd):
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.call(cmd, stdout=devnull, stderr=devnull) == 0
+    except OSError:  # executable not found
+        return False
+
+def _merge_python(inputs, output):
+    try:
+        from pypdf import PdfWriter, PdfReader
+    except ImportError:
+        try:
+            from PyPDF2 import PdfFileWriter as PdfWriter, PdfFileReader as PdfReader
+        except ImportError:
+            return False
+    writer = PdfWriter()
+    for name in inputs:
+        reader = PdfReader(name)
+        pages = reader.pages if hasattr(reader, 'pages') else [reader.getPage(n) for n in range(reader.getNumPages())]
+        for page in pages:
+            if hasattr(writer, 'add_page'): writer.add_page(page)
+            else: writer.addPage(page)
+    with open(output, 'wb') as f: writer.write(f)
+    return True
+
+def merge_pdfs(inputs, output):
+    '''
+    Concatenates the pdf files in inputs, in order, into output
+    '''
+    inputs = list(inputs)
+    if not inputs: raise ValueError('merge_pdfs(): no input files')
+    if len(inputs) == 1:
+        shutil.copyfile(inputs[0], output)
+        return
+    if _run(['pdfunite'] + inputs + [output]): return
+    if _run(['gs', '-q', '-dBATCH', '-dNOPAUSE', '-sDEVICE=pdfwrite', '-sOutputFile=' + output] + inputs): return
+    if _merge_python(inputs, output): return
+    raise RuntimeError('merge_pdfs(): need pdfunite, ghostscript, pypdf or PyPDF2 to merge pages into ' + output)
+
+class PageCache(object):
+    '''
+    Directory of page files (pdf or png), one per name, with the input hash of each in pages.json
+    '''
+    def __init__(self, directory, ext='pdf'):
+        self.directory = directory
+        self.ext = ext
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        if not os.path.exists(directory): os.makedirs(directory)
+        self.keys = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f: self.keys = json.load(f)
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.' + self.ext)
+
+    def valid(self, name, key):
+        '''
+        True if the page of name exists and was drawn from inputs with hash key
+        '''
+        return self.keys.get(os.path.basename(self.path(name))) == key and os.path.exists(self.path(name))
+
+    def forget(self, name):
+        self.keys.pop(os.path.basename(self.path(name)), None)
+
+    def record(self, name, key):
+        self.keys[os.path.basename(self.path(name))] = key
+
+    def save(self):
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f: json.dump(self.keys, f, indent=1, sort_keys=True)
+        os.rename(tmp, self.index_path)
@@ -0,0 +1,103 @@
+'''
+Persistent store of converged loose fit parameters
+
+Parameters from successful fit_hist() calls are saved to a json file, keyed by
+the (region, eta region, pt bin) of the histogram and the model shape (function
+and N). On later runs they are used as initial guesses in place of the hand
+tuned values of lookup_fit_guesses(), which stays as the fallback for bins and
+shapes that have not converged yet.
+
+The file has a schema version; a file written with a different version is
+ignored and replaced. Every entry keeps a revision counter that goes up each
+time it is overwritten.
+'''
+from __future__ import print_function
+import os
+import json
+import time
+from artifact_store import locked
+
+SCHEMA_VERSION = 1
+DEFAULT_NAME = 'fit_params.json'
+
+def bin_key(region, eta_reg, pt_bin):
+    return '{}/{}/{}'.format(region, eta_reg, pt_bin)
+
+def model_key(function, N):
+    return '{}/{}'.format(function, N)
+
+def fit_succeeded(fit_result):
+    '''
+    Status 0 and a valid minimum, for TFitResultPtr and vectorized_fitting.FitResult alike
+    '''
+    try:
+        return int(fit_result.Status()) == 0 and bool(fit_result.IsValid())
+    except (AttributeError, ReferenceError):  # null TFitResultPtr, e.g. fit without 'S'
+        return False
+
+class ParamStore(object):
+    '''
+    store.get(key, function, N) returns the stored parameters or None
+    store.record(key, function, N, tf1, fit_result) saves the parameters of a successful fit
+    '''
+    def __init__(self, path=DEFAULT_NAME, autosave=True):
+        self.path = os.path.abspath(path)
+        self.autosave = autosave
+        self.updated = set()  # (key, model) entries changed by this process
+        self.entries = self._read(verbose=True)
+
+    def _read(self, verbose=False):
+        if not os.path.exists(self.path): return {}
+        with open(self.path) as f: stored = json.load(f)
+        if stored.get('version') == SCHEMA_VERSION: return stored.get('entries', {})
+        if verbose: print('ParamStore: ignoring {} with schema version {}, expected {}'.format(self.path, stored.get('version'), SCHEMA_VERSION))
+        return {}
+
+    def get(self, key, function, N, npar=None):
+        entry = self.entries.get(key, {}).get(model_key(function, N))
+        if entry is None: return None
+        if npar is not None and not len(entry['parameters']) == npar: return None
+        return list(entry['parameters'])
+
+    def record(self, key, function, N, tf1, fit_result, range_low=None, range_high=None):
+        '''
+        Saves the parameters of tf1 if fit_result is a successful fit, returns whether it did
+        '''
+        if not fit_succeeded(fit_result): return False
+        models = self.entries.setdefault(key, {})
+        previous = models.get(model_key(function, N), {})
+        models[model_key(function, N)] = {
+            'parameters': [tf1.GetParameter(i) for i in range(tf1.GetNpar())],
+            'errors': [tf1.GetParError(i) for i in range(tf1.GetNpar())],
+            'chi2': tf1.GetChisquare(),
+            'ndf': tf1.GetNDF(),
+            'range': [range_low, range_high],
+            'revision': previous.get('revision', 0) + 1,
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        self.updated.add((key, model_key(function, N)))
+        if self.autosave: self.save()
+        return True
+
+    def merge(self, key, models):
+        '''
+        Adds the entries for key recorded by another ParamStore, e.g. in a worker process
+        '''
+        if not models: return
+        self.entries.setdefault(key, {}).update(models)
+        for model in models: self.updated.add((key, model))
+        if self.autosave: self.save()
+
+    def save(self):
+        '''
+        Writes the store, keeping the entries other processes saved since it was read
+        '''
+        with locked(self.path + '.lock'):
+            for key, models in self._read().items():
+                for model, entry in models.items():
+                    if (key, model) not in self.updated: self.entries.setdefault(key, {})[model] = entry
+            # write to a temporary file first so an interrupted run can't leave a truncated store
+            tmp = '{}.{}.tmp'.format(self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump({'version': SCHEMA_VERSION, 'entries': self.entries}, f, indent=1, sort_keys=True)
+            os.rename(tmp, self.path)
@@ -0,0 +1,228 @@
+'''
+Incremental driver of the whole chain: run_scaler, run_fitter, run_plotter and process_for_BAT
+
+Every (region, eta region, pt bin) is a task per stage, run as the usual
+script with --testBin, and the tasks form a DAG:
+
+  scale/<bin>  ->  fit/<bin>  ->  plot/<bin>  ->  merge_plots
+                             \\->  merge_fits
+  scale/*, fit/* of the control regions  ->  bat
+
+Each task has a signature, a sha1 of what it is computed from: the input
+histograms of its bin (from the histogram cache), its lookup_fit_guesses()
+entry, the sources of its stage, the extra options passed to the script and
+the signatures of the tasks it depends on. Signatures of finished tasks are
+kept in pipeline_state.json in the input directory, and a task only runs if its
+signature changed, so editing the guesses of one bin reruns the fit and plot
+of that bin and the final merges and export. Independent tasks run in parallel
+with --jobs.
+
+The per-bin pages are written to pipeline_pages/ and merged into fits.pdf and
+plots.pdf, logs of the scripts go to pipeline_logs/.
+'''
+from __future__ import print_function
+import os
+import sys
+import re
+import json
+import time
+import shlex
+import hashlib
+import argparse
+import subprocess
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+import constants as VALS
+import hist_cache
+import pages
+
+STATE_NAME = 'pipeline_state.json'
+PAGES_DIR = 'pipeline_pages'
+LOGS_DIR = 'pipeline_logs'
+STAGES = ['scale', 'fit', 'plot', 'bat']
+REGIONS = ["iso_sym", "iso_asym", "noniso_sym", "noniso_asym"]
+ETA_REGIONS = ["barrel", "endcap"]
+SIGNAL_REGION = "iso_sym"
+
+# sources each stage depends on; the guesses in fitting_utils are tracked per bin instead
+CODE = {
+    'scale': ['run_scaler.py', 'fitting_utils.py', 'downsampling.py', 'artifact_store.py', 'hist_cache.py', 'constants.py'],
+    'fit': ['run_fitter.py', 'fitting_utils.py', 'kernels.py', 'linear_fitting.py', 'vectorized_fitting.py', 'fit_statistics.py', 'degree_scan.py',
+            'basis_cache.py', 'array_template.py', 'stat_boxes.py', 'loose_cache.py', 'param_store.py', 'fit_metadata.py', 'artifact_store.py', 'hist_cache.py', 'constants.py'],
+    'plot': ['run_plotter.py', 'fitting_utils.py', 'fit_metadata.py', 'artifact_store.py', 'hist_cache.py', 'pages.py', 'constants.py'],
+    'bat': ['process_for_BAT.py', 'bat_bundle.py', 'artifact_store.py', 'hist_cache.py'],
+}
+HERE = os.path.dirname(os.path.abspath(__file__))
+GUESSES_PATTERN = re.compile(r'^def lookup_fit_guesses\(.*?(?=^def |\Z)', re.M | re.S)
+
+def source_hash(names):
+    sha1 = hashlib.sha1()
+    for name in names:
+        with open(os.path.join(HERE, name)) as f: source = f.read()
+        if name == 'fitting_utils.py': source = GUESSES_PATTERN.sub('', source)
+        sha1.update(name.encode('utf-8'))
+        sha1.update(source.encode('utf-8'))
+    return sha1.hexdigest()
+
+def bin_name(region, eta_reg, i):
+    if i == len(VALS.PT_EDGES) - 1: return region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+"
+    return region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1])
+
+class Task(object):
+    '''
+    One node of the DAG: a command (argv list) or a python callable, and the tasks it needs first
+    '''
+    def __init__(self, name, stage, inputs, deps=(), command=None, action=None):
+        self.name = name
+        self.stage = stage
+        self.inputs = inputs
+        self.deps = list(deps)
+        self.command = command
+        self.action = action
+        sha1 = hashlib.sha1(json.dumps([name, command, inputs], sort_keys=True).encode('utf-8'))
+        for dep in self.deps: sha1.update(dep.signature.encode('utf-8'))
+        self.signature = sha1.hexdigest()
+
+def build_tasks(directory, cache, options):
+    '''
+    Returns the list of tasks in topological order
+    '''
+    def contents_hash(region, eta_reg, pt, kinds=('tight',)):
+        # every cached histogram of the bin: pt binned and all phi slices
+        sha1 = hashlib.sha1()
+        for key in sorted(cache.keys, key=str):
+            if key[0] == region and key[1] == eta_reg and key[2] == pt and key[4] in kinds:
+                sha1.update(str(key).encode('utf-8'))
+                sha1.update(cache.contents(cache.keys[key]).tobytes())
+        return sha1.hexdigest()
+    import fitting_utils as util
+    script = lambda name: [sys.executable, os.path.join(HERE, name), directory]
+    code = dict((stage, source_hash(names)) for stage, names in CODE.items())
+    tasks, scales, fits, plots = [], OrderedDict(), OrderedDict(), OrderedDict()
+    for region in REGIONS:
+        for i in range(len(VALS.PT_EDGES)):
+            for eta_reg in ETA_REGIONS:
+                name = bin_name(region, eta_reg, i)
+                pt = VALS.PT_EDGES[i]
+                test_bin = "{} {} {}".format(region, eta_reg, pt)
+                deps = []
+                if not region == SIGNAL_REGION:
+                    scales[name] = Task('scale/' + name, 'scale',
+                        [code['scale'], contents_hash(region, eta_reg, pt), contents_hash(SIGNAL_REGION, eta_reg, pt)],
+                        command=script('run_scaler.py') + ['--testBin', test_bin] + shlex.split(options.scalerArgs))
+                    tasks.append(scales[name])
+                    deps.append(scales[name])
+                guesses = util.lookup_fit_guesses(region, eta_reg, pt)
+                fits[name] = Task('fit/' + name, 'fit',
+                    [code['fit'], contents_hash(region, eta_reg, pt, ('tight', 'loose')), guesses], deps,
+                    command=script('run_fitter.py') + ['--testBin', test_bin, '--name', os.path.join(PAGES_DIR, 'fit_' + name)] + shlex.split(options.fitterArgs))
+                plots[name] = Task('plot/' + name, 'plot', [code['plot']], [fits[name]],
+                    command=script('run_plotter.py') + ['--testBin', test_bin, '--name', os.path.join(PAGES_DIR, 'plot_' + name)] + shlex.split(options.plotterArgs))
+                tasks += [fits[name], plots[name]]
+    def merger(prefix, output):
+        inputs = [os.path.join(directory, PAGES_DIR, prefix + name + '.pdf') for name in fits]
+        return lambda: pages.merge_pdfs([path for path in inputs if os.path.exists(path)], os.path.join(directory, output))
+    tasks.append(Task('merge_fits', 'fit', [], list(fits.values()), action=merger('fit_', 'fits.pdf')))
+    tasks.append(Task('merge_plots', 'plot', [], list(plots.values()), action=merger('plot_', 'plots.pdf')))
+    mc_path = os.path.join(directory, 'summed_gjets.root')
+    mc_hash = hist_cache.file_sha1(mc_path) if os.path.exists(mc_path) else None
+    control = [name for name in fits if not name.startswith(SIGNAL_REGION + '_')]
+    tasks.append(Task('bat', 'bat', [code['bat'], mc_hash], [scales[name] for name in control] + [fits[name] for name in control],
+        command=script('process_for_BAT.py') + shlex.split(options.batArgs)))
+    return tasks
+
+def run_task(task, directory):
+    '''
+    Runs one task, returns (task, succeeded, seconds)
+    '''
+    start = time.time()
+    if task.action is not None:
+        try:
+            task.action()
+            return task, True, time.time() - start
+        except Exception as e:
+            print('{} failed: {}'.format(task.name, e))
+            return task, False, time.time() - start
+    log_path = os.path.join(directory, LOGS_DIR, task.name.replace('/', '_') + '.log')
+    with open(log_path, 'w') as log:
+        code = subprocess.call(task.command, cwd=HERE, stdout=log, stderr=subprocess.STDOUT)
+    if not code == 0: print('{} failed with exit code {}, see {}'.format(task.name, code, log_path))
+    return task, code == 0, time.time() - start
+
+def run(tasks, directory, state, jobs=1, stages=STAGES, force=False, dry_run=False):
+    '''
+    Runs the out of date tasks, as soon as the tasks they depend on are done
+
+    state is the dict of task name -> signature, updated and saved as tasks finish.
+    Returns the names of the tasks that failed or could not run.
+    '''
+    def save_state():
+        tmp = os.path.join(directory, STATE_NAME + '.tmp')
+        with open(tmp, 'w') as f: json.dump(state, f, indent=1, sort_keys=True)
+        os.rename(tmp, os.path.join(directory, STATE_NAME))
+    done, failed = set(), set()
+    pending = list(tasks)
+    finished = Queue()
+    pool = ThreadPool(max(1, jobs))
+    running = 0
+    while pending or running:
+        for task in list(pending):
+            if any(dep.name in failed for dep in task.deps):
+                failed.add(task.name)
+                pending.remove(task)
+            elif all(dep.name in done for dep in task.deps):
+                pending.remove(task)
+                up_to_date = state.get(task.name) == task.signature and not force
+                if up_to_date or task.stage not in stages:
+                    done.add(task.name)
+                elif dry_run:
+                    print('would run', task.name)
+                    done.add(task.name)
+                else:
+                    print('running', task.name)
+                    state.pop(task.name, None)
+                    pool.apply_async(run_task, (task, directory), callback=finished.put)
+                    running += 1
+        if not running: continue
+        task, succeeded, seconds = finished.get()
+        running -= 1
+        if succeeded:
+            print('finished {} in {:.1f}s'.format(task.name, seconds))
+            done.add(task.name)
+            state[task.name] = task.signature
+        else:
+            failed.add(task.name)
+        save_state()
+    pool.close()
+    pool.join()
+    return sorted(failed)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="run the scaler, fitter, plotter and BAT export, redoing only what changed")
+    parser.add_argument("input", metavar="INPUT", help="input directory with summed_egamma.root")
+    parser.add_argument("--jobs", "-j", default=1, type=int, help="number of tasks to run at the same time")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES, help="stages to run, tasks of the others are taken as up to date")
+    parser.add_argument("--force", default=False, action="store_true", help="run every task of the selected stages")
+    parser.add_argument("--dryRun", default=False, action="store_true", help="only print the tasks that would run")
+    parser.add_argument("--scalerArgs", default="", help="extra options for run_scaler.py")
+    parser.add_argument("--fitterArgs", default="", help="extra options for run_fitter.py")
+    parser.add_argument("--plotterArgs", default="", help="extra options for run_plotter.py")
+    parser.add_argument("--batArgs", default="", help="extra options for process_for_BAT.py")
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.input)
+    for sub in [PAGES_DIR, LOGS_DIR]:
+        if not os.path.exists(os.path.join(directory, sub)): os.mkdir(os.path.join(directory, sub))
+    state = {}
+    if os.path.exists(os.path.join(directory, STATE_NAME)):
+        with open(os.path.join(directory, STATE_NAME)) as f: state = json.load(f)
+    cache = hist_cache.HistCache(directory)
+    tasks = build_tasks(directory, cache, args)
+    failed = run(tasks, directory, state, jobs=args.jobs, stages=args.stages, force=args.force, dry_run=args.dryRun)
+    if failed:
+        print('failed or skipped: ' + ', '.join(failed))
+        sys.exit(1)
@@ -0,0 +1,183 @@
+'''
+Per-bin timers and call counters, for run_fitter --profile
+
+Profiling is off unless enable() was called, and then timer(), count() and
+counted() cost nothing but a check of a global. With it on, every bin between
+begin_bin() and end_bin() gets
+
+  times    seconds spent in each phase (loose_fit, ftest, bin_error, ...)
+  calls    how often each phase was entered
+  counts   counters, e.g. calls of the python TF1 functions and fit function calls
+
+Phases can be nested (template_to_histogram inside ftest, ...), the time of a
+phase includes the phases inside it. write() saves the bins and a summary over
+all bins as <name>.json and one row per bin as <name>.csv.
+
+  profiling.enable()
+  profiling.begin_bin('iso_asym_barrel_100_120')
+  with profiling.timer('loose_fit'): ...
+  profiling.end_bin()
+  profiling.write('profile')
+'''
+from __future__ import print_function
+import csv
+import json
+import time
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_active = None  # the Profiler collecting, None when profiling is off
+
+class Profiler(object):
+    def __init__(self):
+        self.bins = OrderedDict()
+        self.current = None
+        self.start = None
+
+    def begin_bin(self, name):
+        self.current = OrderedDict([('total', 0.0), ('times', OrderedDict()), ('calls', OrderedDict()), ('counts', OrderedDict())])
+        self.bins[name] = self.current
+        self.start = time.time()
+
+    def end_bin(self):
+        record = self.current
+        if record is not None: record['total'] = time.time() - self.start
+        self.current = None
+        return record
+
+    def add_time(self, phase, seconds):
+        if self.current is None: return
+        self.current['times'][phase] = self.current['times'].get(phase, 0.0) + seconds
+        self.current['calls'][phase] = self.current['calls'].get(phase, 0) + 1
+
+    def count(self, name, n=1):
+        if self.current is None: return
+        self.current['counts'][name] = self.current['counts'].get(name, 0) + n
+
+    def summary(self, slowest=10):
+        '''
+        Totals over all bins: per phase the total, mean and maximum time and the bin of the maximum
+        '''
+        phases, counts = OrderedDict(), OrderedDict()
+        for name, record in self.bins.items():
+            for phase, seconds in record['times'].items():
+                entry = phases.setdefault(phase, {'total': 0.0, 'calls': 0, 'max': 0.0, 'max_bin': None})
+                entry['total'] += seconds
+                entry['calls'] += record['calls'][phase]
+                if seconds >= entry['max']: entry['max'], entry['max_bin'] = seconds, name
+            for counter, n in record['counts'].items(): counts[counter] = counts.get(counter, 0) + n
+        for entry in phases.values(): entry['mean'] = entry['total'] / len(self.bins)
+        ordered = sorted(self.bins.items(), key=lambda item: -item[1]['total'])
+        return OrderedDict([
+            ('bins', len(self.bins)),
+            ('total', sum(record['total'] for record in self.bins.values())),
+            ('phases', OrderedDict(sorted(phases.items(), key=lambda item: -item[1]['total']))),
+            ('counts', counts),
+            ('slowest_bins', [[name, record['total']] for name, record in ordered[:slowest]]),
+        ])
+
+    def write(self, name):
+        '''
+        Writes <name>.json (bins and summary) and <name>.csv (one row per bin), returns the paths
+        '''
+        with open(name + '.json', 'w') as f:
+            json.dump(OrderedDict([('summary', self.summary()), ('bins', self.bins)]), f, indent=1)
+        phases, counters = [], []
+        for record in self.bins.values():
+            phases += [phase for phase in record['times'] if phase not in phases]
+            counters += [counter for counter in record['counts'] if counter not in counters]
+        with open(name + '.csv', 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['bin', 'total'] + [phase + '_s' for phase in phases] + [phase + '_calls' for phase in phases] + counters)
+            for bin_name, record in self.bins.items():
+                writer.writerow([bin_name, '{:.6f}'.format(record['total'])]
+                    + ['{:.6f}'.format(record['times'].get(phase, 0.0)) for phase in phases]
+                    + [record['calls'].get(phase, 0) for phase in phases]
+                    + [record['counts'].get(counter, 0) for counter in counters])
+        return [name + '.json', name + '.csv']
+
+    def print_summary(self, slowest=5):
+        summary = self.summary(slowest)
+        print('profile of {} bins, {:.1f}s'.format(summary['bins'], summary['total']))
+        for phase, entry in summary['phases'].items():
+            print('  {:<24} {:9.2f}s  {:6d} calls  mean {:.3f}s/bin  max {:.3f}s ({})'.format(
+                phase, entry['total'], entry['calls'], entry['mean'], entry['max'], entry['max_bin']))
+        for counter, n in summary['counts'].items(): print('  {:<24} {:d}'.format(counter, n))
+        print('  slowest bins: ' + ', '.join('{} ({:.2f}s)'.format(name, seconds) for name, seconds in summary['slowest_bins']))
+
+def enable():
+    global _active
+    if _active is None: _active = Profiler()
+    return _active
+
+def enabled():
+    return _active is not None
+
+def begin_bin(name):
+    if _active is not None: _active.begin_bin(name)
+
+def end_bin():
+    '''
+    Closes the current bin, returns its record (None when profiling is off)
+    '''
+    if _active is not None: return _active.end_bin()
+
+def add_bin(name, record):
+    '''
+    Adds the record of a bin profiled in another process
+    '''
+    if _active is not None and record is not None: _active.bins[name] = record
+
+@contextmanager
+def timer(phase):
+    if _active is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        _active.add_time(phase, time.time() - start)
+
+def timed(phase):
+    '''
+    Decorator, times every call of the function as phase
+    '''
+    def decorate(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            if _active is None: return func(*args, **kwargs)
+            with timer(phase): return func(*args, **kwargs)
+        return timed_func
+    return decorate
+
+def count(name, n=1):
+    if _active is not None: _active.count(name, n)
+
+def count_fit(name, result):
+    '''
+    Adds the number of function calls of a fit (a TFitResultPtr or vectorized_fitting.FitResult) to counter name
+    '''
+    if _active is None: return
+    try:
+        _active.count(name, int(result.NCalls()))
+    except (AttributeError, ReferenceError, TypeError):  # no result, e.g. a fit without the S option
+        pass
+
+def counted(name, func):
+    '''
+    The python function func(x, p) of a TF1, wrapped to count its calls under name when profiling is on
+    '''
+    if _active is None: return func
+    def counting(x, p):
+        _active.count(name)
+        return func(x, p)
+    return counting
+
+def write(name):
+    if _active is not None: return _active.write(name)
+    return []
+
+def print_summary(slowest=5):
+    if _active is not None: _active.print_summary(slowest)
@@ -1,14 +1,12 @@
 from __future__ import print_function
 import math
-import ROOT
+import time
 import sys
 import os
 import argparse
+import multiprocessing
 import array
-import fitting_utils as util
 import constants as VALS
-import scipy
-#import scipy.stats as stats
 
 # command line options
 parser = argparse.ArgumentParser(description="")
@@ -19,18 +17,55 @@ parser.add_argument("--name", default="plots", help="create name for plots pdf")
 parser.add_argument("--show", default=False, action="store_true", help="don't close after finished running (to view canvas)")
 run_args = parser.add_argument_group("run options")
 run_args.add_argument("--createLooseFits", default=False, action="store_true", help="will recreate loose fits even if present")
+run_args.add_argument("--looseCache", default=None, help="directory of the loose fit cache, default is $BKGFIT_CACHE/loose_fits or ~/.cache/bkgfitting/loose_fits")
+run_args.add_argument("--noLooseCache", default=False, action="store_true", help="reuse any loose fit in the artifact store instead of checking the loose fit cache")
 run_args.add_argument("--useUnscaledTight", default=False, action="store_true", help="use unscaled tight data in preference to scaled")
 run_args.add_argument("--ftest", default="3 4", help="change ftest, format: '<CHEB_TYPE> <MAXDEGREE>', default is cheby degree 4")
 run_args.add_argument("--integral", default=False, action="store_true", help="add I to tight fit")
+run_args.add_argument("--tightSolver", default="minuit", choices=["minuit", "irls", "wls"], help="tight fit solver, irls/wls solve the linear template times polynomial fit directly")
+run_args.add_argument("--binErrorTol", default=1e-4, type=float, help="precision of the bin-by-bin error")
+run_args.add_argument("--steppedBinError", default=False, action="store_true", help="find the bin-by-bin error with the old 0.005 step scan")
+run_args.add_argument("--coldStart", default=False, action="store_true", help="start every ftest degree from the default guesses instead of the previous degree's fit")
+run_args.add_argument("--ftestEarlyStop", default=False, action="store_true", help="stop fitting higher degrees once the sequential ftest fails")
+run_args.add_argument("--backend", default="root", choices=["root", "numpy"], help="loose fit backend, numpy evaluates the models on all bins at once")
+run_args.add_argument("--paramStore", default=None, help="json file of converged loose fit parameters used as initial guesses, default is fit_params.json in the input directory")
+run_args.add_argument("--noParamStore", default=False, action="store_true", help="only use the initial guesses in lookup_fit_guesses")
+run_args.add_argument("--noHistCache", default=False, action="store_true", help="read the masspi0 histograms of summed_egamma.root with ROOT instead of the memory-mapped histogram cache")
+run_args.add_argument("--jobs", "-j", default=1, type=int, help="number of bins to fit in parallel processes")
+run_args.add_argument("--stream", default=False, action="store_true", help="scale, fit and export for BAT in memory, writing only the pdf and the bat_input_* bundles (runs serially)")
+run_args.add_argument("--profile", nargs="?", const="profile", default=None, metavar="NAME", help="time the phases of every bin and count fit function calls, write the report to NAME.json and NAME.csv (default profile)")
+run_args.add_argument("--streamFormat", default="npz", choices=["npz", "npy"], help="format of the BAT bundles written with --stream")
 plot_args = parser.add_argument_group("plotting options")
 plot_args.add_argument("--checkPull", default=False, action="store_true", help="print on legend if there are four consecutive pull bins greater than 1.5 sigma")
 plot_args.add_argument("--specifyFtestDegree", "--fdeg", default=None, help="specify which degree ftest should pick for visualization purposes")
 plot_args.add_argument("--printFtest", "--printftest", default=False, action="store_true", help="for a fixed test bin, create a pdf of all possible ftest fits")
 plot_args.add_argument("--onlyLoose", default=False, action="store_true", help="create loose fit plots only")
 plot_args.add_argument("--sanity", "-s", default=False, action="store_true", help="create sanity plots")
+plot_args.add_argument("--noPlots", default=False, action="store_true", help="only fit, no drawing and no pdf of fit pages")
 
 # parse args
 args = parser.parse_args()
+if args.stream and args.noHistCache: parser.error("--stream reads the input histograms from the histogram cache, it can't be used with --noHistCache")
+if args.noPlots and args.sanity: parser.error("--sanity only makes plots, it can't be used with --noPlots")
+
+# imported after the options are parsed, so --help and option errors don't wait for ROOT
+import ROOT
+import fitting_utils as util
+import linear_fitting as linfit
+import fit_statistics as fstats
+import degree_scan as degscan
+import param_store as pstore
+import pages
+import artifact_store as artifacts
+import hist_cache
+import th1_arrays as th1
+import loose_cache
+import fit_metadata
+import stat_boxes
+import profiling
+import object_registry as registry
+import streaming
+if args.profile is not None: profiling.enable()
 
 # constants
 egamma_rootfile = 'summed_egamma.root'
@@ -42,6 +77,544 @@ ROOT.gStyle.SetOptFit(1111)
 ROOT.gStyle.SetLegendFillColor(ROOT.TColor.GetColorTransparent(ROOT.kWhite, 0.01));
 ROOT.gStyle.SetLegendBorderSize(0)
 
+def open_egamma():
+    '''
+    Source of the masspi0 input histograms: the histogram cache, or summed_egamma.root with --noHistCache
+    '''
+    if args.noHistCache: return ROOT.TFile(egamma_rootfile)
+    return hist_cache.shared('.')
+
+@registry.scoped
+def fit_bin(region, i, eta_reg, infile1, c1, pdf, store, param_store=None):
+    '''
+    Loose and tight fits of one (region, pt bin, eta) bin
+
+    Reads the input histograms from infile1 (a TFile or a HistCache) and the
+    fit artifacts through store, draws on canvas c1 and prints the pages to
+    pdf. Returns a dict with the chi2 p-values of the pages and the parameter
+    store entries of the bin
+    '''
+    chi2_pvalues = []
+    time_start = time.time()
+    if i == len(VALS.PT_EDGES) - 1: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+"
+    else: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) 
+    profiling.begin_bin(hist_name)
+    # Generate correct plots names to access from summed histogram files
+    egamma_tight_plots = "plots/twoprong_masspi0_" + region + "_" + eta_reg
+    egamma_loose_plots = "plots/twoprong_masspi0_" + region + "_" + eta_reg
+
+    # this must follow the naming convention of the input histograms
+    if i == len(VALS.PT_EDGES) - 1:
+        egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "+"
+        egamma_loose_plots += "_" + str(VALS.PT_EDGES[i]) + "+"
+    else:
+        egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1])
+        egamma_loose_plots += "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) 
+
+    # Reference name of the histogram created in the backend 
+    egamma_tight_plots += "_tight"
+    egamma_loose_plots += "_loose"
+
+    # Get the histograms from the input file
+    with profiling.timer('input_read'):
+        h_egamma_tight = infile1.Get(egamma_tight_plots)
+        h_egamma_loose = infile1.Get(egamma_loose_plots)
+    registry.adopt_fits(h_egamma_tight, h_egamma_loose)  # the fitted functions go with the objects of the bin
+
+    # Set Poisson errors for tight histogram 
+    h_egamma_tight.SetBinErrorOption(ROOT.TH1.kPoisson)
+
+    # Configure display options
+    h_egamma_tight.SetLineColor(ROOT.kBlack)
+    h_egamma_loose.SetLineColor(ROOT.kBlack)
+
+    # scaled tight data
+    if not args.useUnscaledTight and region != "iso_sym":
+        h_scaled_tight = store.get(artifacts.SCALED_TIGHT, hist_name+"_tight")
+        h_egamma_tight.Reset()
+        th1.copy_contents(h_egamma_tight, h_scaled_tight)
+
+    # FITTING
+    if i == 0 and eta_reg == "barrel": print("====================== " + region.upper() + " =====================")
+    if i == len(VALS.PT_EDGES) - 1: print("############### " + region.upper() + " " + eta_reg.upper() + " " + str(VALS.PT_EDGES[i]) + "+ ###############")
+    else: print("############### " + region.upper() + " " + eta_reg.upper() + " " + str(VALS.PT_EDGES[i]) + "-" + str(VALS.PT_EDGES[i+1]) + " ###############")
+
+    ### new idea, fit only rising and falling ###
+    # determine left and right bounds
+    # fit landaus from first_bin to left_bin
+    # fit exps from right_bin to last_bin
+    ENTRIES_CUTOFF = 1000  # adjust based on bulk region
+    first_bin = 4 
+    left_bin = 0
+    for b in range(h_egamma_loose.GetNbinsX()):
+      if h_egamma_loose.GetBinContent(b+1)<ENTRIES_CUTOFF: continue
+      else:
+        left_bin = b + 1
+        break
+    right_bin = h_egamma_loose.GetNbinsX()+1
+    for b in reversed(range(h_egamma_loose.GetNbinsX())):
+      if h_egamma_loose.GetBinContent(b+1)<ENTRIES_CUTOFF: continue
+      else:
+        right_bin = b + 1
+        break
+    last_bin = h_egamma_loose.GetNbinsX() + 1
+    for b in reversed(range(h_egamma_loose.GetNbinsX())):
+      if h_egamma_loose.GetBinContent(b+1)==0: continue
+      else:
+        last_bin = b + 1
+        break
+    # convert to x-ranges
+    first = h_egamma_loose.GetBinLowEdge(first_bin)  # first bin with data
+    left = h_egamma_loose.GetBinLowEdge(left_bin+1)  # first bin exceeding ENTRIES_CUTOFF
+    right = h_egamma_loose.GetBinLowEdge(right_bin)  # last bin exceeding ENTRIES_CUTOFF
+    last = h_egamma_loose.GetBinLowEdge(last_bin+1)  # last bin with data
+
+    fit_init = util.lookup_fit_guesses(region, eta_reg, VALS.PT_EDGES[i])
+    old_method = fit_init['old_method']
+    guesses = fit_init['guesses']
+    nLandau = fit_init['nLandau']
+    landau_guess = fit_init['landau_guess']
+    nExp = fit_init['nExp']
+    exp_guess = fit_init['exp_guess']
+    store_key = pstore.bin_key(region, eta_reg, VALS.PT_EDGES[i])
+
+    # Loose spectrum fitting
+    if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_loose"
+    else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_loose" 
+    if loose_fits is not None:  # refit only if no fit of the same histogram, guesses, ranges and code is cached
+        loose_settings = {'fit_init': fit_init, 'bins': [first_bin, left_bin, right_bin, last_bin], 'cutoff': ENTRIES_CUTOFF, 'backend': args.backend}
+        loose_key = loose_cache.fit_key(util.hist_to_numpy(h_egamma_loose), th1.edges(h_egamma_loose), loose_settings)
+        cached_loose = None if args.createLooseFits else loose_fits.get(loose_key)
+        create_loose = cached_loose is None
+    else:
+        create_loose = not store.has(artifacts.LOOSE, title) or args.createLooseFits
+    loose_stats = []  # summaries of the rising and falling fits, drawn as stat boxes
+    if create_loose: # create new loose fits
+        if old_method:
+            N = str(nLandau) + str(nExp)
+            with profiling.timer('loose_fit'):
+                func_full, fitresult_full = util.fit_hist(h_egamma_loose, 'full', 0, 50, int(N), initial_guesses=guesses, backend=args.backend, param_store=param_store, store_key=store_key)
+            loose_fit_as_hist = util.TemplateToHistogram(func_full, 1000, 0, 50)  # the histogram bin definition must align with the input loose and tight histograms
+        else:
+            with profiling.timer('loose_fit'):
+                func_rising, fitresult_rising = util.fit_hist(h_egamma_loose, 'landau', first, left, N=nLandau, initial_guesses=landau_guess, backend=args.backend, param_store=param_store, store_key=store_key)
+            rising_fit_as_hist = util.TemplateToHistogram(func_rising, 1000, 0, 50)
+            loose_stats.append(stat_boxes.summary(func_rising))
+
+            with profiling.timer('loose_fit'):
+                func_falling, fitresult_falling = util.fit_hist(h_egamma_loose, 'exp', right, last, N=nExp, initial_guesses=exp_guess, backend=args.backend, param_store=param_store, store_key=store_key)
+            falling_fit_as_hist = util.TemplateToHistogram(func_falling, 1000, 0, 50)
+            loose_stats.append(stat_boxes.summary(func_falling))
+
+            # create overall fitted histogram as: rising - bulk - falling
+            loose_fit_as_hist = h_egamma_loose.Clone()
+            loose_fit_as_hist.Reset()
+            stitched = th1.contents(h_egamma_loose).astype(float)
+            stitched[:left_bin] = th1.contents(rising_fit_as_hist)[:left_bin]
+            stitched[right_bin+1:] = th1.contents(falling_fit_as_hist)[right_bin+1:]
+            th1.set_contents(loose_fit_as_hist, stitched)
+    
+        # Save the loose fits in the artifact store
+        #if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_loose"
+        #else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_loose" 
+        loose_hist = ROOT.TH1F(title, title, 1000, 0, 50) 
+        th1.copy_contents(loose_hist, loose_fit_as_hist)
+        loose_hist.SetName(title)
+        store.put(artifacts.LOOSE, [loose_hist])
+        if loose_fits is not None: loose_fits.put(loose_key, util.hist_to_numpy(loose_hist))
+    elif loose_fits is not None:
+        # cached fit, only written to the store if the one there is different
+        if not store.has(artifacts.LOOSE, title) or not (util.hist_to_numpy(store.get(artifacts.LOOSE, title)) == cached_loose).all():
+            loose_hist = ROOT.TH1F(title, title, 1000, 0, 50)
+            th1.set_contents(loose_hist, cached_loose)
+            store.put(artifacts.LOOSE, [loose_hist])
+    
+    # Input loose fit templates saved previously for fitting to the tight data
+    loose_fit_as_hist = store.get(artifacts.LOOSE, hist_name+"_loose")
+
+    time_loose = time.time() - time_start
+    tight_start = time.time()
+
+    fitted_func = util.HistogramToFunction(loose_fit_as_hist)
+    if args.tightSolver == "minuit":
+        fitted_func_times_constant, _, _ = util.MultiplyWithPolyToTF1(fitted_func, 0, poly=0)  # this part can appear a bit buggy in the plots for some reason
+        fit_result = h_egamma_tight.Fit(fitted_func_times_constant, '0L' if not args.integral else '0LI')
+    else:
+        fitted_func_times_constant, fit_result = linfit.fit_template_poly(h_egamma_tight, fitted_func, 0, poly=0, integral=args.integral, method=args.tightSolver)
+    tight_fit_w_constant = util.TemplateToHistogram(fitted_func_times_constant, 1000, 0, 50)  
+
+    # tight data and its Poisson errors as arrays, for the F-test and chi2s
+    data, err_low, err_up = fstats.hist_poisson_arrays(h_egamma_tight)
+
+    # Decide whether an F-test should be used to pick the best polynomial degree
+    FTEST = True
+    NUM_PLOTS = 1  # this variable is used so that the --printFtest option works
+    if not FTEST:
+        POLY_TYPE = 3
+        DEGREE = 0 
+        if args.tightSolver == "minuit":
+            func_with_poly, func_with_ploy_py, _ = util.MultiplyWithPolyToTF1(fitted_func, DEGREE, poly=POLY_TYPE)
+            tight_result = h_egamma_tight.Fit(func_with_poly, '0SL' if not args.integral else '0SLI')
+        else:
+            func_with_poly, tight_result = linfit.fit_template_poly(h_egamma_tight, fitted_func, DEGREE, poly=POLY_TYPE, integral=args.integral, method=args.tightSolver)
+        tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
+
+    if FTEST:
+        parse = args.ftest.split()
+        NUM_DEGREES = int(parse[1])
+        if args.printFtest and args.testBin is not None: NUM_PLOTS = NUM_DEGREES+1
+        POLY_TYPE = int(parse[0])
+        statboxes = []
+        def capture_stats(degree, func, result):
+            statboxes.append(stat_boxes.summary(func))
+        # every degree is needed when one is picked or printed by hand
+        early_stop = args.ftestEarlyStop and not args.printFtest and args.specifyFtestDegree is None
+        with profiling.timer('ftest'):
+            fitfuncs, fitresults, table, best_d, tested = degscan.scan_degrees(h_egamma_tight, fitted_func, NUM_DEGREES, poly=POLY_TYPE,
+                solver=args.tightSolver, integral=args.integral, warm_start=not args.coldStart, early_stop=early_stop, callback=capture_stats)
+        h_egamma_tight.SetStats(0)
+
+        for d2, d1, decision in tested:
+            print(d2, '>', d1, decision)
+            print('  F={} target={}'.format(table['F'][d2][d1], table['target'][d2][d1]), '({}, {}) dof'.format(int(table['dof1'][d2][d1]), int(table['dof2'][d2][d1])))
+    
+        if args.specifyFtestDegree is not None: best_d = int(args.specifyFtestDegree)
+        print('Best: ', best_d)
+        func_with_poly = fitfuncs[best_d]
+        tight_result = fitresults[best_d]
+        tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
+        tight_stat = statboxes[best_d]
+    time_tight = time.time() - tight_start
+
+    # Save the tight templates to be plotted separately
+    if not args.useUnscaledTight: template_category = artifacts.TEMPLATES
+    else: template_category = artifacts.TEMPLATES_NOSCALING
+
+    # Save the loose fits in a separate file
+    if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_tight_temp"
+    else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_tight_temp" 
+    tight_fit_hist = ROOT.TH1F(title, title, 1000, 0, 50) 
+    th1.copy_contents(tight_fit_hist, tight_fit_as_hist)
+    tight_fit_hist.SetName(title)
+    store.put(template_category, [tight_fit_hist])
+
+    if i == len(VALS.PT_EDGES) - 1: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+"
+    else: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) 
+
+    # The plotting done here are for rough visualization purposes
+    # For finalized plots, a separate plotting script should be used
+    for plot in range(NUM_PLOTS):
+        if args.printFtest and args.testBin:
+            func_with_poly = fitfuncs[plot]
+            tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
+            tight_stat = statboxes[plot]
+
+        just_poly = util.ExtractPolyFromTightFit(func_with_poly, poly=POLY_TYPE)
+        tlast_bin = h_egamma_tight.GetNbinsX() + 1
+        for b in reversed(range(h_egamma_tight.GetNbinsX())):
+          if h_egamma_tight.GetBinContent(b+1)==0: continue
+          else:
+            tlast_bin = b + 1
+            break
+        rightmost_tightdata = h_egamma_loose.GetBinLowEdge(tlast_bin+1)
+        just_poly.SetRange(0,rightmost_tightdata)
+
+        # Save the loose fits in a separate file
+        if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_tight_poly"
+        else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_tight_poly" 
+        bern_poly = just_poly.Clone()
+        bern_poly.SetName(title)
+        store.put(artifacts.POLYS, [bern_poly])
+
+        # determine bin-by-bin error
+        STEP_SIZE = 0.005
+        integral = False
+        hist = h_egamma_tight
+        fit = func_with_poly
+        #ndof = util.count_nonzero_VALS.PT_EDGES(hist) - fit.GetNpar()
+        ndof = tlast_bin - fit.GetNpar()
+        fit_vals = fstats.template_poly_values(fitted_func, [fit.GetParameter(k) for k in range(fit.GetNpar())],
+            th1.edges(hist), POLY_TYPE, integral=integral)
+        with profiling.timer('bin_error'):
+            bin_bin_error, chi2_ndof = fstats.solve_bin_error(data, fit_vals, err_low, err_up, ndof,
+                tol=args.binErrorTol, stepped=args.steppedBinError, step=STEP_SIZE)
+
+        chi2_mod, mod_bins = fstats.rss(data, fit_vals, err_low, err_up, error=0, chi2=True, cutoff=5)
+        num_bins = len(mod_bins['data'])
+        if not num_bins == 0:
+            chi2_mod_ndof = chi2_mod / (num_bins-fit.GetNpar())
+            chi2_pvalues.append(fstats.chi2_pvalue(chi2_mod, num_bins-fit.GetNpar()))
+        else:
+            chi2_mod_ndof = chi2_mod
+            chi2_pvalues.append(-1)
+        #print(chi2_mod, len(num_bins), chi2_mod_ndof)
+
+        # scalar results of the bin, for the picked fit
+        if NUM_PLOTS == 1 or plot == best_d:
+            status, edm = fit_metadata.fit_status(tight_result)
+            metadata = fit_metadata.make_record(hist_name, degree=best_d, chi2=chi2_mod, ndof=num_bins-fit.GetNpar(),
+                chi2_ndof=chi2_mod_ndof, pvalue=chi2_pvalues[-1], bin_error=bin_bin_error, status=status, edm=edm,
+                time_loose=time_loose, time_tight=time_tight)
+        if args.noPlots: continue
+
+        h_loose_pull_num = h_egamma_loose.Clone()
+        h_loose_pull_num.Reset()
+        h_loose_pull = h_egamma_loose.Clone()
+        h_loose_pull.Reset()
+        h_loose_pull_num.Add(h_egamma_loose, loose_fit_as_hist, 1, -1)  # Numerator of pull hist is data - fit
+
+        for j in range(h_loose_pull_num.GetNbinsX()): 
+            if h_egamma_loose.GetBinContent(j+1) == 0: err = 1.8
+            else: err = h_egamma_loose.GetBinError(j+1)
+            h_loose_pull.SetBinContent(j+1, h_loose_pull_num.GetBinContent(j+1)/err)
+            h_loose_pull.SetBinError(j+1, 1)
+    
+        h_tight_pull_num = h_egamma_tight.Clone()
+        h_tight_pull_num.Reset()
+        h_tight_pull = h_egamma_tight.Clone()
+        h_tight_pull.Reset()
+        h_tight_pull_num.Add(h_egamma_tight, tight_fit_as_hist, 1, -1)  # Numerator of pull hist is data - fit
+    
+        h_tight_pull_error = h_tight_pull.Clone() # to visualize binbin error
+        h_tight_pull_error.Reset()
+
+        for j in range(h_tight_pull_num.GetNbinsX()): 
+            if h_egamma_tight.GetBinContent(j+1) == 0:
+                err = h_egamma_tight.GetBinErrorUp(j+1)
+            else: 
+                if tight_fit_as_hist.GetBinContent(j+1) > h_egamma_tight.GetBinContent(j+1):
+                    err = h_egamma_tight.GetBinErrorUp(j+1)
+                else:
+                    err = h_egamma_tight.GetBinErrorLow(j+1)
+            h_tight_pull.SetBinContent(j+1, h_tight_pull_num.GetBinContent(j+1)/err)
+            h_tight_pull.SetBinError(j+1, 1)
+            h_tight_pull_error.SetBinContent(j+1, 0)
+            h_tight_pull_error.SetBinError(j+1, (tight_fit_as_hist.GetBinContent(j+1)*bin_bin_error)/err)
+
+        # pull for tight fit with constant
+        h_tight_pullc = h_egamma_tight.Clone()
+        h_tight_pullc.Reset()
+        h_tight_pullc_num = h_egamma_tight.Clone()
+        h_tight_pullc_num.Reset()
+        h_tight_pullc_num.Add(h_egamma_tight, tight_fit_w_constant, 1, -1)  # Numerator of pull hist is data - fit
+        for j in range(h_tight_pullc_num.GetNbinsX()): 
+            if h_egamma_tight.GetBinContent(j+1) == 0:
+                err = h_egamma_tight.GetBinErrorUp(j+1)
+            else: 
+                if tight_fit_w_constant.GetBinContent(j+1) > h_egamma_tight.GetBinContent(j+1):
+                    err = h_egamma_tight.GetBinErrorUp(j+1)
+                else:
+                    err = h_egamma_tight.GetBinErrorLow(j+1)
+            h_tight_pullc.SetBinContent(j+1, h_tight_pullc_num.GetBinContent(j+1)/err)
+            h_tight_pullc.SetBinError(j+1, 0) # no error bar
+    
+        # Create title for plot 
+        title = region + " Twoprong"
+        if eta_reg == "barrel": title += ", Barrel"
+        elif eta_reg == "endcap": title += ", Endcap"
+        if i == len(VALS.PT_EDGES) - 1: title += ", pt > " + str(VALS.PT_EDGES[i])
+        else: title += ", " + str(VALS.PT_EDGES[i]) + " < pt < " + str(VALS.PT_EDGES[i+1]) 
+        if not old_method:
+            if nLandau == 1: title += ", 1 land"
+            elif nLandau == 2: title += ", 2 land"
+            if nExp == 1: title += ", 1 exp"
+            elif nExp == 2: title += ", 2 exp"
+            elif nExp == 3: title += ", 3 exp"
+            elif nExp == 4: title += ", 4 exp"
+        if old_method:
+            title += ", full fit (" + str(nLandau) + " land " + str(nExp) + " exp)"
+
+        # Legend creation
+        legend1 = ROOT.TLegend(0.35, 0.78, 0.65, 0.9)
+        legend1.AddEntry(h_egamma_loose, "Loose Photon, " + str(round(h_egamma_loose.GetEntries())), "l")
+        if region == "iso_sym": legend1.AddEntry(h_egamma_tight, "Tight Photon, " + str(round(h_egamma_tight.GetEntries())), "l")
+        legend2 = ROOT.TLegend(0.29, 0.70, 0.62, 0.89)
+        legend2.AddEntry(h_egamma_tight, "Tight Photon, " + str(h_egamma_tight.GetEntries()), "l")
+        if POLY_TYPE == 0: legend2.AddEntry('', 'Polynomial', '')
+        if POLY_TYPE == 1: legend2.AddEntry('', 'Chebyshev 1st kind', '')
+        if POLY_TYPE == 2: legend2.AddEntry('', 'Chebyshev 2nd kind', '')
+        if POLY_TYPE == 3: legend2.AddEntry('', 'Bernstein', '')
+        func_n_par = func_with_poly.GetNpar()
+        if POLY_TYPE == 3 and func_n_par == 1: fit_degree = 0
+        elif POLY_TYPE == 3 and func_n_par > 1: fit_degree = func_n_par - 1
+        elif POLY_TYPE < 3: fit_degree = func_n_par - 1
+        if FTEST: legend2.AddEntry(tight_fit_as_hist, "Fit w f-test (Degree "+str(fit_degree)+")", "l")
+        else: legend2.AddEntry(tight_fit_as_hist, "Fit (Degree "+str(fit_degree)+")", "l")
+        legend2.AddEntry(tight_fit_w_constant, "Constant fit p0 = {:.4}".format(fitted_func_times_constant.GetParameter(0)), "l")
+        legend2.AddEntry('', 'Chi2/Ndof: {:.3f}'.format(chi2_ndof), '')
+        legend2.AddEntry('', 'Chi2_mod/Ndof: {:.3f}'.format(chi2_mod_ndof), '')
+        legend2.AddEntry('', 'Bin Error: {:.1%}'.format(bin_bin_error), '')
+        if args.checkPull:
+            legend2.AddEntry('', '3 Consecutive Bins > 2 sigma: ' + str(utilcheckPullHist(h_tight_pull, 3, 2)), '')
+            legend2.AddEntry('', '4 Consecutive Bins > 1.5 sigma: ' + str(util.checkPullHist(h_tight_pull, 4, 1.5)), '')
+            legend2.AddEntry('', '5 Consecutive Bins > 1 sigma: ' + str(util.checkPullHist(h_tight_pull, 5, 1)), '')
+
+        # Draw plots
+        if args.onlyLoose: c1.cd(1)
+        else:
+          c1.cd()
+          pad1 = ROOT.TPad('pad1', 'pad1', 0, 0.3, 0.5, 1)
+          pad1.Draw()
+          pad1.cd()
+
+        h_egamma_loose.SetTitle(title)
+        h_egamma_loose.SetMaximum()
+        h_egamma_loose.SetMinimum(0.1)
+        h_egamma_loose.Draw("e")
+        loose_fit_as_hist.SetLineColor(ROOT.kRed+1)
+        loose_fit_as_hist.Draw("same")
+        if not(left == 0 and right == 50) and loose_stats:
+            stats1 = stat_boxes.box(loose_stats[0], "stats1", .4, .6)
+            stats2 = stat_boxes.box(loose_stats[1], "stats2")
+            stats1.Draw()
+            stats2.Draw()
+        ROOT.gPad.SetLogy()
+        if VALS.PT_EDGES[i] < 60: h_egamma_loose.GetXaxis().SetRangeUser(0, 5)
+        elif VALS.PT_EDGES[i] < 120: h_egamma_loose.GetXaxis().SetRangeUser(0, 10)
+        elif VALS.PT_EDGES[i] < 200: h_egamma_loose.GetXaxis().SetRangeUser(0, 15)
+        elif VALS.PT_EDGES[i] < 380: h_egamma_loose.GetXaxis().SetRangeUser(0, 20)
+        else: h_egamma_loose.GetXaxis().SetRangeUser(0, 26)
+        legend1.Draw("same")
+        ROOT.gPad.Update()
+
+        if not args.onlyLoose:
+            if not region == "iso_sym":
+                c1.cd()
+                pad2 = ROOT.TPad('pad2', 'pad2', 0.5, 0.3, 1, 1)
+                pad2.Draw()
+                pad2.cd()
+                ROOT.gPad.SetLogy()
+                if VALS.PT_EDGES[i] < 60: h_egamma_tight.GetXaxis().SetRangeUser(0, 5)
+                elif VALS.PT_EDGES[i] < 120: h_egamma_tight.GetXaxis().SetRangeUser(0, 10)
+                elif VALS.PT_EDGES[i] < 200: h_egamma_tight.GetXaxis().SetRangeUser(0, 15)
+                elif VALS.PT_EDGES[i] < 380: h_egamma_tight.GetXaxis().SetRangeUser(0, 20)
+                else: h_egamma_tight.GetXaxis().SetRangeUser(0, 26)
+                h_egamma_tight.SetMinimum(0.1)
+                h_egamma_tight.Draw("e")
+                if FTEST:
+                    tight_box = stat_boxes.box(tight_stat, "tight_stat")
+                    tight_box.Draw()
+                tight_fit_w_constant.SetLineColor(ROOT.kBlue)
+                tight_fit_as_hist.SetLineColor(ROOT.kRed)
+                tight_fit_as_hist.SetLineWidth(1)
+                #tight_fit_as_hist_errorbars = tight_fit_as_hist.Clone()
+                #tight_fit_as_hist_errorbars.SetFillColor(ROOT.kRed+2)
+                #tight_fit_as_hist_errorbars.Draw("same e2")
+                tight_fit_as_hist.Draw("same hist")
+                tight_fit_w_constant.Draw('same')
+                h_egamma_tight.Draw("e same")
+                h_egamma_tight.GetYaxis().SetRangeUser(0.1, h_egamma_tight.GetMaximum()+50)
+                ROOT.gPad.Update()
+
+                legend2.Draw("same")
+                overlay = ROOT.TPad("overlay","",0, 0.06, 1, 0.5)
+                overlay.SetFillStyle(4000)
+                overlay.SetFillColor(0)
+                overlay.SetFrameFillStyle(4000)
+                overlay.SetFrameLineWidth(0)
+                overlay.Draw()
+                overlay.cd()
+                empty = ROOT.TH1F(util.getname('empty'), '', 100, 0, 50)
+                empty.SetLineColor(ROOT.kRed)
+                if VALS.PT_EDGES[i] < 60: empty.GetXaxis().SetRangeUser(0, 5)
+                elif VALS.PT_EDGES[i] < 120: empty.GetXaxis().SetRangeUser(0, 10)
+                elif VALS.PT_EDGES[i] < 200: empty.GetXaxis().SetRangeUser(0, 15)
+                elif VALS.PT_EDGES[i] < 380: empty.GetXaxis().SetRangeUser(0, 20)
+                else: empty.GetXaxis().SetRangeUser(0, 26)
+                empty.GetYaxis().SetRangeUser(min(0, just_poly.GetMinimum()), just_poly.GetMaximum())
+                empty.Draw('AH')
+                just_poly.SetRange(0, 50)
+                just_poly.SetTitle("")
+                just_poly.Draw("AI L same")
+                ROOT.gPad.Update()
+                rightaxis = ROOT.TGaxis(ROOT.gPad.GetUxmax(), ROOT.gPad.GetUymin(), ROOT.gPad.GetUxmax(), ROOT.gPad.GetUymax(), ROOT.gPad.GetUymin(), ROOT.gPad.GetUymax(), 510, "L+")
+                rightaxis.SetLineColor(ROOT.kRed);
+                rightaxis.SetLabelColor(ROOT.kRed);
+                rightaxis.Draw()
+                ROOT.gPad.Update()
+                #topaxis = ROOT.TGaxis(ROOT.gPad.GetUxmin(), ROOT.gPad.GetUymax(), ROOT.gPad.GetUxmax(), ROOT.gPad.GetUymax(), ROOT.gPad.GetUxmin(), ROOT.gPad.GetUxmax(), 510, "+L")
+                #topaxis.SetLineColor(ROOT.kRed);
+                #topaxis.SetLabelColor(ROOT.kRed);
+                #topaxis.Draw()
+
+            c1.cd()
+            pad3 = ROOT.TPad('pad3', 'pad3', 0, 0, 0.5, 0.3)
+            pad3.Draw()
+            pad3.cd()
+            h_loose_pull.SetTitle("(Loose - Fit) / Error")
+            h_loose_pull.SetLineColor(ROOT.kBlack)
+            h_loose_pull.Draw('pe')
+            h_loose_pull.SetMarkerStyle(8)
+            h_loose_pull.SetMarkerSize(0.25)
+            h_loose_pull.GetYaxis().SetRangeUser(-10, 10)
+            h_loose_pull.SetStats(0)
+            if VALS.PT_EDGES[i] < 60: h_loose_pull.GetXaxis().SetRangeUser(0, 5)
+            elif VALS.PT_EDGES[i] < 120: h_loose_pull.GetXaxis().SetRangeUser(0, 10)
+            elif VALS.PT_EDGES[i] < 200: h_loose_pull.GetXaxis().SetRangeUser(0, 15)
+            elif VALS.PT_EDGES[i] < 380: h_loose_pull.GetXaxis().SetRangeUser(0, 20)
+            else: h_loose_pull.GetXaxis().SetRangeUser(0, 26)
+
+            if not region == "iso_sym":
+                c1.cd()
+                pad4 = ROOT.TPad('pad4', 'pad4', 0.5, 0, 1, 0.3)
+                pad4.Draw()
+                pad4.cd()
+                h_tight_pull.Draw('pe')
+                h_tight_pull_error.SetLineColor(ROOT.kGray+2)
+                h_tight_pull_error.SetFillColor(ROOT.kGray+2)
+                h_tight_pull_error.Draw('same e2')
+                h_tight_pull.SetTitle("(Tight - Fit) / Error")
+                h_tight_pull.SetLineColor(ROOT.kBlack)
+                h_tight_pull.Draw('pe same')
+                h_tight_pull.SetMarkerStyle(8)
+                h_tight_pull.SetMarkerSize(0.25)
+                h_tight_pull.GetYaxis().SetRangeUser(-10, 10)
+                h_tight_pull.SetStats(0)
+                if VALS.PT_EDGES[i] < 60: h_tight_pull.GetXaxis().SetRangeUser(0, 5)
+                elif VALS.PT_EDGES[i] < 120: h_tight_pull.GetXaxis().SetRangeUser(0, 10)
+                elif VALS.PT_EDGES[i] < 200: h_tight_pull.GetXaxis().SetRangeUser(0, 15)
+                elif VALS.PT_EDGES[i] < 380: h_tight_pull.GetXaxis().SetRangeUser(0, 20)
+                else: h_tight_pull.GetXaxis().SetRangeUser(0, 26)
+                h_tight_pullc.SetMarkerColor(ROOT.kBlue)
+                h_tight_pullc.SetMarkerStyle(8)
+                h_tight_pullc.SetMarkerSize(0.25)
+                h_tight_pullc.Draw('pe same')
+                ROOT.gPad.Update()
+
+        ROOT.gPad.Update()
+        with profiling.timer('print'): c1.Print(pdf)
+
+    metadata['time_total'] = time.time() - time_start
+    return {
+        'bin': hist_name,
+        'profile': profiling.end_bin(),
+        'chi2_pvalues': chi2_pvalues,
+        'metadata': metadata,
+        'store_key': store_key,
+        'params': param_store.entries.get(store_key) if param_store is not None else None,
+    }
+
+def run_bin_task(task):
+    '''
+    Runs fit_bin() in a worker process, with its own input file, canvas and pdf of pages
+    '''
+    order, region, i, eta_reg, pdf = task
+    egamma = open_egamma()
+    c1 = ROOT.TCanvas(util.getname('c'), "c1", 800, 600)
+    param_store = None
+    # the parent merges the recorded parameters, workers don't write the store
+    if not args.noParamStore: param_store = pstore.ParamStore(args.paramStore if args.paramStore is not None else pstore.DEFAULT_NAME, autosave=False)
+    if not args.noPlots: c1.Print(pdf + "[")
+    store = artifacts.ArtifactStore('.')
+    result = fit_bin(region, i, eta_reg, egamma, c1, pdf, store, param_store)
+    store.close()
+    if not args.noPlots: c1.Print(pdf + "]")
+    if args.noHistCache: egamma.Close()
+    result['order'] = order
+    result['pdf'] = pdf
+    result['objects'] = registry.stats()
+    return result
+
 # select regions
 # pi0: masspi0 plots for all eta regions, barrel, and endcap
 # pi0_VALS.PT_EDGES: pt-binned masspi0 plots in barrel and endcap; 
@@ -54,10 +627,20 @@ eta_regions = ["barrel", "endcap"]
 photon_regions = ["tight", "loose"]
 
 # init
+if args.paramStore is not None: args.paramStore = os.path.abspath(args.paramStore)
+if args.looseCache is not None: args.looseCache = os.path.abspath(args.looseCache)
 os.chdir(args.input)
-infile1 = ROOT.TFile(egamma_rootfile)
+loose_fits = None if args.noLooseCache else loose_cache.LooseFitCache(args.looseCache)
+param_store = None
+if not args.noParamStore: param_store = pstore.ParamStore(args.paramStore if args.paramStore is not None else pstore.DEFAULT_NAME)
+# with --jobs the bin pages are printed by the workers and merged at the end
+parallel = args.jobs > 1 and "pi0_VALS.PT_EDGES" in plots and not args.stream
+if parallel or args.noPlots: ROOT.gROOT.SetBatch(True)
+# summed_egamma.root itself is only opened for the sanity plots and with --noHistCache
+infile1 = ROOT.TFile(egamma_rootfile) if args.sanity or args.noHistCache else None
+egamma = infile1 if args.noHistCache else hist_cache.shared('.')
 c1 = ROOT.TCanvas("c1", "c1", 800, 600)
-c1.Print(args.name + ".pdf[")
+if not parallel and not args.noPlots: c1.Print(args.name + ".pdf[")
 
 # run
 for item in plots:
@@ -117,11 +700,11 @@ for item in plots:
         for region in regions:  # loop through twoprong regions
             for eta_reg in eta_regions:  # loop through eta regions for a fixed twoprong sideband
                 if not eta_reg == "barrel" and not eta_reg == "endcap":
-                    h_egamma_tight = infile1.Get("plots/twoprong_masspi0_" + region + "_tight")
-                    h_egamma_loose = infile1.Get("plots/twoprong_masspi0_" + region + "_loose")
+                    h_egamma_tight = egamma.Get("plots/twoprong_masspi0_" + region + "_tight")
+                    h_egamma_loose = egamma.Get("plots/twoprong_masspi0_" + region + "_loose")
                 else:
-                    h_egamma_tight = infile1.Get("plots/twoprong_masspi0_" + region + "_" + eta_reg + "_tight")
-                    h_egamma_loose = infile1.Get("plots/twoprong_masspi0_" + region + "_" + eta_reg + "_loose")
+                    h_egamma_tight = egamma.Get("plots/twoprong_masspi0_" + region + "_" + eta_reg + "_tight")
+                    h_egamma_loose = egamma.Get("plots/twoprong_masspi0_" + region + "_" + eta_reg + "_loose")
                 
                 h_egamma_tight.SetLineColor(ROOT.kBlack)
                 h_egamma_loose.SetLineColor(ROOT.kGreen+2)
@@ -171,25 +754,10 @@ for item in plots:
     elif item == "pi0_VALS.PT_EDGES":  # binned plots (PRIMARILY USED)
         if args.testBin is not None: test_bin = (args.testBin).split(" ")
         chi2_pvalues = []
-        if not os.path.exists('loose_fit_hists'): os.mkdir("loose_fit_hists")
-        if not os.path.exists('tight_templates'): os.mkdir("tight_templates")
-        os.chdir('tight_templates')
-        if args.useUnscaledTight:
-            if not os.path.exists('templates_noscaling'): os.mkdir("templates_noscaling")
-        else:
-            if not os.path.exists('templates'): os.mkdir("templates")
-        if not os.path.exists('degrees'): os.mkdir("degrees")
-        if not os.path.exists('chi2s'): os.mkdir("chi2s")
-        os.chdir('../')
-        if not os.path.exists('tight_templates'): os.mkdir("tight_templates")
-        os.chdir('tight_templates')
-        if not os.path.exists('polys'): os.mkdir('polys')
-        os.chdir('../')
-            
-        loose_fit_files = []
-        scaled_tight_files = []
-        file_counter_loose = 0
-        file_counter_tight = 0
+        # with --stream the intermediate histograms are only kept in memory
+        store = artifacts.MemoryStore() if args.stream else artifacts.ArtifactStore('.')
+        records = []
+        tasks = []
         for region in regions:  # loop through twoprong sideband regions
             if args.printFtest and args.testBin is None:
                 print("EMPTY PDF: Must have --testBin option when using --printFtest")
@@ -203,524 +771,53 @@ for item in plots:
                     if args.testBin is not None: 
                         if not eta_reg == test_bin[1]: continue
                     if not eta_reg == "barrel" and not eta_reg == "endcap": continue  # no pt-bin plots for barrel and endcap combined, so skip this case
-                    
-                    # Generate correct plots names to access from summed histogram files
-                    egamma_tight_plots = "plots/twoprong_masspi0_" + region + "_" + eta_reg
-                    egamma_loose_plots = "plots/twoprong_masspi0_" + region + "_" + eta_reg
-                    
-                    # this must follow the naming convention of the input histograms
-                    if i == len(VALS.PT_EDGES) - 1:
-                        egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "+"
-                        egamma_loose_plots += "_" + str(VALS.PT_EDGES[i]) + "+"
-                    else:
-                        egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1])
-                        egamma_loose_plots += "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) 
-                    
-                    # Reference name of the histogram created in the backend 
-                    egamma_tight_plots += "_tight"
-                    egamma_loose_plots += "_loose"
-                    
-                    # Get the histograms from the input file
-                    h_egamma_tight = infile1.Get(egamma_tight_plots)
-                    h_egamma_loose = infile1.Get(egamma_loose_plots)
-
-                    # Set Poisson errors for tight histogram 
-                    h_egamma_tight.SetBinErrorOption(ROOT.TH1.kPoisson)
-
-                    # Configure display options
-                    h_egamma_tight.SetLineColor(ROOT.kBlack)
-                    h_egamma_loose.SetLineColor(ROOT.kBlack)
-                    
-                    if i == len(VALS.PT_EDGES) - 1: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+"
-                    else: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) 
-                    
-                    # scaled tight data
-                    if not args.useUnscaledTight and region != "iso_sym":
-                        scaled_tight_files.append(ROOT.TFile("scaled_tight_hists/" + hist_name + "_tight.root"))
-                        h_scaled_tight = scaled_tight_files[file_counter_tight].Get(hist_name+"_tight")
-                        h_egamma_tight.Reset()
-                        for b in range(h_scaled_tight.GetNbinsX()): 
-                            h_egamma_tight.SetBinContent(b+1,h_scaled_tight.GetBinContent(b+1))
-                        file_counter_tight += 1
-
-                    # FITTING
-                    if i == 0 and eta_reg == "barrel": print("====================== " + region.upper() + " =====================")
-                    if i == len(VALS.PT_EDGES) - 1: print("############### " + region.upper() + " " + eta_reg.upper() + " " + str(VALS.PT_EDGES[i]) + "+ ###############")
-                    else: print("############### " + region.upper() + " " + eta_reg.upper() + " " + str(VALS.PT_EDGES[i]) + "-" + str(VALS.PT_EDGES[i+1]) + " ###############")
-                    
-                    ### new idea, fit only rising and falling ###
-                    # determine left and right bounds
-                    # fit landaus from first_bin to left_bin
-                    # fit exps from right_bin to last_bin
-                    ENTRIES_CUTOFF = 1000  # adjust based on bulk region
-                    first_bin = 4 
-                    left_bin = 0
-                    for b in range(h_egamma_loose.GetNbinsX()):
-                      if h_egamma_loose.GetBinContent(b+1)<ENTRIES_CUTOFF: continue
-                      else:
-                        left_bin = b + 1
-                        break
-                    right_bin = h_egamma_loose.GetNbinsX()+1
-                    for b in reversed(range(h_egamma_loose.GetNbinsX())):
-                      if h_egamma_loose.GetBinContent(b+1)<ENTRIES_CUTOFF: continue
-                      else:
-                        right_bin = b + 1
-                        break
-                    last_bin = h_egamma_loose.GetNbinsX() + 1
-                    for b in reversed(range(h_egamma_loose.GetNbinsX())):
-                      if h_egamma_loose.GetBinContent(b+1)==0: continue
-                      else:
-                        last_bin = b + 1
-                        break
-                    # convert to x-ranges
-                    first = h_egamma_loose.GetBinLowEdge(first_bin)  # first bin with data
-                    left = h_egamma_loose.GetBinLowEdge(left_bin+1)  # first bin exceeding ENTRIES_CUTOFF
-                    right = h_egamma_loose.GetBinLowEdge(right_bin)  # last bin exceeding ENTRIES_CUTOFF
-                    last = h_egamma_loose.GetBinLowEdge(last_bin+1)  # last bin with data
-                    
-                    fit_init = util.lookup_fit_guesses(region, eta_reg, VALS.PT_EDGES[i])
-                    old_method = fit_init['old_method']
-                    guesses = fit_init['guesses']
-                    nLandau = fit_init['nLandau']
-                    landau_guess = fit_init['landau_guess']
-                    nExp = fit_init['nExp']
-                    exp_guess = fit_init['exp_guess']
-
-                    # Loose spectrum fitting
-                    os.chdir("loose_fit_hists")
-                    if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_loose"
-                    else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_loose" 
-                    if not os.path.exists(title + ".root") or args.createLooseFits: # create new loose fits
-                        if old_method:
-                            N = str(nLandau) + str(nExp)
-                            func_full, fitresult_full = util.fit_hist(h_egamma_loose, 'full', 0, 50, int(N), initial_guesses=guesses)
-                            loose_fit_as_hist = util.TemplateToHistogram(func_full, 1000, 0, 50)  # the histogram bin definition must align with the input loose and tight histograms
-                        else:
-                            func_rising, fitresult_rising = util.fit_hist(h_egamma_loose, 'landau', first, left, N=nLandau, initial_guesses=landau_guess)
-                            rising_fit_as_hist = util.TemplateToHistogram(func_rising, 1000, 0, 50)
-                            h_egamma_loose.Draw()
-                            c1.Update()
-                            stats1 = h_egamma_loose.GetListOfFunctions().FindObject("stats").Clone("stats1")
-                            c1.Clear()
-                            c1.Update()
-                            stats1.SetY1NDC(.4)
-                            stats1.SetY2NDC(.6)
-
-                            func_falling, fitresult_falling = util.fit_hist(h_egamma_loose, 'exp', right, last, N=nExp, initial_guesses=exp_guess)
-                            falling_fit_as_hist = util.TemplateToHistogram(func_falling, 1000, 0, 50)
-                            h_egamma_loose.Draw()
-                            c1.Update()
-                            stats2 = h_egamma_loose.GetListOfFunctions().FindObject("stats").Clone("stats2")
-                            c1.Clear()
-                            c1.Update()
-
-                            # create overall fitted histogram as: rising - bulk - falling
-                            loose_fit_as_hist = h_egamma_loose.Clone()
-                            loose_fit_as_hist.Reset()
-                            for b in range(h_egamma_loose.GetNbinsX()):
-                                if b < left_bin:
-                                    loose_fit_as_hist.SetBinContent(b+1, rising_fit_as_hist.GetBinContent(b+1))
-                                elif b <= right_bin:
-                                    loose_fit_as_hist.SetBinContent(b+1, h_egamma_loose.GetBinContent(b+1)) 
-                                else:
-                                    loose_fit_as_hist.SetBinContent(b+1, falling_fit_as_hist.GetBinContent(b+1))
-                        
-                        # Save the loose fits in a separate file
-                        #if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_loose"
-                        #else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_loose" 
-                        outfile = ROOT.TFile(title + ".root", "RECREATE")
-                        outfile.cd()
-                        loose_hist = ROOT.TH1F(title, title, 1000, 0, 50) 
-                        for b in range(loose_fit_as_hist.GetNbinsX()):
-                            loose_hist.SetBinContent(b+1,loose_fit_as_hist.GetBinContent(b+1))
-                        loose_hist.SetName(title)
-                        loose_hist.Write()
-                        outfile.Close()
-                        os.chdir("../")
-                    else: # read from already present fits
-                        os.chdir("../")
-                        
-                    # Input loose fit templates saved previously for fitting to the tight data
-                    loose_fit_files.append(ROOT.TFile("loose_fit_hists/" + hist_name + "_loose.root"))
-                    loose_fit_as_hist = loose_fit_files[file_counter_loose].Get(hist_name+"_loose")
-                    file_counter_loose += 1
-
-                    fitted_func = util.HistogramToFunction(loose_fit_as_hist)
-                    fitted_func_times_constant, _, _ = util.MultiplyWithPolyToTF1(fitted_func, 0, poly=0)  # this part can appear a bit buggy in the plots for some reason
-                    fit_result = h_egamma_tight.Fit(fitted_func_times_constant, '0L' if not args.integral else '0LI')
-                    tight_fit_w_constant = util.TemplateToHistogram(fitted_func_times_constant, 1000, 0, 50)  
-
-                    # Decide whether an F-test should be used to pick the best polynomial degree
-                    FTEST = True
-                    NUM_PLOTS = 1  # this variable is used so that the --printFtest option works
-                    if not FTEST:
-                        POLY_TYPE = 3
-                        DEGREE = 0 
-                        func_with_poly, func_with_ploy_py, _ = util.MultiplyWithPolyToTF1(fitted_func, DEGREE, poly=POLY_TYPE)
-                        h_egamma_tight.Fit(func_with_poly, '0L' if not args.integral else '0LI')
-                        tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
-                    
-                    if FTEST:
-                        parse = args.ftest.split()
-                        NUM_DEGREES = int(parse[1])
-                        if args.printFtest and args.testBin is not None: NUM_PLOTS = NUM_DEGREES+1
-                        POLY_TYPE = int(parse[0])
-                        fitfuncs = []
-                        fitresults = []
-                        statboxes = []
-                        for degree in range(NUM_DEGREES+1):
-                            func_with_poly, func_with_poly_py, _ = util.MultiplyWithPolyToTF1(fitted_func, degree, poly=POLY_TYPE)
-                            fitresult = h_egamma_tight.Fit(func_with_poly, '0SL' if not args.integral else '0SLI')
-                            tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
-
-                            fitfuncs.append(func_with_poly)
-                            fitresults.append(fitresult)
-                            h_egamma_tight.Draw()
-                            c1.Update()
-                            statboxes.append(h_egamma_tight.GetListOfFunctions().FindObject("stats").Clone("stat"+str(degree)))
-                            c1.Clear()
-                            c1.Update()
-                        h_egamma_tight.SetStats(0)
-
-                        best_d = 0
-                        for d2 in range(NUM_DEGREES+1):
-                            for d1 in range(d2):
-                                if not d1 == best_d: continue
-                                decision, ftest, target, rss1, rss2, dof1, dof2 = util.ftest(
-                                    h_egamma_tight, fitfuncs[d2], fitresults[d2], fitfuncs[d1], fitresults[d1])
-                                print(d2, '>', d1, decision)
-                                print('  F={} target={}'.format(ftest, target), '({}, {}) dof'.format(dof1, dof2))
-                                if decision: best_d = d2
-                        
-                        if args.specifyFtestDegree is not None: best_d = int(args.specifyFtestDegree)
-                        print('Best: ', best_d)
-                        func_with_poly = fitfuncs[best_d]
-                        tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
-                        tight_stat = statboxes[best_d]
-                
-                    # Save the tight templates to be plotted separately
-                    if not args.useUnscaledTight: os.chdir("tight_templates/templates/")
-                    else: os.chdir("tight_templates/templates_noscaling/")
-
-                    # Save the loose fits in a separate file
-                    if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_tight_temp"
-                    else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_tight_temp" 
-                    outfile1 = ROOT.TFile(title + ".root", "RECREATE")
-                    outfile1.cd()
-                    tight_fit_hist = ROOT.TH1F(title, title, 1000, 0, 50) 
-                    for b in range(tight_fit_as_hist.GetNbinsX()): tight_fit_hist.SetBinContent(b+1,tight_fit_as_hist.GetBinContent(b+1))
-                    tight_fit_hist.SetName(title)
-                    tight_fit_hist.Write()
-                    outfile1.Close()
-                    os.chdir("../degrees/")
-                    outfile2 = ROOT.TFile(title+"_deg.root", "RECREATE")
-                    outfile2.cd()
-                    tight_fit_deg = ROOT.TH1F(title+"_deg", title+"_deg", 10, 0, 10)
-                    for b in range(tight_fit_deg.GetNbinsX()): tight_fit_deg.SetBinContent(b+1,best_d)
-                    tight_fit_deg.SetName(title+"_deg")
-                    tight_fit_deg.Write()
-                    outfile2.Close()
-                    os.chdir("../../")
-
-                    if i == len(VALS.PT_EDGES) - 1: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+"
-                    else: hist_name = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) 
-                    
-                    # The plotting done here are for rough visualization purposes
-                    # For finalized plots, a separate plotting script should be used
-                    for plot in range(NUM_PLOTS):
-                        if args.printFtest and args.testBin:
-                            func_with_poly = fitfuncs[plot]
-                            tight_fit_as_hist = util.TemplateToHistogram(func_with_poly, 1000, 0, 50)
-                            tight_stat = statboxes[plot]
-
-                        just_poly = util.ExtractPolyFromTightFit(func_with_poly, poly=POLY_TYPE)
-                        tlast_bin = h_egamma_tight.GetNbinsX() + 1
-                        for b in reversed(range(h_egamma_tight.GetNbinsX())):
-                          if h_egamma_tight.GetBinContent(b+1)==0: continue
-                          else:
-                            tlast_bin = b + 1
-                            break
-                        rightmost_tightdata = h_egamma_loose.GetBinLowEdge(tlast_bin+1)
-                        just_poly.SetRange(0,rightmost_tightdata)
-
-                        os.chdir("tight_templates/polys/")
-                        # Save the loose fits in a separate file
-                        if i == len(VALS.PT_EDGES) - 1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_tight_poly"
-                        else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_tight_poly" 
-                        outfile1 = ROOT.TFile(title + ".root", "RECREATE")
-                        outfile1.cd()
-                        bern_poly = just_poly.Clone()
-                        bern_poly.SetName(title)
-                        bern_poly.Write()
-                        outfile1.Close()
-                        os.chdir("../../")
-                    
-                        # determine bin-by-bin error
-                        STEP_SIZE = 0.005
-                        integral = False
-                        hist = h_egamma_tight
-                        fit = func_with_poly
-                        #ndof = util.count_nonzero_VALS.PT_EDGES(hist) - fit.GetNpar()
-                        ndof = tlast_bin - fit.GetNpar()
-                        chi2, by_bin = util.RSS(fit, hist, error=0, integral=integral, chi2=True)
-                        chi2_ndof = chi2 / ndof
-                        error = 0.00
-                        #print('initial')
-                        #print('chi2', chi2, 'ndof', ndof, 'chi2_ndof', chi2_ndof)
-                        while chi2_ndof > 1.0:
-                            error += STEP_SIZE
-                            #print('trying', error)
-                            chi2, _ = util.RSS(fit, hist, error=error, integral=integral, chi2=True)
-                            chi2_ndof = chi2 / ndof
-                            #print('  ', 'chi2', chi2, 'chi2/ndof', chi2_ndof)
-                        bin_bin_error = error
-
-                        chi2_mod, mod_bins = util.RSS(fit, hist, error=0, integral=integral, chi2=True, cutoff=5)
-                        num_bins = len(mod_bins)
-                        if not num_bins == 0:
-                            chi2_mod_ndof = chi2_mod / (num_bins-fit.GetNpar())
-                            chi2_pvalues.append(scipy.stats.chi2.sf(chi2_mod, num_bins-fit.GetNpar()))
-                        else:
-                            chi2_mod_ndof = chi2_mod
-                            chi2_pvalues.append(-1)
-                        #print(chi2_mod, len(num_bins), chi2_mod_ndof)
-                        
-                        os.chdir("tight_templates/chi2s/")
-                        outfile3 = ROOT.TFile(title+"_chi2.root", "RECREATE")
-                        outfile3.cd()
-                        tight_fit_chi2 = ROOT.TH1D(title+"_chi2", title+"_chi2", 1000, 0, 100)
-                        for b in range(tight_fit_chi2.GetNbinsX()): tight_fit_chi2.SetBinContent(b+1, chi2_mod_ndof)
-                        tight_fit_chi2.SetName(title+"_chi2")
-                        tight_fit_chi2.Write()
-                        outfile2.Close()
-                        os.chdir("../../")
-
-                        h_loose_pull_num = h_egamma_loose.Clone()
-                        h_loose_pull_num.Reset()
-                        h_loose_pull = h_egamma_loose.Clone()
-                        h_loose_pull.Reset()
-                        h_loose_pull_num.Add(h_egamma_loose, loose_fit_as_hist, 1, -1)  # Numerator of pull hist is data - fit
-
-                        for j in range(h_loose_pull_num.GetNbinsX()): 
-                            if h_egamma_loose.GetBinContent(j+1) == 0: err = 1.8
-                            else: err = h_egamma_loose.GetBinError(j+1)
-                            h_loose_pull.SetBinContent(j+1, h_loose_pull_num.GetBinContent(j+1)/err)
-                            h_loose_pull.SetBinError(j+1, 1)
-                        
-                        h_tight_pull_num = h_egamma_tight.Clone()
-                        h_tight_pull_num.Reset()
-                        h_tight_pull = h_egamma_tight.Clone()
-                        h_tight_pull.Reset()
-                        h_tight_pull_num.Add(h_egamma_tight, tight_fit_as_hist, 1, -1)  # Numerator of pull hist is data - fit
-                        
-                        h_tight_pull_error = h_tight_pull.Clone() # to visualize binbin error
-                        h_tight_pull_error.Reset()
-
-                        for j in range(h_tight_pull_num.GetNbinsX()): 
-                            if h_egamma_tight.GetBinContent(j+1) == 0:
-                                err = h_egamma_tight.GetBinErrorUp(j+1)
-                            else: 
-                                if tight_fit_as_hist.GetBinContent(j+1) > h_egamma_tight.GetBinContent(j+1):
-                                    err = h_egamma_tight.GetBinErrorUp(j+1)
-                                else:
-                                    err = h_egamma_tight.GetBinErrorLow(j+1)
-                            h_tight_pull.SetBinContent(j+1, h_tight_pull_num.GetBinContent(j+1)/err)
-                            h_tight_pull.SetBinError(j+1, 1)
-                            h_tight_pull_error.SetBinContent(j+1, 0)
-                            h_tight_pull_error.SetBinError(j+1, (tight_fit_as_hist.GetBinContent(j+1)*bin_bin_error)/err)
-
-                        # pull for tight fit with constant
-                        h_tight_pullc = h_egamma_tight.Clone()
-                        h_tight_pullc.Reset()
-                        h_tight_pullc_num = h_egamma_tight.Clone()
-                        h_tight_pullc_num.Reset()
-                        h_tight_pullc_num.Add(h_egamma_tight, tight_fit_w_constant, 1, -1)  # Numerator of pull hist is data - fit
-                        for j in range(h_tight_pullc_num.GetNbinsX()): 
-                            if h_egamma_tight.GetBinContent(j+1) == 0:
-                                err = h_egamma_tight.GetBinErrorUp(j+1)
-                            else: 
-                                if tight_fit_w_constant.GetBinContent(j+1) > h_egamma_tight.GetBinContent(j+1):
-                                    err = h_egamma_tight.GetBinErrorUp(j+1)
-                                else:
-                                    err = h_egamma_tight.GetBinErrorLow(j+1)
-                            h_tight_pullc.SetBinContent(j+1, h_tight_pullc_num.GetBinContent(j+1)/err)
-                            h_tight_pullc.SetBinError(j+1, 0) # no error bar
-                        
-                        # Create title for plot 
-                        title = region + " Twoprong"
-                        if eta_reg == "barrel": title += ", Barrel"
-                        elif eta_reg == "endcap": title += ", Endcap"
-                        if i == len(VALS.PT_EDGES) - 1: title += ", pt > " + str(VALS.PT_EDGES[i])
-                        else: title += ", " + str(VALS.PT_EDGES[i]) + " < pt < " + str(VALS.PT_EDGES[i+1]) 
-                        if not old_method:
-                            if nLandau == 1: title += ", 1 land"
-                            elif nLandau == 2: title += ", 2 land"
-                            if nExp == 1: title += ", 1 exp"
-                            elif nExp == 2: title += ", 2 exp"
-                            elif nExp == 3: title += ", 3 exp"
-                            elif nExp == 4: title += ", 4 exp"
-                        if old_method:
-                            title += ", full fit (" + str(nLandau) + " land " + str(nExp) + " exp)"
-
-                        # Legend creation
-                        legend1 = ROOT.TLegend(0.35, 0.78, 0.65, 0.9)
-                        legend1.AddEntry(h_egamma_loose, "Loose Photon, " + str(round(h_egamma_loose.GetEntries())), "l")
-                        if region == "iso_sym": legend1.AddEntry(h_egamma_tight, "Tight Photon, " + str(round(h_egamma_tight.GetEntries())), "l")
-                        legend2 = ROOT.TLegend(0.29, 0.70, 0.62, 0.89)
-                        legend2.AddEntry(h_egamma_tight, "Tight Photon, " + str(h_egamma_tight.GetEntries()), "l")
-                        if POLY_TYPE == 0: legend2.AddEntry('', 'Polynomial', '')
-                        if POLY_TYPE == 1: legend2.AddEntry('', 'Chebyshev 1st kind', '')
-                        if POLY_TYPE == 2: legend2.AddEntry('', 'Chebyshev 2nd kind', '')
-                        if POLY_TYPE == 3: legend2.AddEntry('', 'Bernstein', '')
-                        func_n_par = func_with_poly.GetNpar()
-                        if POLY_TYPE == 3 and func_n_par == 1: fit_degree = 0
-                        elif POLY_TYPE == 3 and func_n_par > 1: fit_degree = func_n_par - 1
-                        elif POLY_TYPE < 3: fit_degree = func_n_par - 1
-                        if FTEST: legend2.AddEntry(tight_fit_as_hist, "Fit w f-test (Degree "+str(fit_degree)+")", "l")
-                        else: legend2.AddEntry(tight_fit_as_hist, "Fit (Degree "+str(fit_degree)+")", "l")
-                        legend2.AddEntry(tight_fit_w_constant, "Constant fit p0 = {:.4}".format(fitted_func_times_constant.GetParameter(0)), "l")
-                        legend2.AddEntry('', 'Chi2/Ndof: {:.3f}'.format(chi2_ndof), '')
-                        legend2.AddEntry('', 'Chi2_mod/Ndof: {:.3f}'.format(chi2_mod_ndof), '')
-                        legend2.AddEntry('', 'Bin Error: {:.1%}'.format(bin_bin_error), '')
-                        if args.checkPull:
-                            legend2.AddEntry('', '3 Consecutive Bins > 2 sigma: ' + str(utilcheckPullHist(h_tight_pull, 3, 2)), '')
-                            legend2.AddEntry('', '4 Consecutive Bins > 1.5 sigma: ' + str(util.checkPullHist(h_tight_pull, 4, 1.5)), '')
-                            legend2.AddEntry('', '5 Consecutive Bins > 1 sigma: ' + str(util.checkPullHist(h_tight_pull, 5, 1)), '')
-
-                        # Draw plots
-                        if args.onlyLoose: c1.cd(1)
-                        else:
-                          c1.cd()
-                          pad1 = ROOT.TPad('pad1', 'pad1', 0, 0.3, 0.5, 1)
-                          pad1.Draw()
-                          pad1.cd()
-
-                        h_egamma_loose.SetTitle(title)
-                        h_egamma_loose.SetMaximum()
-                        h_egamma_loose.SetMinimum(0.1)
-                        h_egamma_loose.Draw("e")
-                        loose_fit_as_hist.SetLineColor(ROOT.kRed+1)
-                        loose_fit_as_hist.Draw("same")
-                        if not(left == 0 and right == 50):
-                            try:
-                                stats1.Draw()
-                                stats2.Draw()
-                            except NameError:
-                                pass
-                        ROOT.gPad.SetLogy()
-                        if VALS.PT_EDGES[i] < 60: h_egamma_loose.GetXaxis().SetRangeUser(0, 5)
-                        elif VALS.PT_EDGES[i] < 120: h_egamma_loose.GetXaxis().SetRangeUser(0, 10)
-                        elif VALS.PT_EDGES[i] < 200: h_egamma_loose.GetXaxis().SetRangeUser(0, 15)
-                        elif VALS.PT_EDGES[i] < 380: h_egamma_loose.GetXaxis().SetRangeUser(0, 20)
-                        else: h_egamma_loose.GetXaxis().SetRangeUser(0, 26)
-                        legend1.Draw("same")
-                        ROOT.gPad.Update()
-
-                        if not args.onlyLoose:
-                            if not region == "iso_sym":
-                                c1.cd()
-                                pad2 = ROOT.TPad('pad2', 'pad2', 0.5, 0.3, 1, 1)
-                                pad2.Draw()
-                                pad2.cd()
-                                ROOT.gPad.SetLogy()
-                                if VALS.PT_EDGES[i] < 60: h_egamma_tight.GetXaxis().SetRangeUser(0, 5)
-                                elif VALS.PT_EDGES[i] < 120: h_egamma_tight.GetXaxis().SetRangeUser(0, 10)
-                                elif VALS.PT_EDGES[i] < 200: h_egamma_tight.GetXaxis().SetRangeUser(0, 15)
-                                elif VALS.PT_EDGES[i] < 380: h_egamma_tight.GetXaxis().SetRangeUser(0, 20)
-                                else: h_egamma_tight.GetXaxis().SetRangeUser(0, 26)
-                                h_egamma_tight.SetMinimum(0.1)
-                                h_egamma_tight.Draw("e")
-                                if FTEST: tight_stat.Draw()
-                                tight_fit_w_constant.SetLineColor(ROOT.kBlue)
-                                tight_fit_as_hist.SetLineColor(ROOT.kRed)
-                                tight_fit_as_hist.SetLineWidth(1)
-                                #tight_fit_as_hist_errorbars = tight_fit_as_hist.Clone()
-                                #tight_fit_as_hist_errorbars.SetFillColor(ROOT.kRed+2)
-                                #tight_fit_as_hist_errorbars.Draw("same e2")
-                                tight_fit_as_hist.Draw("same hist")
-                                tight_fit_w_constant.Draw('same')
-                                h_egamma_tight.Draw("e same")
-                                h_egamma_tight.GetYaxis().SetRangeUser(0.1, h_egamma_tight.GetMaximum()+50)
-                                ROOT.gPad.Update()
-
-                                legend2.Draw("same")
-                                overlay = ROOT.TPad("overlay","",0, 0.06, 1, 0.5)
-                                overlay.SetFillStyle(4000)
-                                overlay.SetFillColor(0)
-                                overlay.SetFrameFillStyle(4000)
-                                overlay.SetFrameLineWidth(0)
-                                overlay.Draw()
-                                overlay.cd()
-                                empty = ROOT.TH1F(util.getname('empty'), '', 100, 0, 50)
-                                empty.SetLineColor(ROOT.kRed)
-                                if VALS.PT_EDGES[i] < 60: empty.GetXaxis().SetRangeUser(0, 5)
-                                elif VALS.PT_EDGES[i] < 120: empty.GetXaxis().SetRangeUser(0, 10)
-                                elif VALS.PT_EDGES[i] < 200: empty.GetXaxis().SetRangeUser(0, 15)
-                                elif VALS.PT_EDGES[i] < 380: empty.GetXaxis().SetRangeUser(0, 20)
-                                else: empty.GetXaxis().SetRangeUser(0, 26)
-                                empty.GetYaxis().SetRangeUser(min(0, just_poly.GetMinimum()), just_poly.GetMaximum())
-                                empty.Draw('AH')
-                                just_poly.SetRange(0, 50)
-                                just_poly.SetTitle("")
-                                just_poly.Draw("AI L same")
-                                ROOT.gPad.Update()
-                                rightaxis = ROOT.TGaxis(ROOT.gPad.GetUxmax(), ROOT.gPad.GetUymin(), ROOT.gPad.GetUxmax(), ROOT.gPad.GetUymax(), ROOT.gPad.GetUymin(), ROOT.gPad.GetUymax(), 510, "L+")
-                                rightaxis.SetLineColor(ROOT.kRed);
-                                rightaxis.SetLabelColor(ROOT.kRed);
-                                rightaxis.Draw()
-                                ROOT.gPad.Update()
-                                #topaxis = ROOT.TGaxis(ROOT.gPad.GetUxmin(), ROOT.gPad.GetUymax(), ROOT.gPad.GetUxmax(), ROOT.gPad.GetUymax(), ROOT.gPad.GetUxmin(), ROOT.gPad.GetUxmax(), 510, "+L")
-                                #topaxis.SetLineColor(ROOT.kRed);
-                                #topaxis.SetLabelColor(ROOT.kRed);
-                                #topaxis.Draw()
-
-                            c1.cd()
-                            pad3 = ROOT.TPad('pad3', 'pad3', 0, 0, 0.5, 0.3)
-                            pad3.Draw()
-                            pad3.cd()
-                            h_loose_pull.SetTitle("(Loose - Fit) / Error")
-                            h_loose_pull.SetLineColor(ROOT.kBlack)
-                            h_loose_pull.Draw('pe')
-                            h_loose_pull.SetMarkerStyle(8)
-                            h_loose_pull.SetMarkerSize(0.25)
-                            h_loose_pull.GetYaxis().SetRangeUser(-10, 10)
-                            h_loose_pull.SetStats(0)
-                            if VALS.PT_EDGES[i] < 60: h_loose_pull.GetXaxis().SetRangeUser(0, 5)
-                            elif VALS.PT_EDGES[i] < 120: h_loose_pull.GetXaxis().SetRangeUser(0, 10)
-                            elif VALS.PT_EDGES[i] < 200: h_loose_pull.GetXaxis().SetRangeUser(0, 15)
-                            elif VALS.PT_EDGES[i] < 380: h_loose_pull.GetXaxis().SetRangeUser(0, 20)
-                            else: h_loose_pull.GetXaxis().SetRangeUser(0, 26)
-
-                            if not region == "iso_sym":
-                                c1.cd()
-                                pad4 = ROOT.TPad('pad4', 'pad4', 0.5, 0, 1, 0.3)
-                                pad4.Draw()
-                                pad4.cd()
-                                h_tight_pull.Draw('pe')
-                                h_tight_pull_error.SetLineColor(ROOT.kGray+2)
-                                h_tight_pull_error.SetFillColor(ROOT.kGray+2)
-                                h_tight_pull_error.Draw('same e2')
-                                h_tight_pull.SetTitle("(Tight - Fit) / Error")
-                                h_tight_pull.SetLineColor(ROOT.kBlack)
-                                h_tight_pull.Draw('pe same')
-                                h_tight_pull.SetMarkerStyle(8)
-                                h_tight_pull.SetMarkerSize(0.25)
-                                h_tight_pull.GetYaxis().SetRangeUser(-10, 10)
-                                h_tight_pull.SetStats(0)
-                                if VALS.PT_EDGES[i] < 60: h_tight_pull.GetXaxis().SetRangeUser(0, 5)
-                                elif VALS.PT_EDGES[i] < 120: h_tight_pull.GetXaxis().SetRangeUser(0, 10)
-                                elif VALS.PT_EDGES[i] < 200: h_tight_pull.GetXaxis().SetRangeUser(0, 15)
-                                elif VALS.PT_EDGES[i] < 380: h_tight_pull.GetXaxis().SetRangeUser(0, 20)
-                                else: h_tight_pull.GetXaxis().SetRangeUser(0, 26)
-                                h_tight_pullc.SetMarkerColor(ROOT.kBlue)
-                                h_tight_pullc.SetMarkerStyle(8)
-                                h_tight_pullc.SetMarkerSize(0.25)
-                                h_tight_pullc.Draw('pe same')
-                                ROOT.gPad.Update()
-
-                        ROOT.gPad.Update()
-                        c1.Print(args.name + ".pdf")
+                    tasks.append((region, i, eta_reg))
+
+        if parallel:
+            pages_dir = args.name + "_pages"
+            if not args.noPlots and not os.path.exists(pages_dir): os.mkdir(pages_dir)
+            tasks = [(n, region, i, eta_reg, os.path.join(pages_dir, "bin{:03d}.pdf".format(n))) for n, (region, i, eta_reg) in enumerate(tasks)]
+            if hasattr(multiprocessing, 'get_context'): pool = multiprocessing.get_context('fork').Pool(args.jobs)
+            else: pool = multiprocessing.Pool(args.jobs)
+            page_files = []
+            for result in pool.imap(run_bin_task, tasks):  # results come back in task order
+                chi2_pvalues += result['chi2_pvalues']
+                profiling.add_bin(result['bin'], result['profile'])  # profiled in the worker
+                registry.REGISTRY.merge(result['objects'])
+                if param_store is not None: param_store.merge(result['store_key'], result['params'])
+                records.append(result['metadata'])
+                if not args.noPlots: page_files.append(result['pdf'])
+            pool.close()
+            pool.join()
+            if page_files: pages.merge_pdfs(page_files, args.name + ".pdf")
+            elif not args.noPlots:
+                c1.Print(args.name + ".pdf[")
+                c1.Print(args.name + ".pdf]")
+        else:
+            for region, i, eta_reg in tasks:
+                if args.stream and not region == "iso_sym":
+                    for category, hist in streaming.scale_bin(egamma, region, eta_reg, i): store.put(category, [hist])
+                result = fit_bin(region, i, eta_reg, egamma, c1, args.name + ".pdf", store, param_store)
+                chi2_pvalues += result['chi2_pvalues']
+                records.append(result['metadata'])
+        if records and not args.stream: fit_metadata.save(store, records)
+        if args.stream:
+            mc_file = ROOT.TFile("summed_gjets.root") if os.path.exists("summed_gjets.root") else None
+            for region in regions:
+                if region == "iso_sym": continue
+                for eta_reg in eta_regions:
+                    if not all((region, i, eta_reg) in tasks for i in range(len(VALS.PT_EDGES))): continue  # only whole control regions
+                    if mc_file is None:
+                        print("no summed_gjets.root, not writing the BAT bundle of", region + "_" + eta_reg)
+                        continue
+                    for path in streaming.export_bat(store, egamma, mc_file, region + "_" + eta_reg, args.streamFormat): print("wrote", path)
+        store.close()
+        registry.print_stats()
+        if args.profile is not None:
+            profiling.print_summary()
+            for path in profiling.write(args.profile): print("wrote", path)
 
     if args.show: input("Finished. Press Enter.")
-    c1.Print(args.name + ".pdf]")
-    infile1.Close()
+    if not parallel and not args.noPlots: c1.Print(args.name + ".pdf]")
+    if infile1 is not None: infile1.Close()
+
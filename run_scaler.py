@@ -1,14 +1,10 @@
 from __future__ import print_function
 import math
-import ROOT
 import sys
 import os
 import argparse
 import array
-import fitting_utils as util
 import constants as VALS
-import scipy
-import scipy.stats as stats
 import itertools
 
 # command line options
@@ -17,25 +13,58 @@ parser.add_argument("input", metavar="INPUT", help="input directory file with su
 parser.add_argument("--testBin", default=None, help="specify bin to test")
 parser.add_argument("--nophislice", default=False, action="store_true", help="")
 parser.add_argument("--scaleTo", "-s", default="same", choices=["same", "overall"], help="")
+parser.add_argument("--jobs", "-j", default=1, type=int, help="number of processes to downsample with")
+parser.add_argument("--seed", default=None, type=int, help="seed of the random streams, default is SEED")
+parser.add_argument("--noHistCache", default=False, action="store_true", help="read summed_egamma.root with ROOT instead of the memory-mapped histogram cache")
+parser.add_argument("--legacyRNG", default=False, action="store_true", help="downsample bin by bin with TRandom3 as before (results differ from the default)")
 args = parser.parse_args()
 
+# imported after the options are parsed, so --help and option errors don't wait for ROOT
+import ROOT
+import fitting_utils as util
+import downsampling
+import artifact_store as artifacts
+import hist_cache
+import th1_arrays as th1
+
 # Constants
-SEED = 12445
-directory_name = "scaled_tight_hists"
-phislice_directory_name = "scaled_phislice_tight_hists"
+SEED = VALS.SCALE_SEED
 eta_regions = ["barrel", "endcap"]
 regions = ["iso_sym", "iso_asym", "noniso_sym", "noniso_asym"]
 
 # init
 os.chdir(args.input)
-infile1 = ROOT.TFile('summed_egamma.root')
+if args.noHistCache: infile1 = ROOT.TFile('summed_egamma.root')
+else: infile1 = hist_cache.shared('.')
 rand = ROOT.TRandom3()
 rand.SetSeed(SEED)
+seed = args.seed if args.seed is not None else SEED
 if args.testBin is not None: test_bin = (args.testBin).split(" ")
-if not os.path.exists(directory_name): os.mkdir(directory_name)
-os.chdir(directory_name)
+store = artifacts.ArtifactStore('.')
+
+def egamma_counts(plot_name):
+    '''
+    Bin contents of an input histogram, a view into the histogram cache unless --noHistCache
+    '''
+    if args.noHistCache: return util.hist_to_numpy(infile1.Get(plot_name))
+    return infile1.contents(plot_name.split('/')[-1])
+
+def scale_hists(jobs, rand=None):
+    '''
+    Downsample the input histograms of jobs, a list of dicts with 'name', 'plot' and 'target'
+    
+    Returns the list of downsampled bin contents, in the order of jobs
+    '''
+    if args.legacyRNG:
+        hists = [infile1.Get(job['plot']) for job in jobs]
+        for job, hist in zip(jobs, hists): util.removeEntries(hist, job['target'], rand=rand)
+        return [util.hist_to_numpy(hist) for hist in hists]
+    items = [(job['name'], egamma_counts(job['plot']), job['target']) for job in jobs]
+    scaled = downsampling.downsample_many(items, seed, processes=args.jobs)
+    return list(scaled.values())
 
 # pt-binned only histos
+jobs = []
 for region, i, eta_reg in itertools.product(regions, range(len(VALS.PT_EDGES)), eta_regions):
     if region == "iso_sym": continue
     if args.testBin:
@@ -46,33 +75,24 @@ for region, i, eta_reg in itertools.product(regions, range(len(VALS.PT_EDGES)),
     if i == len(VALS.PT_EDGES)-1: egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "+"
     else: egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1])
     egamma_tight_plots += "_tight"
-    h_egamma_tight = infile1.Get(egamma_tight_plots)
-
-    # Scale
-    target = infile1.Get(egamma_tight_plots.replace(region, "iso_sym")).Integral()
-    util.removeEntries(h_egamma_tight, target, rand=rand)
 
-    # Save
+    # Scale target
+    target = egamma_counts(egamma_tight_plots.replace(region, "iso_sym")).sum()
     if i == len(VALS.PT_EDGES)-1: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "+_tight"
     else: title = region + "_" + eta_reg + "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1]) + "_tight" 
-    outfile = ROOT.TFile(title + ".root", "RECREATE")
-    outfile.cd()
+    jobs.append({'name': title, 'plot': egamma_tight_plots, 'target': target})
+
+# Scale and save
+scaled_hists = []
+for job, contents in zip(jobs, scale_hists(jobs, rand=rand)):
+    title = job['name']
     tight_hist = ROOT.TH1F(title, title, 1000, 0, 50) 
-    for b in range(h_egamma_tight.GetNbinsX()):
-        tight_hist.SetBinContent(b+1,h_egamma_tight.GetBinContent(b+1))
+    th1.set_contents(tight_hist, contents)
     tight_hist.SetName(title)
-    tight_hist.Write()
-    outfile.Close()
+    scaled_hists.append(tight_hist)
+store.put(artifacts.SCALED_TIGHT, scaled_hists)
 
-    egamma_tight_plots = "plots/twoprong_masspi0_phi" + region + "_" + eta_reg
-    if i == len(VALS.PT_EDGES)-1: egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "+"
-    else: egamma_tight_plots += "_" + str(VALS.PT_EDGES[i]) + "_" + str(VALS.PT_EDGES[i+1])
-    egamma_tight_plots += "_tight"
-
-if args.nophislice: exit()
-os.chdir('../')
-if not os.path.exists(phislice_directory_name): os.mkdir(phislice_directory_name)
-os.chdir(phislice_directory_name)
+if args.nophislice: sys.exit()
 
 if args.scaleTo == "overall":
     full_integrals = {}
@@ -86,12 +106,12 @@ if args.scaleTo == "overall":
             pt_low = VALS.PT_EDGES[i]
             pt_high = VALS.PT_EDGES[i+1] if i != len(VALS.PT_EDGES)-1 else "Inf"
             tight_plot_name = 'plots/{}phi{}-{}_{}_pt{}-{}_tight'.format(histogram_prefix_mass, phi_low, phi_high, control_region, pt_low, pt_high)
-            h_egamma_tight = infile1.Get(tight_plot_name)
-            total_integral += h_egamma_tight.Integral()
+            total_integral += egamma_counts(tight_plot_name).sum()
         full_integrals[region + "_" + eta_reg] = total_integral
     print(full_integrals)
 
 # pt-and-phi-binned histos
+jobs = []
 for region, i, eta_reg, k in itertools.product(regions, range(len(VALS.PT_EDGES)), eta_regions, range(len(VALS.PHI_EDGES))):
     if region == "iso_sym": continue
     if args.testBin:
@@ -105,24 +125,22 @@ for region, i, eta_reg, k in itertools.product(regions, range(len(VALS.PT_EDGES)
     pt_low = VALS.PT_EDGES[i]
     pt_high = VALS.PT_EDGES[i+1] if i != len(VALS.PT_EDGES)-1 else "Inf"
     tight_plot_name = 'plots/{}phi{}-{}_{}_pt{}-{}_tight'.format(histogram_prefix_mass, phi_low, phi_high, control_region, pt_low, pt_high)
-    h_egamma_tight = infile1.Get(tight_plot_name)
-    h_egamma_signal_region = infile1.Get(tight_plot_name.replace(region, "iso_sym"))
 
-    # Scale
+    # Scale target
     if args.scaleTo == "overall":
         signal_region = "iso_sym_" + eta_reg
-        target = h_egamma_tight.Integral() * (full_integrals[signal_region] / full_integrals[control_region])
-    if args.scaleTo == "same": target = h_egamma_signal_region.Integral()
-    util.removeEntries(h_egamma_tight, target)
-
-    # Save
+        target = egamma_counts(tight_plot_name).sum() * (full_integrals[signal_region] / full_integrals[control_region])
+    if args.scaleTo == "same": target = egamma_counts(tight_plot_name.replace(region, "iso_sym")).sum()
     save_name = '{}phi{}-{}_{}_pt{}-{}_tight'.format(histogram_prefix_mass, phi_low, phi_high, control_region, pt_low, pt_high)
-    outfile = ROOT.TFile(save_name + ".root", "RECREATE")
-    outfile.cd()
-    save_hist = h_egamma_tight.Clone()
+    jobs.append({'name': save_name, 'plot': tight_plot_name, 'target': target})
+
+# Scale and save
+scaled_hists = []
+for job, contents in zip(jobs, scale_hists(jobs)):
+    save_name = job['name']
+    save_hist = infile1.Get(job['plot']).Clone()
     save_hist.SetName(save_name)
     save_hist.Reset()
-    for b in range(h_egamma_tight.GetNbinsX()):
-        save_hist.SetBinContent(b+1,h_egamma_tight.GetBinContent(b+1))
-    save_hist.Write()
-    outfile.Close()
+    th1.set_contents(save_hist, contents)
+    scaled_hists.append(save_hist)
+store.put(artifacts.SCALED_PHISLICE, scaled_hists)
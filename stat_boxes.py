@@ -0,0 +1,59 @@
+'''
+Fit stat boxes made from the fit results, without drawing the fitted histogram
+
+summary() reads chi2, ndf and parameters from a fitted TF1 (every fit backend
+and tight solver sets them) when the fit is done, and box() makes the
+TPaveStats from a summary only when a page is drawn, so fitting needs no canvas.
+
+The box has the lines gStyle.GetOptFit() asks for, formatted with
+gStyle.GetFitFormat(), at the gStyle stat box position.
+'''
+
+def summary(tf1):
+    '''
+    Chi2, ndf, probability and parameters of a fitted TF1, as plain python values
+    '''
+    return {
+        'chi2': tf1.GetChisquare(),
+        'ndf': tf1.GetNDF(),
+        'prob': tf1.GetProb(),
+        'params': [(tf1.GetParName(i), tf1.GetParameter(i), tf1.GetParError(i)) for i in range(tf1.GetNpar())],
+    }
+
+def lines(fit_summary, optfit=1111, fmt='5.4g'):
+    '''
+    Text lines of the stat box, as THistPainter writes them for optfit
+    '''
+    print_values, print_errors, print_chi2, print_prob = optfit % 10, (optfit // 10) % 10, (optfit // 100) % 10, (optfit // 1000) % 10
+    number = lambda value: ('{:' + fmt + '}').format(value).strip()
+    text = []
+    if print_chi2: text.append('#chi^{{2}} / ndf = {} / {}'.format(number(fit_summary['chi2']), int(fit_summary['ndf'])))
+    if print_prob: text.append('Prob  = {}'.format(number(fit_summary['prob'])))
+    if print_values:
+        for name, value, error in fit_summary['params']:
+            if print_errors: text.append('{:<8} = {} #pm {}'.format(name, number(value), number(error)))
+            else: text.append('{:<8} = {}'.format(name, number(value)))
+    return text
+
+def box(fit_summary, name='stats', y1=None, y2=None):
+    '''
+    TPaveStats with the fit summary, placed like the default stat box unless y1/y2 (NDC) are given
+    '''
+    import ROOT
+    style = ROOT.gStyle
+    text = lines(fit_summary, style.GetOptFit(), style.GetFitFormat())
+    x2 = style.GetStatX()
+    x1 = x2 - style.GetStatW()
+    if y2 is None: y2 = style.GetStatY()
+    if y1 is None: y1 = y2 - style.GetStatH() * max(1.0, len(text) / 4.0)
+    stats = ROOT.TPaveStats(x1, y1, x2, y2, 'brNDC')
+    stats.SetName(name)
+    stats.SetFillColor(style.GetStatColor())
+    stats.SetFillStyle(style.GetStatStyle())
+    stats.SetBorderSize(style.GetStatBorderSize())
+    stats.SetTextFont(style.GetStatFont())
+    stats.SetTextColor(style.GetStatTextColor())
+    stats.SetTextAlign(12)
+    for line in text: stats.AddText(line)
+    ROOT.SetOwnership(stats, False)  # owned by the pad it is drawn on
+    return stats
@@ -0,0 +1,72 @@
+'''
+In-memory versions of the run_scaler and process_for_BAT steps, for run_fitter --stream
+
+With --stream, run_fitter reads the histograms of each bin once from the
+histogram cache, scales them with scale_bin(), fits them, and keeps every
+intermediate histogram in an artifact_store.MemoryStore. At the end the BAT
+bundles are made from memory with export_bat(). Only the pdf and the bundles
+are written, no fit_artifacts.root and no per-bin files.
+
+scale_bin() draws from the same random streams as run_scaler with its
+default options (--scaleTo same, the default seed), so it gives the same
+scaled histograms.
+'''
+import os
+import constants as VALS
+import downsampling
+import artifact_store as artifacts
+import bat_bundle
+import th1_arrays as th1
+
+SIGNAL_REGION = 'iso_sym'
+
+def hist_arrays(hist):
+    '''
+    (contents, edges) of a TH1, without under- and overflow
+    '''
+    return th1.contents(hist).astype(float), th1.edges(hist)
+
+def scale_bin(cache, region, eta_reg, i, seed=VALS.SCALE_SEED, cutoff=1e6):
+    '''
+    Scaled tight histograms of one bin, the pt binned one and its phi slices
+
+    Returns a list of (artifact category, TH1)
+    '''
+    import ROOT
+    control_region = region + "_" + eta_reg
+    pt_low = VALS.PT_EDGES[i]
+    pt_high = VALS.PT_EDGES[i+1] if i != len(VALS.PT_EDGES)-1 else "Inf"
+    if pt_high == "Inf": title = control_region + "_" + str(pt_low) + "+_tight"
+    else: title = control_region + "_" + str(pt_low) + "_" + str(pt_high) + "_tight"
+    input_name = bat_bundle.PREFIX_MASS + title
+    items = [(title, cache.contents(input_name), cache.integral(input_name.replace(region, SIGNAL_REGION)))]
+    categories = {title: artifacts.SCALED_TIGHT}
+    for k in range(len(VALS.PHI_EDGES)):
+        phi_low = VALS.PHI_EDGES[k]
+        phi_high = VALS.PHI_EDGES[k+1] if k != len(VALS.PHI_EDGES)-1 else "Inf"
+        name = '{}phi{}-{}_{}_pt{}-{}_tight'.format(bat_bundle.PREFIX_MASS, phi_low, phi_high, control_region, pt_low, pt_high)
+        items.append((name, cache.contents(name), cache.integral(name.replace(region, SIGNAL_REGION))))
+        categories[name] = artifacts.SCALED_PHISLICE
+    hists = []
+    for name, contents in downsampling.downsample_many(items, seed, cutoff=cutoff).items():
+        if categories[name] == artifacts.SCALED_TIGHT: hist = ROOT.TH1F(name, name, 1000, 0, 50)
+        else:
+            hist = cache.to_hist(name)
+            hist.Reset()
+        th1.set_contents(hist, contents)
+        hists.append((categories[name], hist))
+    return hists
+
+def export_bat(store, cache, mc_file, control_region, fmt='npz', directory='.'):
+    '''
+    Writes the BAT bundle of control_region from the histograms in store
+
+    mc_file is the open summed_gjets.root, for the pt spectra
+    '''
+    def read(source, name):
+        if source == bat_bundle.EGAMMA: return cache.contents(name), cache.edges(name)
+        if source == bat_bundle.MC: return hist_arrays(mc_file.Get(name))
+        return hist_arrays(store.get(source, name))
+    arrays = bat_bundle.collect(control_region, read, VALS.PT_EDGES, VALS.PHI_EDGES)
+    bat_bundle.save(directory, control_region, arrays, fmt)
+    return bat_bundle.paths(os.path.abspath(directory), control_region, fmt)
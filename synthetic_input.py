@@ -0,0 +1,154 @@
+'''
+Synthetic summed_egamma.root (and summed_gjets.root) for benchmarks and tests
+
+The masspi0 histograms have the names and binning of the real input
+(plots/twoprong_masspi0_*, 1000 bins from 0 to 50), so every script runs on
+them unchanged:
+
+  twoprong_masspi0_<region>_<eta>_<pt low>_<pt high>_<tight|loose>   (last bin <pt low>+)
+  twoprong_masspi0_phi<low>-<high>_<region>_<eta>_pt<low>-<high>_tight
+  twoprong_masspi0_phiAll_<region>_<eta>_pt<low>-<high>_tight
+
+Each spectrum is a Landau-like rise (the Moyal approximation of the Landau
+density) continued by an exponential, with a peak and tail slope that move
+with pt, and Poisson fluctuations. The number of entries falls with pt like
+(pt_min/pt)^2 from --entries in the first bin. The tight histograms are a
+fraction of the loose statistics and are split over the phi bins, so the
+phi slices add up to the pt binned histogram like in the real input.
+
+Written with ROOT if it can be imported, with uproot otherwise.
+
+  python synthetic_input.py <dir> --entries 1e6 --seed 1
+'''
+from __future__ import print_function
+import os
+import argparse
+import numpy as np
+import constants as VALS
+
+REGIONS = ["iso_sym", "iso_asym", "noniso_sym", "noniso_asym"]
+ETA_REGIONS = ["barrel", "endcap"]
+NBINS, LOW, HIGH = 1000, 0, 50
+# tight/loose ratio of the statistics of each region
+TIGHT_FRACTION = {"iso_sym": 0.10, "iso_asym": 0.06, "noniso_sym": 0.30, "noniso_asym": 0.20}
+# relative statistics of the regions and eta regions
+REGION_SCALE = {"iso_sym": 0.2, "iso_asym": 0.3, "noniso_sym": 1.0, "noniso_asym": 0.8}
+ETA_SCALE = {"barrel": 1.0, "endcap": 0.6}
+PHI_FRACTIONS_SLOPE = 1.5  # phi slices get exponentially fewer entries
+
+def shape(x, pt, eta_reg='barrel', tight=False):
+    '''
+    Density (not normalized) of the masspi0 spectrum of a pt bin at the points x
+    '''
+    mpv = 0.4 + 0.006 * pt + (0.05 if eta_reg == 'endcap' else 0.0)
+    sigma = 0.06 + 0.0015 * pt
+    if tight: sigma *= 0.9
+    slope = -1.0 / (0.5 + 0.012 * pt)
+    boundary = mpv + 3 * sigma
+    def moyal(x):
+        lam = (x - mpv) / sigma
+        return np.exp(-0.5 * (lam + np.exp(-lam)))
+    x = np.asarray(x, dtype=float)
+    with np.errstate(over='ignore'):
+        rise = moyal(np.minimum(x, boundary))
+    tail = moyal(boundary) * np.exp(slope * (x - boundary))
+    return np.where(x < boundary, rise, tail)
+
+def spectrum(rand, entries, pt, eta_reg, tight):
+    edges = np.linspace(LOW, HIGH, NBINS + 1)
+    density = shape((edges[:-1] + edges[1:]) / 2.0, pt, eta_reg, tight)
+    return rand.poisson(entries * density / density.sum()).astype(float), edges
+
+def pt_label(pt_edges, i):
+    if i == len(pt_edges) - 1: return str(pt_edges[i]) + "+"
+    return str(pt_edges[i]) + "_" + str(pt_edges[i+1])
+
+def make_histograms(entries=1e6, pt_edges=VALS.PT_EDGES, phi_edges=VALS.PHI_EDGES, eta_regions=ETA_REGIONS, regions=REGIONS, seed=1):
+    '''
+    Returns an ordered list of (name, contents, edges) of the masspi0 histograms
+    '''
+    rand = np.random.RandomState(seed)
+    phi_weights = np.exp(-PHI_FRACTIONS_SLOPE * np.arange(len(phi_edges)))
+    phi_weights /= phi_weights.sum()
+    hists = []
+    for region in regions:
+        for eta_reg in eta_regions:
+            for i, pt in enumerate(pt_edges):
+                n_loose = entries * REGION_SCALE[region] * ETA_SCALE[eta_reg] * (float(pt_edges[0]) / pt)**2
+                loose, edges = spectrum(rand, n_loose, pt, eta_reg, False)
+                tight, _ = spectrum(rand, n_loose * TIGHT_FRACTION[region], pt, eta_reg, True)
+                name = "twoprong_masspi0_" + region + "_" + eta_reg + "_" + pt_label(pt_edges, i)
+                hists.append((name + "_loose", loose, edges))
+                hists.append((name + "_tight", tight, edges))
+                # phi slices: a multinomial split of the tight entries of every mass bin
+                pt_high = pt_edges[i+1] if i != len(pt_edges)-1 else "Inf"
+                slices = np.array([rand.multinomial(int(n), phi_weights) for n in tight]).T.astype(float)
+                for k in range(len(phi_edges)):
+                    phi_high = phi_edges[k+1] if k != len(phi_edges)-1 else "Inf"
+                    hists.append(('twoprong_masspi0_phi{}-{}_{}_{}_pt{}-{}_tight'.format(phi_edges[k], phi_high, region, eta_reg, pt, pt_high), slices[k], edges))
+                hists.append(('twoprong_masspi0_phiAll_{}_{}_pt{}-{}_tight'.format(region, eta_reg, pt, pt_high), tight.copy(), edges))
+    return hists
+
+def make_pt_spectra(entries=1e6, phi_edges=VALS.PHI_EDGES, eta_regions=ETA_REGIONS, seed=2):
+    '''
+    (name, contents, edges) of the MC twoprong pt spectra of summed_gjets.root that process_for_BAT reads
+    '''
+    rand = np.random.RandomState(seed)
+    edges = np.linspace(0, 2000, 201)
+    centers = (edges[:-1] + edges[1:]) / 2.0
+    hists = []
+    for eta_reg in eta_regions:
+        for k in range(len(phi_edges)):
+            phi_high = phi_edges[k+1] if k != len(phi_edges)-1 else "Inf"
+            density = np.where(centers > 20, (20.0 / centers)**3, 0.0)
+            name = "twoprong_pt_phi{}-{}_iso_sym_{}_ptX-X_tight".format(phi_edges[k], phi_high, eta_reg)
+            hists.append((name, rand.poisson(entries * density / density.sum()).astype(float), edges))
+    return hists
+
+def write(path, hists):
+    '''
+    Writes the histograms into the plots/ directory of a new ROOT file
+    '''
+    try:
+        import ROOT
+    except ImportError:
+        ROOT = None
+    if ROOT is None:
+        import uproot
+        with uproot.recreate(path) as outfile:
+            for name, contents, edges in hists: outfile['plots/' + name] = (contents, edges)
+        return
+    import array
+    import th1_arrays as th1
+    outfile = ROOT.TFile(path, 'RECREATE')
+    outfile.mkdir('plots').cd()
+    for name, contents, edges in hists:
+        hist = ROOT.TH1F(name, name, len(edges) - 1, array.array('d', edges))
+        th1.set_contents(hist, contents)
+        hist.SetEntries(float(np.sum(contents)))
+        hist.Write()
+    outfile.Close()
+
+def generate(directory, entries=1e6, pt_edges=VALS.PT_EDGES, phi_edges=VALS.PHI_EDGES, eta_regions=ETA_REGIONS, seed=1):
+    '''
+    Writes summed_egamma.root and summed_gjets.root into directory, returns their paths
+    '''
+    if not os.path.exists(directory): os.makedirs(directory)
+    egamma = os.path.join(directory, 'summed_egamma.root')
+    gjets = os.path.join(directory, 'summed_gjets.root')
+    write(egamma, make_histograms(entries, pt_edges, phi_edges, eta_regions, seed=seed))
+    write(gjets, make_pt_spectra(entries, phi_edges, eta_regions, seed=seed+1))
+    return [egamma, gjets]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="write a synthetic summed_egamma.root and summed_gjets.root")
+    parser.add_argument("output", metavar="OUTPUT", help="output directory")
+    parser.add_argument("--entries", default=1e6, type=float, help="loose entries of the first pt bin of noniso_sym barrel, the others scale from it")
+    parser.add_argument("--ptEdges", default=None, help="low edges of the pt bins, e.g. '20 40 60', default is constants.PT_EDGES (the scripts use those)")
+    parser.add_argument("--phiEdges", default=None, help="low edges of the phi bins, default is constants.PHI_EDGES")
+    parser.add_argument("--etaRegions", nargs="+", default=ETA_REGIONS, choices=ETA_REGIONS, help="eta regions to write")
+    parser.add_argument("--seed", default=1, type=int, help="seed of the fluctuations")
+    args = parser.parse_args()
+    pt_edges = [int(v) for v in args.ptEdges.split()] if args.ptEdges else VALS.PT_EDGES
+    phi_edges = [int(v) for v in args.phiEdges.split()] if args.phiEdges else VALS.PHI_EDGES
+    for path in generate(args.output, args.entries, pt_edges, phi_edges, args.etaRegions, args.seed): print("wrote", path)
@@ -0,0 +1,104 @@
+'''
+NumPy access to the bins of a TH1 without per-bin PyROOT calls
+
+contents() is a view on the TH1's own GetArray() buffer: reading it copies
+nothing, and writing to it changes the histogram. set_contents() and
+copy_contents() fill a histogram in one assignment instead of a loop of
+SetBinContent calls.
+
+  values = th1_arrays.contents(hist)      # bins 1..N, no under- or overflow
+  th1_arrays.set_contents(hist, values)   # statistics are recomputed
+  th1_arrays.copy_contents(dst, src)
+
+Histograms whose buffer can't be viewed (other classes, PyROOT versions
+without buffer support) fall back to per-bin calls, so the functions work
+with any TH1.
+'''
+import numpy as np
+
+# numpy type of the GetArray() buffer of each class
+DTYPES = {
+    'TH1D': np.float64,
+    'TH1F': np.float32,
+    'TH1I': np.int32,
+    'TH1S': np.int16,
+    'TH1C': np.int8,
+}
+
+def _view(buf, count, dtype):
+    if hasattr(buf, 'reshape'): buf.reshape((count,))  # cppyy LowLevelView
+    elif hasattr(buf, 'SetSize'): buf.SetSize(count)  # PyROOT buffers before 6.22
+    return np.frombuffer(buf, dtype=dtype, count=count)
+
+def buffer(hist):
+    '''
+    View of all cells of hist (under- and overflow included), None if there is none
+    '''
+    try:
+        dtype = DTYPES.get(hist.ClassName())
+        if dtype is None: return None
+        return _view(hist.GetArray(), hist.GetNcells(), dtype)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def contents(hist, flow=False):
+    '''
+    Bin contents of hist, a view on the histogram if possible and a copy otherwise
+    '''
+    view = buffer(hist)
+    if view is None:
+        nbins = hist.GetNbinsX()
+        first, last = (0, nbins+2) if flow else (1, nbins+1)
+        return np.array([hist.GetBinContent(b) for b in range(first, last)], dtype=float)
+    return view if flow else view[1:-1]
+
+def errors(hist):
+    '''
+    Symmetric bin errors of hist (a new array), as GetBinError()
+    '''
+    nbins = hist.GetNbinsX()
+    if hist.GetBinErrorOption() == 0:  # TH1::kNormal
+        if hist.GetSumw2N():
+            sumw2 = hist.GetSumw2()
+            try:
+                return np.sqrt(_view(sumw2.GetArray(), sumw2.GetSize(), np.float64)[1:nbins+1])
+            except (AttributeError, TypeError, ValueError):
+                pass
+        else:
+            return np.sqrt(np.abs(contents(hist).astype(float)))
+    return np.array([hist.GetBinError(b+1) for b in range(nbins)])
+
+def edges(hist):
+    '''
+    The nbins+1 bin edges of hist
+    '''
+    axis = hist.GetXaxis()
+    nbins = axis.GetNbins()
+    if axis.GetXbins().GetSize():
+        try:
+            return _view(axis.GetXbins().GetArray(), nbins+1, np.float64).copy()
+        except (AttributeError, TypeError, ValueError):
+            return np.array([axis.GetBinLowEdge(b+1) for b in range(nbins+1)])
+    return np.linspace(axis.GetXmin(), axis.GetXmax(), nbins+1)
+
+def set_contents(hist, values, flow=False):
+    '''
+    Sets the bin contents of hist from values (bins 1..N, or all cells with flow=True)
+
+    The statistics (entries, mean, ...) are recomputed from the new contents.
+    '''
+    view = buffer(hist)
+    if view is not None and view.flags.writeable:
+        if flow: view[:] = values
+        else: view[1:-1] = values
+        hist.ResetStats()
+        return hist
+    first = 0 if flow else 1
+    for b, value in enumerate(values): hist.SetBinContent(b + first, value)
+    return hist
+
+def copy_contents(dst, src):
+    '''
+    Copies the bin contents of src into dst, which must have the same number of bins
+    '''
+    return set_contents(dst, contents(src))
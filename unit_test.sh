@@ -3,11 +3,14 @@ if [[ $# -ne 1 ]]; then
     echo "Must supply input directory" >&2
     exit 2
 fi
+python kernels.py || exit 1
 rm -rf $1/scaled_tight_hists/
 rm -rf $1/scaled_phislice_tight_hists/
 rm -rf $1/loose_fit_hists/
 rm -rf $1/tight_templates/
+rm -f $1/fit_artifacts.root $1/fit_artifacts.root.lock $1/fit_artifacts.root.metadata.lock $1/fit_artifacts.root.generation
 rm $1/plots.pdf
+rm -rf $1/plots_pages/
 python run_scaler.py $1 --testBin "noniso_sym barrel 100"
 python run_fitter.py $1 --testBin "noniso_sym barrel 100" --useScaledTight
 python run_fitter.py $1 --testBin "noniso_sym barrel 100"
@@ -0,0 +1,203 @@
+'''
+NumPy backend for fit_hist()
+
+The piecewise Landau/exponential models of fit_hist() (kernels.CHAINS) are
+evaluated over the whole array of bin centers in one call, and the binned
+Poisson likelihood that ROOT minimizes for the 'L' fit option is minimized
+with scipy. The fitted parameters are written back into the TF1 built by fit_hist(), so the TF1 can be
+used exactly as after hist.Fit(), and the returned FitResult stands in for the
+TFitResult.
+'''
+import ctypes
+import numpy as np
+import ROOT
+import kernels
+import th1_arrays as th1
+
+# points and weights used to average the model over a bin for the 'I' option
+GAUSS_POINTS, GAUSS_WEIGHTS = np.polynomial.legendre.leggauss(5)
+
+def _model(build):
+    return lambda x, p: build(p)(x)
+
+# (function, N) of fit_hist() -> vectorized model(x, p), the Chain of kernels.CHAINS at the array x
+MODELS = dict((key, _model(build)) for key, (build, npar) in kernels.CHAINS.items())
+
+class FitResult(object):
+    '''
+    Stand-in for the TFitResult returned by hist.Fit(tf1, 'S')
+    '''
+    def __init__(self, parameters, errors, covariance, min_fcn, ndf, status, edm, ncalls):
+        self.parameters = parameters
+        self.errors = errors
+        self.covariance = covariance
+        self.min_fcn = min_fcn
+        self.ndf = ndf
+        self.status = status
+        self.edm = edm
+        self.ncalls = ncalls
+
+    def Status(self): return self.status
+    def IsValid(self): return self.status == 0
+    def Parameter(self, i): return self.parameters[i]
+    def ParError(self, i): return self.errors[i]
+    def Parameters(self): return list(self.parameters)
+    def Errors(self): return list(self.errors)
+    def NPar(self): return len(self.parameters)
+    def CovMatrix(self, i, j): return self.covariance[i, j]
+    def MinFcnValue(self): return self.min_fcn
+    def Chi2(self): return 2 * self.min_fcn  # Baker-Cousins likelihood chi2, as ROOT reports for 'L' fits
+    def Ndf(self): return self.ndf
+    def Edm(self): return self.edm
+    def NCalls(self): return self.ncalls
+    def Prob(self):
+        from scipy.stats import chi2
+        return chi2.sf(self.Chi2(), self.ndf) if self.ndf > 0 else 0.0
+
+def hist_arrays(hist):
+    '''
+    Returns bin low edges, widths and contents of a TH1 as numpy arrays
+    '''
+    edges = th1.edges(hist)
+    return edges[:-1], np.diff(edges), th1.contents(hist).astype(float)
+
+def par_limits(tf1, i):
+    '''
+    Returns the (low, high) limits of parameter i of a TF1, None if not limited
+    '''
+    if hasattr(ROOT, 'Double'): low, high = ROOT.Double(0), ROOT.Double(0)
+    else: low, high = ctypes.c_double(0), ctypes.c_double(0)
+    tf1.GetParLimits(i, low, high)
+    low, high = float(getattr(low, 'value', low)), float(getattr(high, 'value', high))
+    if low == 0 and high == 0: return None
+    if low >= high: return (low, low)  # fixed parameter
+    return (low, high)
+
+def evaluate(model, p, lows, widths, integral=False):
+    '''
+    Model values at bin centers, or averaged over each bin if integral=True
+    '''
+    if not integral:
+        return model(lows + widths/2.0, p)
+    x = (lows[:, None] + widths[:, None] * (GAUSS_POINTS[None, :] + 1)/2.0).ravel()
+    vals = model(x, p).reshape(len(lows), len(GAUSS_POINTS))
+    return vals.dot(GAUSS_WEIGHTS) / 2.0
+
+def poisson_nll(mu, n):
+    '''
+    Binned Poisson negative log-likelihood, offset so that a perfect fit is 0
+    '''
+    mu = np.where(np.isfinite(mu) & (mu > 1e-300), mu, 1e-300)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_term = np.where(n > 0, n * np.log(n / mu), 0.0)
+    return np.sum(mu - n + log_term)
+
+def _hessian(fcn, x, steps):
+    npar = len(x)
+    hess = np.zeros((npar, npar))
+    f0 = fcn(x)
+    for i in range(npar):
+        ei = np.zeros(npar); ei[i] = steps[i]
+        hess[i, i] = (fcn(x + ei) - 2*f0 + fcn(x - ei)) / steps[i]**2
+        for j in range(i):
+            ej = np.zeros(npar); ej[j] = steps[j]
+            hess[i, j] = hess[j, i] = (fcn(x + ei + ej) - fcn(x + ei - ej) - fcn(x - ei + ej) + fcn(x - ei - ej)) / (4*steps[i]*steps[j])
+    return hess
+
+def fit(hist, model, initial, limits, range_low, range_high, integral=False, maxiter=5000):
+    '''
+    Minimize the binned Poisson likelihood of model to the bins of hist whose
+    centers are inside [range_low, range_high]
+
+    initial: list of starting parameters
+    limits:  list of (low, high) or None per parameter, as set by SetParLimits
+
+    Returns a FitResult
+    '''
+    lows, widths, contents = hist_arrays(hist)
+    centers = lows + widths/2.0
+    in_range = (centers >= range_low) & (centers <= range_high)
+    lows, widths, contents = lows[in_range], widths[in_range], contents[in_range]
+
+    initial = np.array(initial, dtype=float)
+    free = np.array([lim is None or lim[0] < lim[1] for lim in limits])
+    x0 = initial.copy()
+    bounds = []
+    for i, lim in enumerate(limits):
+        if lim is None: continue
+        x0[i] = lim[0] if not free[i] else min(max(x0[i], lim[0]), lim[1])
+
+    # work in units of the starting values so norms and slopes are comparable
+    scale = np.where(np.abs(x0) > 1e-3, np.abs(x0), 1.0)
+    for i, lim in enumerate(limits):
+        if not free[i]: continue
+        if lim is None: bounds.append((None, None))
+        else: bounds.append((lim[0]/scale[i], lim[1]/scale[i]))
+
+    ncalls = [0]
+    def to_params(u):
+        p = x0.copy()
+        p[free] = u * scale[free]
+        return p
+    def fcn(u):
+        ncalls[0] += 1
+        val = poisson_nll(evaluate(model, to_params(u), lows, widths, integral), contents)
+        return val if np.isfinite(val) else 1e300
+
+    u0 = x0[free] / scale[free]
+    from scipy.optimize import minimize
+    res = minimize(fcn, u0, method='L-BFGS-B', bounds=bounds, options={'maxiter': maxiter})
+    u = res.x
+    params = to_params(u)
+
+    npar = len(params)
+    covariance = np.zeros((npar, npar))
+    errors = np.zeros(npar)
+    edm = 0.0
+    status = 0 if res.success else 4
+    try:
+        hess = _hessian(fcn, u, np.maximum(np.abs(u), 1.0) * 1e-4)
+        cov_u = np.linalg.inv(hess)
+        cov_free = cov_u * np.outer(scale[free], scale[free])
+        idx = np.where(free)[0]
+        covariance[np.ix_(idx, idx)] = cov_free
+        errors[idx] = np.sqrt(np.abs(np.diag(cov_free)))
+        grad = np.asarray(getattr(res, 'jac', np.zeros(len(u))))
+        edm = 0.5 * float(grad.dot(cov_u).dot(grad))
+    except np.linalg.LinAlgError:
+        status = 1 if status == 0 else status
+
+    ndf = int(len(contents) - free.sum())
+    return FitResult(params, errors, covariance, float(res.fun), ndf, status, edm, ncalls[0])
+
+def attach_function(hist, tf1):
+    '''
+    Store a copy of tf1 in the list of functions of hist, like hist.Fit(tf1, '0')
+    does, so stat boxes and later GetFunction() calls see the fit
+    '''
+    functions = hist.GetListOfFunctions()
+    for obj in list(functions):
+        if obj.InheritsFrom('TF1'): functions.Remove(obj)
+    copy = tf1.Clone()
+    copy.SetBit(ROOT.TF1.kNotDraw)
+    functions.Add(copy)
+
+def fit_tf1(hist, tf1, model, range_low, range_high, integral=False):
+    '''
+    Fit hist with the vectorized version (model) of the TF1 built by
+    fit_hist(), starting from the TF1's parameters and respecting its limits
+
+    The TF1 is updated with the fitted parameters, errors, chi2 and ndf
+    Returns a FitResult
+    '''
+    npar = tf1.GetNpar()
+    initial = [tf1.GetParameter(i) for i in range(npar)]
+    limits = [par_limits(tf1, i) for i in range(npar)]
+    result = fit(hist, model, initial, limits, range_low, range_high, integral=integral)
+    for i in range(npar):
+        tf1.SetParameter(i, result.Parameter(i))
+        tf1.SetParError(i, result.ParError(i))
+    tf1.SetChisquare(result.Chi2())
+    tf1.SetNDF(result.Ndf())
+    attach_function(hist, tf1)
+    return result